@@ -3,49 +3,87 @@ for basics operations on the database e.g. opening, reading or writing
 data to the database.
 """
 
-import functools
+import copy
+import gzip
 import io
 import json
+import lzma
 import os
+import re
+import stat
+import tempfile
+import threading
+from collections import OrderedDict
 from pathlib import Path
 from urllib.parse import urlparse
 
-from requests import Request, Session
+from requests import RequestException, Session
+from requests.adapters import HTTPAdapter
 
+from django_no_sql.db import json_codecs
 from django_no_sql.db import errors as django_no_sql_errors
+from django_no_sql.db.storage import MappedRecords
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+NUMBER_TAIL = re.compile(r'[0-9.eE+-]*')
+
+# The extensions of the files that can be used
+# as a database and the modules used to
+# decompress the compressed ones
+DATABASE_SUFFIXES = ['.json', '.json.gz', '.json.xz']
+
+COMPRESSIONS = {
+    '.gz': gzip,
+    '.xz': lzma
+}
+
+
+def get_compression(path):
+    """Returns the module used to (de)compress the
+    database file or None if it is not compressed"""
+    for suffix, module in COMPRESSIONS.items():
+        if str(path).endswith(suffix):
+            return module
+    return None
+
+
+def open_database(path, mode='r'):
+    """
+    Opens a database file for reading as text. Compressed files
+    are decompressed while they are being read
+    """
+    compression = get_compression(path)
+    if compression is None:
+        return open(path, mode, encoding='utf-8')
+    return compression.open(path, mode.replace('t', '') + 't', encoding='utf-8')
+
 
 def _search_for_database(path):
     base, _, files = list(os.walk(path))[0]
     registry = []
     for item in files:
-        if item.startswith('database') and item.endswith('json'):
+        if item.startswith('database') and item.endswith(tuple(DATABASE_SUFFIXES)):
             registry.append((base, item, os.path.join(base, item)))
+    # Sort the files so that the shards of a
+    # database are always loaded in the same order
+    registry.sort(key=lambda entry: entry[1])
     if len(registry) == 1:
         return registry[0]
     return registry
 
 
-def _check_path(path_or_url):
+def _check_path(path_or_url, key=None):
     """
     Checks if the path of the database exists or is a url
     """
-    if not path_or_url.endswith('.json'):
+    if not path_or_url.endswith(tuple(DATABASE_SUFFIXES)):
         raise django_no_sql_errors.DatabaseError('The file you are trying to access is not of type JSON')
 
     starts_with_http = any([path_or_url.startswith('http'), \
                                 path_or_url.startswith('https')])
     if starts_with_http:
-        session = Session()
-        with session as s:
-            request = Request('GET', url=path_or_url)
-
-            session.verify = True
-            session.headers.update({})
-
-            response = session.send(session.prepare_request(request))
-
-            if response.status_code == 200:
-                return response.json()
+        return remote_reader.read(path_or_url, key=key)
     else:
         path_exists = os.path.exists(path_or_url)
         if not path_exists:
@@ -53,10 +91,609 @@ def _check_path(path_or_url):
         return Path(path_or_url)
 
 
-@functools.lru_cache
-def file_reader(path_or_url, mode='r', is_dir=False):
+def is_url(path_or_url):
+    """Checks whether the database should be fetched over HTTP"""
+    return str(path_or_url).startswith(('http://', 'https://'))
+
+
+def resolve_path(path_or_url, is_dir=False):
+    """
+    Returns the path of the database file to open from
+    either a direct path or a directory to search in
+    """
+    if is_dir:
+        path_or_url = _search_for_database(path_or_url)
+    else:
+        path_or_url = _check_path(path_or_url)
+    if not path_or_url:
+        raise django_no_sql_errors.DatabaseError('We could not find a database to open. A you sure the database exists and is at the root or your project?')
+    if isinstance(path_or_url, list):
+        raise django_no_sql_errors.DatabaseError(f'{len(path_or_url)} database files were found. Load them as the shards of a single database')
+    if isinstance(path_or_url, tuple):
+        path_or_url = path_or_url[2]
+    return path_or_url
+
+
+def resolve_shards(path):
+    """
+    Returns the paths of all the database files found in
+    the directory. Each file is a shard of the same database
+    """
+    registry = _search_for_database(path)
+    if isinstance(registry, tuple):
+        registry = [registry]
+    return [entry[2] for entry in registry]
+
+
+class StreamReader:
     """
-    A function used to open a JSON database file
+    Incrementally parses a JSON database file so that the records
+    of the data section can be consumed one by one instead of
+    loading the whole document in memory with json.load
+
+    Description
+    -----------
+
+        Iterating over the reader yields each (id, record) pair of the
+        data section as soon as it is parsed. The other sections of the
+        file (title, properties...) are collected in the schema attribute
+        which is complete once the iteration is over.
+
+    Parameters
+    ----------
+
+        path_or_url (str): path to the file
+        key (str, optional): the key of the data section. Defaults to 'data'.
+        is_dir (bool, optional): whether the path is a dir. Defaults to False.
+        chunk_size (int, optional): the number of characters to read at once
+        fileobj (obj, optional): an open text file to read from instead of the path
+
+    Example
+    -------
+
+        reader = StreamReader('path/to/database.json')
+        for record_id, record in reader:
+            ...
+        reader.schema -> {title: ..., properties: ...}
+    """
+    chunk_size = 65536
+
+    def __init__(self, path_or_url=None, key=None, is_dir=False, chunk_size=None, fileobj=None):
+        self.fileobj = fileobj
+        self.path = None if fileobj is not None else resolve_path(path_or_url, is_dir=is_dir)
+        self.key = key or 'data'
+        if chunk_size:
+            self.chunk_size = chunk_size
+        self.schema = {}
+        # Whether the document contained
+        # the data section
+        self.has_data = False
+
+        self._decoder = json.JSONDecoder()
+        self._fp = None
+        self._buffer = ''
+        self._position = 0
+        self._eof = False
+
+    def __iter__(self):
+        self.schema = {}
+        self._buffer = ''
+        self._position = 0
+        self._eof = False
+        self.has_data = False
+        if self.fileobj is not None:
+            self._fp = self.fileobj
+            yield from self._parse()
+        else:
+            with open_database(self.path) as fp:
+                self._fp = fp
+                yield from self._parse()
+        self._fp = None
+        if not self.schema:
+            raise django_no_sql_errors.SchemaError('The database you are trying to load is empty or does not contain a valid schema')
+
+    def _parse(self):
+        self._expect('{')
+        if self._peek() == '}':
+            return
+        while True:
+            name = self._read_value()
+            self._expect(':')
+            if name == self.key:
+                self.has_data = True
+                yield from self._parse_records()
+            else:
+                self.schema[name] = self._read_value()
+            if self._next_token() == '}':
+                break
+
+    def _parse_records(self):
+        self._expect('{')
+        if self._peek() == '}':
+            self._position += 1
+            return
+        while True:
+            record_id = self._read_value()
+            self._expect(':')
+            yield record_id, self._read_value()
+            if self._next_token() == '}':
+                break
+
+    def _fill(self, size=None):
+        """Reads the next chunk of the file into the buffer
+        and drops the part that was already consumed"""
+        chunk = self._fp.read(size or self.chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._position:] + chunk
+        self._position = 0
+        return True
+
+    def _skip_whitespace(self):
+        while True:
+            self._position = WHITESPACE.match(self._buffer, self._position).end()
+            if self._position < len(self._buffer) or not self._fill():
+                return
+
+    def _peek(self):
+        self._skip_whitespace()
+        return self._buffer[self._position:self._position + 1]
+
+    def _next_token(self):
+        token = self._peek()
+        if not token:
+            raise django_no_sql_errors.DatabaseError('The file you are trying to open could not be read')
+        self._position += 1
+        return token
+
+    def _expect(self, token):
+        if self._next_token() != token:
+            raise django_no_sql_errors.DatabaseError('The file you are trying to open could not be read')
+
+    def _is_partial_number(self, value, end):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return False
+        return NUMBER_TAIL.fullmatch(self._buffer, end) is not None
+
+    def _read_value(self):
+        self._skip_whitespace()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._position)
+            except json.JSONDecodeError:
+                # The value is incomplete: read a larger
+                # chunk each time so that very large records
+                # do not get decoded over and over again
+                if not self._fill(max(self.chunk_size, len(self._buffer))):
+                    raise django_no_sql_errors.DatabaseError('The file you are trying to open could not be read')
+                continue
+            # A number followed by nothing but number characters
+            # up to the end of the buffer might continue in the
+            # next chunk e.g. 12|34 or 1603123456.|789
+            if self._is_partial_number(value, end) and not self._eof and self._fill():
+                continue
+            self._position = end
+            return value
+
+
+class RemoteReader:
+    """
+    Loads databases over HTTP using a pooled session
+
+    Description
+    -----------
+
+        The ETag and Last-Modified headers of each response are kept
+        with the parsed data so that the next request for the same url
+        is conditional: when the server answers 304 Not Modified, the
+        cached data is returned without downloading anything. Bodies
+        are requested with gzip and are decompressed while they are
+        streamed into the parser. As with file_reader, the records are
+        shared with the cache and the rest of the schema is copied.
+
+    Parameters
+    ----------
+
+        pool_size (int, optional): the number of connections to keep per host
+        timeout (int, optional): the number of seconds to wait for the server
+
+    Example
+    -------
+
+        reader = RemoteReader()
+        reader.read('https://example.com/database.json') -> {title: ...}
+        reader.stats -> {requests: 1, not_modified: 0, ...}
+    """
+    pool_size = 10
+    timeout = 30
+
+    def __init__(self, pool_size=None, timeout=None):
+        if pool_size is not None:
+            self.pool_size = pool_size
+        if timeout is not None:
+            self.timeout = timeout
+
+        self.session = Session()
+        self.session.verify = True
+        self.session.headers.update({
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip, deflate'
+        })
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.requests = 0
+        self.not_modified = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}(entries={len(self._entries)})>'
+
+    @property
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'not_modified': self.not_modified,
+            'entries': len(self._entries)
+        }
+
+    def read(self, url, key=None):
+        """
+        Returns the parsed database located at the url
+
+        Parameters
+        ----------
+
+            url (str): the url of the JSON file
+            key (str, optional): the key of the data section. Defaults to 'data'.
+        """
+        headers = {}
+        with self._lock:
+            entry = self._entries.get(url)
+        if entry is not None:
+            etag, last_modified, _ = entry
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        try:
+            response = self.session.get(url, headers=headers, stream=True, timeout=self.timeout)
+        except RequestException as error:
+            raise django_no_sql_errors.DatabaseError(f'The remote database could not be reached: {error}')
+
+        with response:
+            self.requests = self.requests + 1
+            if response.status_code == 304 and entry is not None:
+                self.not_modified = self.not_modified + 1
+                return copy_schema(entry[2], key=key or 'data')
+
+            if response.status_code != 200:
+                raise django_no_sql_errors.DatabaseError(f'The remote database could not be loaded. Got status code {response.status_code}')
+
+            # Let urllib3 decompress the body while
+            # the parser reads it from the socket
+            response.raw.decode_content = True
+            body = response.raw
+            compression = get_compression(urlparse(url).path)
+            if compression is not None and response.headers.get('Content-Encoding') is None:
+                body = compression.open(body, 'rb')
+            reader = StreamReader(key=key, fileobj=io.TextIOWrapper(body, encoding='utf-8'))
+            records = dict(reader)
+            raw_data = reader.schema
+            if reader.has_data:
+                raw_data[reader.key] = records
+
+        validators = (response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        with self._lock:
+            if any(validators):
+                self._entries[url] = (*validators, raw_data)
+            else:
+                self._entries.pop(url, None)
+        return copy_schema(raw_data, key=key or 'data')
+
+    def invalidate(self, url=None):
+        """Forgets the cached data of the url or of all the urls"""
+        with self._lock:
+            if url is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(url, None)
+        return True
+
+
+remote_reader = RemoteReader()
+
+
+def _fsync_directory(directory):
+    """Makes sure that a rename in the directory is persisted"""
+    try:
+        descriptor = os.open(directory, os.O_RDONLY)
+    except OSError:
+        # Directories cannot be opened on
+        # Windows in which case there is
+        # nothing to synchronize
+        return
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def _dump_database(schema, records, key, f, pretty=False):
+    """Writes the schema and each record one by one so that
+    the whole data section never has to be built as a dict"""
+    names = list(schema.keys())
+    if key not in names:
+        names.append(key)
+
+    if pretty:
+        member, indent, nested_indent = '\n    ', '\n    ', '\n        '
+    else:
+        member, indent, nested_indent = '', '', ''
+    separator = ': ' if pretty else ':'
+
+    f.write('{')
+    for position, name in enumerate(names):
+        f.write(',' + member if position else member)
+        f.write(json_codecs.dumps(name) + separator)
+        if name == key:
+            f.write('{')
+            is_empty = True
+            for record_id, record in records:
+                f.write(nested_indent if is_empty else ',' + nested_indent)
+                f.write(json_codecs.dumps(str(record_id)) + separator)
+                f.write(json_codecs.dumps(record, pretty=pretty).replace('\n', nested_indent))
+                is_empty = False
+            f.write('}' if is_empty else indent + '}')
+        else:
+            f.write(json_codecs.dumps(schema[name], pretty=pretty).replace('\n', indent))
+    f.write('\n}' if pretty else '}')
+
+
+def _file_mode(path):
+    """Returns the permissions of the file or the default
+    ones of a new file when it does not exist yet"""
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        # The umask can only be read by changing it
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def write_database(path, schema, records=None, key='data', pretty=False):
+    """
+    Atomically writes a database file. The data is written to a temporary
+    file in the same directory which then replaces the database once it
+    was fully written and synchronized to the disk. A crash during the
+    write therefore leaves the previous version of the file untouched.
+    The new file keeps the permissions of the one it replaces. Paths
+    ending with .gz or .xz are compressed while they are written
+
+    Parameters
+    ----------
+
+        path (str): path to the file
+        schema (dict): the schema of the database
+        records (iterable, optional): (id, record) pairs to write in the data
+        section instead of the one contained in the schema itself
+        key (str, optional): the key of the data section. Defaults to 'data'.
+        pretty (bool, optional): indent the JSON. Defaults to False.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    mode = _file_mode(path)
+    descriptor, temporary_path = tempfile.mkstemp(prefix='.database-', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(descriptor, 'wb') as raw:
+            compression = get_compression(path)
+            if compression is gzip:
+                compressor = gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6)
+            elif compression is lzma:
+                compressor = lzma.LZMAFile(raw, mode='wb')
+            else:
+                compressor = None
+
+            f = io.TextIOWrapper(compressor or raw, encoding='utf-8')
+            if records is None:
+                json_codecs.dump(schema, f, pretty=pretty)
+            else:
+                _dump_database(schema, records, key, f, pretty=pretty)
+            f.flush()
+            # Detach the text layer so that closing it does
+            # not close the file before it is synchronized
+            f.detach()
+            if compressor is not None:
+                compressor.close()
+            raw.flush()
+            os.fsync(raw.fileno())
+        # The temporary file is only readable by its owner
+        os.chmod(temporary_path, mode)
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+    finally:
+        file_cache.invalidate(path)
+    _fsync_directory(directory)
+    return True
+
+
+def map_reader(path_or_url, key=None, is_dir=False):
+    """
+    Memory maps a local JSON database file and returns its records
+    as a lazy sequence that only decodes the records that are accessed
+
+    Parameters
+    ----------
+
+        path_or_url (str): path to the file
+        key (str, optional): the key of the data section. Defaults to 'data'.
+        is_dir (bool, optional): whether the path is a dir. Defaults to False.
+    """
+    if is_url(path_or_url):
+        raise django_no_sql_errors.DatabaseError('Only local databases can be memory mapped')
+    path = resolve_path(path_or_url, is_dir=is_dir)
+    if get_compression(path) is not None:
+        raise django_no_sql_errors.DatabaseError('Compressed databases cannot be memory mapped')
+    return MappedRecords(path, key=key)
+
+
+class FileCache:
+    """
+    A bounded cache of the parsed database files
+
+    Description
+    -----------
+
+        Each entry is validated against the modification time, the size
+        and the inode of the file so that a file that was changed on disk
+        is parsed again. The size of the decoded JSON, which can be much
+        larger than a compressed file, is used as the cost of each entry:
+        when the total exceeds max_bytes, the least recently used entries
+        are evicted. Our own writes invalidate their path.
+
+    Parameters
+    ----------
+
+        max_bytes (int, optional): the total decoded size of the files that can be cached
+
+    Example
+    -------
+
+        cache = FileCache(max_bytes=1048576)
+        cache.set('path/to/database.json', data, size=len(text))
+        cache.get('path/to/database.json') -> data
+        cache.stats -> {hits: 1, misses: 0, ...}
+    """
+    max_bytes = 256 * 1024 * 1024
+
+    def __init__(self, max_bytes=None):
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}(entries={len(self._entries)}, bytes={self.current_bytes})>'
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _key(path):
+        return os.path.abspath(str(path))
+
+    @staticmethod
+    def signature(path):
+        """Returns the values that change when the file is modified"""
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    @property
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes
+        }
+
+    def get(self, path):
+        """Returns the cached data of the file or None when the
+        file is not cached or was modified since it was cached"""
+        key = self._key(path)
+        try:
+            signature = self.signature(key)
+        except OSError:
+            signature = None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(key)
+                self.hits = self.hits + 1
+                return entry[2]
+
+            self.misses = self.misses + 1
+            if entry is not None:
+                self._remove(key)
+        return None
+
+    def set(self, path, data, size=None):
+        """Caches the data of the file. The size defaults
+        to the size of the file on disk"""
+        key = self._key(path)
+        signature = self.signature(key)
+        if size is None:
+            size = signature[1]
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return False
+            self._entries[key] = (signature, size, data)
+            self.current_bytes = self.current_bytes + size
+            while self.current_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions = self.evictions + 1
+        return True
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.current_bytes = self.current_bytes - size
+
+    def invalidate(self, path):
+        """Removes the file from the cache"""
+        key = self._key(path)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                return True
+        return False
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+        return True
+
+
+file_cache = FileCache()
+
+
+def copy_schema(raw_data, key='data'):
+    """Returns a copy of the parsed file where everything but the
+    records can be changed without changing the cached file"""
+    return {name: value if name == key else copy.deepcopy(value) for name, value in raw_data.items()}
+
+
+def file_reader(path_or_url, mode='r', is_dir=False, key='data'):
+    """
+    A function used to open a JSON database file. The parsed
+    files are kept in the module's file_cache until they
+    are modified on disk
+
+    Description
+    -----------
+
+        The records under `key` are shared with the cache and should
+        be replaced instead of being changed in place. The rest of
+        the schema is copied each time the file is read
 
     Parameters
     ----------
@@ -64,6 +701,7 @@ def file_reader(path_or_url, mode='r', is_dir=False):
         path_or_url (str): path to the file
         mode (str, optional): the default mode to open the file with. Defaults to 'r'.
         is_dir (bool, optional): whether the path is a dir. Defaults to False.
+        key (str, optional): the key of the records. Defaults to 'data'.
 
     Raises
     ------
@@ -74,20 +712,21 @@ def file_reader(path_or_url, mode='r', is_dir=False):
     Returns:
         [type]: [description]
     """
-    if is_dir:
-        path_or_url = _search_for_database(path_or_url)
-    else:
-        path_or_url = _check_path(path_or_url)
-    if not path_or_url:
-        raise django_no_sql_errors.DatabaseError('We could not find a database to open. A you sure the database exists and is at the root or your project?')
-    if isinstance(path_or_url, tuple):
-        path_or_url = path_or_url[2]        
+    if is_url(path_or_url):
+        return _check_path(path_or_url, key=key)
+    path_or_url = resolve_path(path_or_url, is_dir=is_dir)
+
+    raw_data = file_cache.get(path_or_url)
+    if raw_data is not None:
+        return copy_schema(raw_data, key=key)
 
-    with open(path_or_url, mode, encoding='utf-8') as db:
+    with open_database(path_or_url, mode) as db:
+        text = db.read()
         try:
-            raw_data = json.load(db)
-        except json.JSONDecodeError:
+            raw_data = json_codecs.loads(text)
+        except ValueError:
             raise django_no_sql_errors.DatabaseError('The file you are trying to open could not be read')
         if not raw_data:
             raise django_no_sql_errors.SchemaError('The database you are trying to load is empty or does not contain a valid schema')
-        return raw_data
+    file_cache.set(path_or_url, raw_data, size=len(text))
+    return copy_schema(raw_data, key=key)
@@ -0,0 +1,132 @@
+"""A module that implements the cache of the results of the
+queries of a manager
+"""
+
+import sys
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    A bounded cache of the results of the queries that were run on
+    the records of a database
+
+    Description
+    -----------
+
+        Each result is stored with the write version of the records it was
+        computed from. The first lookup that sees another version clears
+        the whole cache since any write can change the result of any query.
+
+        When the number of entries exceeds max_entries or their estimated
+        size exceeds max_bytes, the least recently used entries are evicted.
+        The records of a result are shared with the database so only the
+        lists and the records that were projected count towards their size.
+
+    Parameters
+    ----------
+
+        max_entries (int, optional): the number of results that can be cached
+        max_bytes (int, optional): the estimated total size of the results
+
+    Example
+    -------
+
+        cache = ResultCache(max_entries=128)
+        cache.set(key, records.version, result)
+        cache.get(key, records.version) -> result
+        cache.stats -> {hits: 1, misses: 0, hit_ratio: 1.0, ...}
+    """
+    max_entries = 256
+    max_bytes = 64 * 1024 * 1024
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        if max_entries is not None:
+            self.max_entries = max_entries
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        self.version = None
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}(entries={len(self._entries)}, bytes={self.current_bytes})>'
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes
+        }
+
+    @staticmethod
+    def size_of(result, projected=False):
+        """Estimates the memory used by a result"""
+        size = sys.getsizeof(result)
+        if projected:
+            size = size + sum(sys.getsizeof(record) for record in result)
+        return size
+
+    def _check_version(self, version):
+        if version != self.version:
+            if self._entries:
+                self.invalidations = self.invalidations + 1
+            self._entries.clear()
+            self.current_bytes = 0
+            self.version = version
+
+    def get(self, key, version):
+        """Returns the cached result of the query or None when it
+        is not cached or the records were written to since"""
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses = self.misses + 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits = self.hits + 1
+            return entry[1]
+
+    def set(self, key, version, result, projected=False):
+        size = self.size_of(result, projected=projected)
+        with self._lock:
+            self._check_version(version)
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return False
+            self._entries[key] = (size, result)
+            self.current_bytes = self.current_bytes + size
+            while len(self._entries) > self.max_entries or self.current_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions = self.evictions + 1
+        return True
+
+    def _remove(self, key):
+        size, _ = self._entries.pop(key)
+        self.current_bytes = self.current_bytes - size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+        return True
@@ -1,14 +1,18 @@
 import collections
 import datetime
 import functools
-import json
 import os
 import secrets
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from importlib import import_module
 
 from django_no_sql.db import backends
 from django_no_sql.db import errors as django_no_sql_errors
 from django_no_sql.db.managers import Manager
+from django_no_sql.db.storage import MappedRecords, RecordStore
+from django_no_sql.db.wal import Compactor, WriteAheadLog
 
 
 class Database:
@@ -61,12 +65,53 @@ class Database:
 
     _default_manager = None
 
-    def __init__(self, path_or_url=None, import_name=None):
+    # Whether the files written by the database
+    # are indented as opposed to compact JSON
+    pretty_print = False
+
+    # The different ways the data of the
+    # database can be loaded: 'memory' parses the
+    # whole file at once, 'stream' parses the records
+    # of the data section one by one and 'mmap' maps
+    # the file and only decodes the records on access
+    load_modes = ['memory', 'stream', 'mmap']
+
+    # The field of the records used to choose the
+    # shard a new record is written to when the
+    # database is split in several files. The id
+    # of the record is used when it is not set
+    shard_key = None
+
+    # The maximum number of shards that are
+    # loaded at the same time
+    shard_workers = 8
+
+    def __init__(self, path_or_url=None, import_name=None, mode='memory', shard_key=None):
         self.path_or_url = path_or_url
         if import_name:
             dir_path = os.path.abspath(os.path.dirname(import_name))
             self.import_name = dir_path
 
+        if mode not in self.load_modes:
+            raise django_no_sql_errors.DatabaseError(f'"{mode}" is not a valid loading mode. Use one of: {", ".join(self.load_modes)}')
+        self.mode = mode
+        self.data_key = 'data'
+        self.record_ids = []
+        if shard_key is not None:
+            self.shard_key = shard_key
+        self.shards = []
+        self._shard_of = {}
+
+        self.schema = None
+        self.database_path = None
+        self.write_log = None
+        self.compactor = None
+        self._last_id = 0
+        self._write_lock = threading.RLock()
+        # The entries that were queued in a write ahead
+        # log and are applied once they are written
+        self._unapplied = collections.deque()
+
     def __repr__(self):
         return f'<{self.__class__.__name__}(loaded={self.database_loaded})>'
 
@@ -83,6 +128,7 @@ class Database:
         if name == 'manager':
             if not self.database_loaded:
                 raise django_no_sql_errors.ManagerLoadingError()
+            return self._default_manager
         return name
 
     def load_database(self, key=None):
@@ -95,17 +141,163 @@ class Database:
         ----------
         
             key (str): The main entrypoint to your database data
+
+        Returns
+        -------
+
+            dict: the schema of the database. When the database is
+            loaded in 'stream' mode, the data section is not included.
+            When the database is split in several files, the schema
+            of the first shard is returned
         """
-        if self.path_or_url:
-            raw_data = backends.file_reader(path_or_url=self.path_or_url)
+        self.data_key = key or 'data'
+        shard_paths = self._find_shards()
+        if len(shard_paths) > 1:
+            raw_data = self._load_shards(shard_paths)
         else:
-            raw_data = backends.file_reader(path_or_url=self.import_name, is_dir=True)
-        self._check_schema(raw_data)
-        self.database_loaded = True
-        self.loaded_json_data = self.transform_data(raw_data, key=key)
+            if isinstance(self.path_or_url, (list, tuple)):
+                self.path_or_url = shard_paths[0] if shard_paths else None
+            self.shards = []
+            raw_data = self._load_file()
         self.set_database_class(data_to_use=raw_data)
         return raw_data
 
+    def _load_file(self, key=None):
+        """Loads the records of a single database file
+        and replays its write ahead log"""
+        if key is not None:
+            self.data_key = key
+        key = self.data_key
+        if self.mode == 'stream' and not backends.is_url(self.path_or_url or ''):
+            raw_data = self._stream_database()
+        elif self.mode == 'mmap':
+            raw_data = self._map_database()
+        else:
+            if self.path_or_url:
+                raw_data = backends.file_reader(path_or_url=self.path_or_url, key=key)
+            else:
+                raw_data = backends.file_reader(path_or_url=self.import_name, is_dir=True, key=key)
+            self._check_schema(raw_data)
+            self.database_loaded = True
+            self.loaded_json_data = self.transform_data(raw_data, key=key)
+            self.record_ids = self.loaded_json_data.ids
+        self.schema = raw_data
+        self._replay_write_log()
+        return raw_data
+
+    def _find_shards(self):
+        """Returns the paths of the database files when
+        the database is split in several of them"""
+        if isinstance(self.path_or_url, (list, tuple)):
+            return [str(path) for path in self.path_or_url]
+        if self.path_or_url:
+            return []
+        try:
+            return backends.resolve_shards(self.import_name)
+        except (OSError, IndexError):
+            return []
+
+    def _load_shards(self, paths):
+        """
+        Loads each database file as a shard of this database on a thread
+        pool. The records of the shards are then chained in a single list
+        so that the manager queries all of them at once
+
+        Returns
+        -------
+
+            dict: the schema of the first shard
+        """
+        if self.mode == 'mmap':
+            raise django_no_sql_errors.DatabaseError('A database split in several files cannot be loaded in mmap mode')
+
+        for shard in self.shards:
+            if shard.write_log is not None:
+                shard.write_log.close()
+        self.shards = [Database(path_or_url=path, mode=self.mode) for path in paths]
+
+        workers = min(len(self.shards), self.shard_workers)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            schemas = list(executor.map(lambda shard: shard._load_file(self.data_key), self.shards))
+
+        records = []
+        record_ids = []
+        self._shard_of = {}
+        for shard in self.shards:
+            for record_id in shard.record_ids:
+                if record_id in self._shard_of:
+                    raise django_no_sql_errors.DatabaseError(f'The record "{record_id}" is present in more than one shard')
+                self._shard_of[record_id] = shard
+            record_ids.extend(shard.record_ids)
+            records.extend(shard.loaded_json_data)
+        self.loaded_json_data = RecordStore(records, record_ids)
+        self.record_ids = self.loaded_json_data.ids
+
+        self._last_id = max(shard._last_id for shard in self.shards)
+        self.database_path = None
+        self.write_log = None
+        self.database_loaded = True
+        self.schema = schemas[0]
+        return self.schema
+
+    def _get_shard(self, operation, record_id, payload):
+        """
+        Returns the shard that stores the record. New records are
+        routed with a stable hash of their shard key so that the same
+        value always lands in the same file
+        """
+        shard = self._shard_of.get(record_id)
+        if shard is not None or operation != 'insert':
+            return shard
+
+        value = record_id
+        if self.shard_key is not None:
+            value = payload['record'].get(self.shard_key, record_id)
+        index = zlib.crc32(str(value).encode('utf-8')) % len(self.shards)
+        return self.shards[index]
+
+
+    def _stream_database(self):
+        """
+        Loads the records of the data section one by one using
+        the backend's StreamReader so that the whole file never
+        has to sit in memory next to the list of records
+        """
+        if self.path_or_url:
+            reader = backends.StreamReader(self.path_or_url, key=self.data_key)
+        else:
+            reader = backends.StreamReader(self.import_name, key=self.data_key, is_dir=True)
+
+        # The store is filled in place: it is the same
+        # object that the manager uses as its data
+        self.loaded_json_data = records = RecordStore()
+        self.record_ids = records.ids
+        for record_id, record in reader:
+            records.put(record_id, record)
+
+        self._check_schema(reader.schema)
+        self.database_loaded = True
+        return reader.schema
+
+    def _map_database(self):
+        """
+        Memory maps the database file. The records are indexed
+        once and are only decoded when a query accesses them
+        """
+        if isinstance(self.loaded_json_data, MappedRecords):
+            self.loaded_json_data.close()
+
+        if self.path_or_url:
+            records = backends.map_reader(self.path_or_url, key=self.data_key)
+        else:
+            records = backends.map_reader(self.import_name, key=self.data_key, is_dir=True)
+
+        self._check_schema(records.schema)
+        self.database_loaded = True
+        self.loaded_json_data = records
+        self.record_ids = records.ids
+        return records.schema
+
     def set_database_class(self, data_to_use=None, **kwargs):
         """
         Defines the different properties of the class with
@@ -177,7 +369,8 @@ class Database:
         return True
     
     def _update_schema(self, schema, field, value):
-        """Updates specific fields of the database schema
+        """Updates specific fields of the database schema. The change
+        is appended to the write ahead log instead of rewriting the file
         
         Parameters
         ----------
@@ -192,7 +385,14 @@ class Database:
         if field not in allowed_fields:
             pass
 
-        with open(self.path_or_url, 'w', encoding='utf-8') as db:
+        if self.shards:
+            # Each shard keeps its own copy of the schema
+            for shard in self.shards:
+                shard._update_schema(shard.schema, field, value)
+            return True
+
+        write_log = self._get_write_log()
+        with self._write_lock:
             try:
                 schema[field] = value
             except (KeyError, django_no_sql_errors.SchemaUpdataError):
@@ -200,7 +400,217 @@ class Database:
             else:
                 schema['version'] = schema['version'] + 1
                 schema['modified_on'] = str(datetime.datetime.now())
-                json.dump(schema, db, indent=4)
+                ticket = write_log.enqueue('schema', field=field, value=value,
+                                    version=schema['version'], modified_on=schema['modified_on'])
+        write_log.wait(ticket)
+        return True
+
+    def _get_write_log(self):
+        """Returns the write ahead log of the database file"""
+        if self.write_log is None:
+            if not self.database_path:
+                raise django_no_sql_errors.DatabaseError('Only local databases that were loaded can be written to')
+            self.write_log = WriteAheadLog(self.database_path)
+        return self.write_log
+
+    def _replay_write_log(self):
+        """
+        Applies the entries of the write ahead log, that were not yet
+        written to the JSON file, on top of the loaded data
+        """
+        if self.write_log is not None:
+            self.write_log.close()
+            self.write_log = None
+        self._unapplied.clear()
+
+        if backends.is_url(self.path_or_url or ''):
+            self.database_path = None
+            return False
+
+        if self.path_or_url:
+            self.database_path = str(backends.resolve_path(self.path_or_url))
+        else:
+            self.database_path = str(backends.resolve_path(self.import_name, is_dir=True))
+
+        numeric_ids = [int(record_id) for record_id in self.record_ids if str(record_id).isdigit()]
+        self._last_id = max(numeric_ids, default=0)
+
+        for entry in self._get_write_log().entries():
+            self._apply_entry(entry)
+        return True
+
+    def _apply_entry(self, entry):
+        """Applies a single entry of the write ahead log
+        to the loaded records or to the schema"""
+        operation = entry['op']
+        if operation == 'schema':
+            self.schema[entry['field']] = entry['value']
+            # A compaction that did not complete can replay
+            # entries that are older than the snapshot
+            self.schema['version'] = max(self.schema.get('version', 0), entry['version'])
+            self.schema['modified_on'] = entry['modified_on']
+        elif operation == 'insert':
+            self._set_record(entry['id'], entry['record'])
+        elif operation == 'update':
+            record = self.get_record(entry['id'])
+            if record is not None:
+                # Create a new dict as opposed to updating the
+                # record in place since the original one can be
+                # shared with the backend's cache
+                self._set_record(entry['id'], {**record, **entry['fields']})
+        elif operation == 'delete':
+            self._remove_record(entry['id'])
+
+    def get_record(self, record_id):
+        """Returns the record stored under the given id or None"""
+        return self.loaded_json_data.get(str(record_id))
+
+    def _set_record(self, record_id, record):
+        record_id = str(record_id)
+        if record_id.isdigit():
+            self._last_id = max(self._last_id, int(record_id))
+        return self.loaded_json_data.put(record_id, record)
+
+    def _remove_record(self, record_id):
+        return self.loaded_json_data.delete(str(record_id))
+
+    def _capture_records(self):
+        """Returns the (id, record) pairs of the current records
+        without copying or decoding the records themselves"""
+        return self.loaded_json_data.items()
+
+    def compact(self):
+        """Folds the write ahead log into a new snapshot of the
+        database file and returns the timings of the compaction"""
+        if self.shards:
+            return [shard.compact() for shard in self.shards]
+        if self.compactor is None:
+            self.compactor = Compactor(self)
+        return self.compactor.compact()
+
+    def start_compaction(self, max_bytes=None, max_age=None, interval=None):
+        """
+        Starts a background thread that compacts the write ahead
+        log when it exceeds max_bytes or when its oldest entry is
+        older than max_age seconds
+        """
+        if self.shards:
+            return [shard.start_compaction(max_bytes=max_bytes, max_age=max_age, interval=interval) \
+                        for shard in self.shards]
+        if self.compactor is not None:
+            self.compactor.stop()
+        self.compactor = Compactor(self, max_bytes=max_bytes, max_age=max_age, interval=interval)
+        return self.compactor.start()
+
+    def _write(self, operation, record_id=None, **payload):
+        """
+        Persists a change in the write ahead log and applies it to
+        the loaded records. The entry is queued under the write lock
+        but the wait for the disk happens outside of it so that
+        concurrent writers are committed together. The entry is only
+        applied once it was written
+
+        Returns
+        -------
+
+            str: the id of the record that was changed
+        """
+        if not self.database_loaded:
+            raise django_no_sql_errors.ManagerLoadingError()
+
+        with self._write_lock:
+            last_id = self._last_id
+            if record_id is None:
+                record_id = self._last_id + 1
+            record_id = str(record_id)
+            if operation != 'insert' and self.get_record(record_id) is None:
+                raise django_no_sql_errors.ItemExistError()
+            if operation == 'insert' and record_id.isdigit():
+                # The id is reserved for this record
+                # while the entry is being written
+                self._last_id = max(self._last_id, int(record_id))
+
+            # A sharded database writes the entry in the
+            # log of the shard that stores the record
+            target = self._get_shard(operation, record_id, payload) if self.shards else self
+            entry = {'op': operation, 'id': record_id, **payload}
+            with target._write_lock:
+                write_log = target._get_write_log()
+                ticket = write_log.enqueue(operation, record_id=record_id, **payload)
+                if target is not self:
+                    target._unapplied.append((write_log, ticket, entry, None))
+                self._unapplied.append((write_log, ticket, entry, target if target is not self else None))
+
+        try:
+            write_log.wait(ticket)
+        except django_no_sql_errors.DatabaseError:
+            with self._write_lock:
+                if operation == 'insert' and record_id.isdigit() and self._last_id == int(record_id):
+                    self._last_id = last_id
+            raise
+        finally:
+            with self._write_lock:
+                with target._write_lock:
+                    if target is not self:
+                        target._apply_written()
+                    self._apply_written()
+        return record_id
+
+    def _apply_written(self):
+        """
+        Applies the queued entries that were written to their log, in
+        the order of the log. The entries that could not be written are
+        dropped. Should be called under the write lock
+        """
+        # An entry that is still queued holds back
+        # the entries that follow it in the same log
+        waiting = set()
+        remaining = collections.deque()
+        for item in self._unapplied:
+            write_log, ticket, entry, shard = item
+            written = None if write_log in waiting else write_log.is_written(ticket)
+            if written is None:
+                waiting.add(write_log)
+                remaining.append(item)
+                continue
+            if not written:
+                continue
+            if shard is not None:
+                if entry['op'] == 'delete':
+                    self._shard_of.pop(entry['id'], None)
+                else:
+                    self._shard_of[entry['id']] = shard
+            self._apply_entry(entry)
+        self._unapplied = remaining
+        return True
+
+    def insert(self, record:dict, record_id=None):
+        """
+        Adds a new record to the database
+
+        Parameters
+        ----------
+
+            record (dict): the record to add
+
+            record_id (str, optional): the id of the record. Defaults
+            to the last numeric id plus one
+
+        Returns
+        -------
+
+            str: the id of the new record
+        """
+        return self._write('insert', record_id, record=record)
+
+    def update(self, record_id, **fields):
+        """Updates the fields of the record stored under the given id"""
+        self._write('update', record_id, fields=fields)
+        return True
+
+    def delete(self, record_id):
+        """Deletes the record stored under the given id"""
+        self._write('delete', record_id)
         return True
 
     def _check_schema(self, schema):
@@ -218,7 +628,9 @@ class Database:
         -----------
 
             In order to simplify iteration over the top dictionnary,
-            storing each dict as an array does exactly that
+            storing each dict as an array does exactly that. The list
+            is a RecordStore which keeps the id of each record so that
+            records can still be accessed by id
 
         Parameters
         ----------
@@ -239,7 +651,7 @@ class Database:
             return self.db_data
         if not key:
             key = 'data'
-        return [record for record in raw_data[key].values()]
+        return RecordStore(raw_data[key].values(), raw_data[key].keys())
 
     def create_inline(self, model_name, fields_to_create:dict, **kwargs):
         """
@@ -269,9 +681,8 @@ class Database:
         # os.path.exists(constructed_database_path)
 
         if not os.path.exists(self.path_or_url):
-            with open(self.path_or_url, 'w', encoding='utf-8') as db:
-                schema_structure = self._create_fields(self._create_default_schema(model_name), fields_to_create)
-                json.dump(schema_structure, db, indent=4)
+            schema_structure = self._create_fields(self._create_default_schema(model_name), fields_to_create)
+            backends.write_database(self.path_or_url, schema_structure, pretty=self.pretty_print)
             return True
         else:
             # self.path_or_url = constructed_database_path
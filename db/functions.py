@@ -1,10 +1,47 @@
 import copy
 import datetime
+import operator
 import re
 from collections import OrderedDict
 
 from django_no_sql.db import errors
 from django_no_sql.db.errors import FilterError, ResolutionError, SubDictError
+from django_no_sql.db.indexes import matches_search, parse_search
+from django_no_sql.db.planner import Planner
+from django_no_sql.db.storage import MappedRecords
+
+
+def _is_in(a, b):
+    try:
+        return a in b
+    except TypeError:
+        # An unhashable value is never
+        # part of a set of hashable ones
+        return False
+
+
+# The functions used to compare the value of
+# a record (a) to the searched value (b) for
+# each of the special keywords. The case
+# insensitive lookups receive a searched
+# value that was already lowered
+LOOKUPS = {
+    'exact': operator.eq,
+    'eq': operator.eq,
+    'ne': operator.ne,
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+    'contains': lambda a, b: b in a,
+    'icontains': lambda a, b: b in a.lower(),
+    'iexact': lambda a, b: a.lower() == b,
+    'startswith': lambda a, b: a.startswith(b),
+    'endswith': lambda a, b: a.endswith(b),
+    're': lambda a, b: b.match(a) is not None,
+    'in': _is_in,
+    'search': matches_search
+}
 
 
 class Functions:
@@ -16,10 +53,20 @@ class Functions:
     new_queryset = []
 
     special_words = ['eq', 'gt', 'gte', 'lt', 'lte', 'startswith', 'endswith',
-                        'ne', 'contains', 'icontains', 'exact', 'iexact', 're']
+                        'ne', 'contains', 'icontains', 'exact', 'iexact', 're', 'in', 'search']
 
     special_date_keywords = ['year', 'day', 'month']
 
+    # The plan of the last query that was run
+    # which can be displayed with explain()
+    last_plan = None
+
+    # Scans of at least parallel_threshold records
+    # compare them on scan_workers processes when it
+    # is more than 1. None uses all the cores
+    scan_workers = 1
+    parallel_threshold = 200000
+
     # A list that holds
     # all the filter keys
     keys_dict = []
@@ -95,13 +142,10 @@ class Functions:
                     }
                 ]
         """
-        special_keyword = 'exact'
-        number_of_filters = self.decompose(get_count=True, **expressions)
-
-        comparator_results = []
-        filtered_items = []
-        # number_of_values_to_search = len(self.searched_values)
-        # position = 0
+        self.decompose(**expressions)
+        # Each expression is parsed once for the whole
+        # query as opposed to once for each record
+        lookups = self.compile(**expressions)
 
         items_to_iterate = self.new_queryset or self.db_data
         # if self.new_queryset:
@@ -115,90 +159,157 @@ class Functions:
         if not items_to_iterate:
             return []
 
-        if not isinstance(items_to_iterate, list):
+        if not isinstance(items_to_iterate, (list, MappedRecords)):
             raise errors.QueryTypeError(query)
 
-        # This section iterates over both
-        # arrays in order to filter the data
-        for item in items_to_iterate:
-            for index, key in enumerate(self.keys_dict):
-                searched_value = self.searched_values[index]
-
-                try:
-                    no_underscore = item[key]
-
-                    # We need to reset the special keyword
-                    # to the default value which is eq or exact
-                    special_keyword = 'exact'
-                    # There are cases where we might not have reached
-                    # the full depth of a subdictionnary.
-
-                    # For example suppopse we have this:
-                    # {a: b, c: {d: e}} and the user queries
-                    # .get(c=something). In such a case, we
-                    # can see that the user did not query a
-                    # a specific key from the subdict (c).
-
-                    # This results in the return value
-                    # being a subdict.
-
-                    # Therefore, we just append the
-                    # subdict into the filtered items(?)
-                    # or raise an error telling the user
-                    # that the subdict needs to be queried(?)
-                    if isinstance(no_underscore, dict):
-                        # filtered_items.append(item[key])
-                        raise errors.SubDictError(key, item[key])
-                except KeyError:
-                    no_underscore = None
-                    # If the key contains a double
-                    # underscore we need to separate
-                    # the key from the special keyword
-                    result = self.right_hand_filter(key, item)
-                    with_underscore = result[0]
-                    special_keyword = result[1]
-
-                # Here we can get the parameter
-                # that resulted into a true
-                g = no_underscore or with_underscore
-
-                if number_of_filters == 1:
-                    # This logic is specific to cases where
-                    # we only have one filter
-                    return_value = self.comparator(g, searched_value, special_keyword=special_keyword, sub_dict=item)
-                    if return_value is True:
-                        filtered_items.append(item)
-                elif number_of_filters > 1:
-                    # This logic works for cases where we have
-                    # multiple filters. It's like applying an AND
-                    # operator in an SQL statement.
-
-                    # The logic is to get all the booleans in an array
-                    # and to apply an all() function that will determine
-                    # if the item needs to be appended or not
-                    comparator_results.append(self.comparator(g, searched_value, special_keyword=special_keyword))
-
-                # position = position + 1
-                # # In order for the cursor to always iterate
-                # # between the 0 and the max amount of values
-                # # that the user wants to search, we have to reset it
-                # if position >= number_of_values_to_search:
-                #     position = 0
-
-
-            # This is the section with the all() function that
-            # determines if everything is TRUE in order to append
-            # the item in the array or not
-            if number_of_filters > 1 and all(comparator_results):
-                filtered_items.append(item)
-            # We need to reset the comparator results
-            # variable in order to prevent it from 
-            # appending all the thruth/false values
-            # of all the tested data
-            comparator_results = []
+        if not lookups:
+            # A query without expressions
+            # does not return any records
+            filtered_items = []
+        else:
+            filtered_items = self.execute(items_to_iterate, lookups)
         self.new_queryset = filtered_items
         return filtered_items
 
+    def execute(self, items, lookups, limit=None):
+        """
+        Returns the items that match all the compiled lookups. The
+        scan stops once `limit` items were found
+        """
+        # The planner chooses between a scan and the
+        # indexes of the records and orders the lookups
+        # that still have to be compared to each record
+        plan = Planner(items).plan(lookups)
+        plan.workers = self.scan_workers
+        plan.parallel_threshold = self.parallel_threshold
+        filtered_items = plan.execute(items, limit=limit)
+        self.last_plan = plan
+        return filtered_items
+
+    def batch(self, items, queries):
+        """
+        Returns the items that match the lookups of each query
+        with a single pass over the items
+
+        Description
+        -----------
+
+            The lookups that are the same in several queries are only
+            compared once for each item. The queries that an index can
+            answer run on their own since they do not need to read all
+            the items
+
+        Parameters
+        ----------
+
+            items (list): the items to filter
+            queries (dict): the compiled lookups of each query by name
+
+        Example
+        -------
+
+            batch(items, {'adults': compile(age__gte=21), 'kendall': compile(name='Kendall')})
+                -> {'adults': [...], 'kendall': [...]}
+        """
+        results = {}
+        shared = {}
+        predicates = []
+        scans = []
+        for name, lookups in queries.items():
+            if not lookups:
+                results[name] = list(items)
+                continue
+
+            planner = Planner(items)
+            plan = planner.plan(lookups)
+            if plan.strategy != 'scan':
+                results[name] = plan.execute(items)
+                continue
+
+            positions = []
+            for lookup in planner.order(lookups):
+                key = (lookup.expression, repr(lookup.value))
+                if key not in shared:
+                    shared[key] = len(predicates)
+                    predicates.append(lookup.predicate)
+                positions.append(shared[key])
+            results[name] = []
+            scans.append((positions, results[name]))
+
+        if scans:
+            for item in items:
+                # The result of each lookup for
+                # the item once it was compared
+                compared = {}
+                for positions, matches in scans:
+                    for position in positions:
+                        result = compared.get(position)
+                        if result is None:
+                            result = compared[position] = bool(predicates[position](item))
+                        if not result:
+                            break
+                    else:
+                        matches.append(item)
+        return results
+
+    def iterate(self, items, lookups):
+        """Returns a generator of the items that match all
+        the compiled lookups which are found as it is consumed"""
+        plan = Planner(items).plan(lookups)
+        self.last_plan = plan
+        return plan.iterate(items)
+
+    def compile(self, **expressions):
+        """
+        Compiles the expressions of a query into a list of lookups
+        that can be applied to each record without parsing the
+        expressions again
+
+        Example
+        -------
+
+            compile(name='Kendall', location__country__exact='USA')
+                -> [Lookup(name__exact), Lookup(location__country__exact)]
+        """
+        return [Lookup(expression, value) for expression, value in expressions.items()]
+
+    def create_index(self, field, kind='hash'):
+        """Creates an index on a field of the records of the database"""
+        if not hasattr(self.db_data, 'create_index'):
+            raise errors.DatabaseError('Indexes can only be created on the records of a loaded database')
+        return self.db_data.create_index(field, kind=kind)
+
+    def order_by(self, field, query=None):
+        """
+        Returns the records sorted on the field. A field starting
+        with a minus sign sorts the records in descending order
+
+        Description
+        -----------
+
+            When the records are the ones of the database and a sorted
+            index exists on the field for all of them, the records are
+            read in the order of the index instead of being sorted
+        """
+        reverse = field.startswith('-')
+        field = field.lstrip('-')
+
+        items = self.new_queryset or self.db_data
+        if query is not None:
+            items = query
+
+        index = getattr(items, 'indexes', {}).get(f'{field}_sorted')
+        if index is not None and len(index) == len(items):
+            record_ids = index.ordered_ids(reverse=reverse, position=getattr(items, 'position', None))
+            return [items.get(record_id) for record_id in record_ids]
+        return sorted(items, key=Lookup(field, None).get, reverse=reverse)
+
+    def drop_index(self, field, kind='hash'):
+        """Removes an index from the records of the database"""
+        if not hasattr(self.db_data, 'drop_index'):
+            return False
+        return self.db_data.drop_index(field, kind=kind)
+
     def decompose(self, get_count=False, **expressions):
         """A more complex query expression separator that can
         also separate logical comparision keywords e.g. gt, lt
@@ -232,7 +343,12 @@ class Functions:
         """
         # Now we can seperate the keys from
         # the search values so that we have
-        # two independent arrays from one another
+        # two independent arrays from one another.
+        # The lists are created for each query so
+        # that the expressions of a previous query
+        # are not applied again
+        self.keys_dict = []
+        self.searched_values = []
         for key, value in expressions.items():
             self.keys_dict.append(key)
 
@@ -335,33 +451,16 @@ class Functions:
         # comparision in order to keep the flow
         if special_keyword is None:
             return a == b
-         
-        if special_keyword == 'exact' or special_keyword == 'eq':
-            return a == b
-
-        if special_keyword == 'gt':
-            return a > b
 
-        if special_keyword == 'gte':
-            return a >= b
+        if special_keyword in ('icontains', 'iexact'):
+            b = b.lower()
 
-        if special_keyword == 'lt':
-            return a < b
+        if special_keyword == 'search':
+            b = parse_search(b)
 
-        if special_keyword == 'lte':
-            return a <= b
-
-        if special_keyword == 'ne':
-            return a != b
-
-        if special_keyword == 'contains':
-            return b in a
-
-        if special_keyword == 'startswith':
-            return a.startswith(b)
-
-        if special_keyword == 'endswith':
-            return a.endswith(b)
+        function = LOOKUPS.get(special_keyword)
+        if function is not None:
+            return function(a, b)
 
     def right_hand_filter(self, expression, sub_dict):
         """A special function that takes expressions
@@ -534,8 +633,16 @@ class Functions:
         -----------
 
             This special function was created in order to
-            prevent useless iteration over the database.
+            prevent useless iteration over the database. The
+            record is looked up with the id it was stored under
+            in the data section of the database
         """
+        if hasattr(self.db_data, 'in_bulk'):
+            item = self.db_data.get(str(reference_or_id))
+            if item is None:
+                raise errors.ItemExistError()
+            return item
+
         try:
             item = self.db_data[reference_or_id]
         except:
@@ -543,20 +650,138 @@ class Functions:
         else:
             return item
 
+    def in_bulk(self, ids=None):
+        """Return a dict of the items stored under the given
+        ids. Ids that do not exist are left out"""
+        if hasattr(self.db_data, 'in_bulk'):
+            return self.db_data.in_bulk(ids)
+
+        # Plain lists do not have ids and
+        # are accessed by position instead
+        if ids is None:
+            ids = range(len(self.db_data))
+        items = {}
+        for i in ids:
+            if isinstance(i, int) and 0 <= i < len(self.db_data):
+                items[i] = self.db_data[i]
+        return items
+
     def filter_by_ids(self, ids:list):
         """From a list of ids, return a list of items that
         corresponds to the given ids
         """
-        def iterate():
-            for i in ids:
-                for index, value in enumerate(self.db_data):
-                    if i == index:
-                        yield value
-        return list(iterate())
+        return list(self.in_bulk(ids).values())
 
     def copy(self):
         return copy.copy(self)
 
+class Lookup:
+    """
+    A single filter expression of a query compiled into a function
+    that gets the value of a record and compares it to the searched one
+
+    Description
+    -----------
+
+        The expression is split once: the parts that are special words
+        give the comparison to use and the others give the path to the
+        value in the record. The searched value is prepared once as well
+        e.g. regular expressions are compiled and case insensitive values
+        are lowered.
+
+        When the searched value is an F function, it is resolved against
+        the record that is being compared.
+
+    Parameters
+    ----------
+
+        expression (str): an expression such as location__country__exact
+        value: the value to search for
+
+    Example
+    -------
+
+        lookup = Lookup('location__country', 'USA')
+        lookup.path -> [location, country]
+        lookup.predicate({location: {country: USA}}) -> True
+    """
+    def __init__(self, expression, value):
+        self.expression = expression
+        self.value = value
+        self.path = []
+        self.lookup = None
+        for key in expression.split('__'):
+            if key in Functions.special_words:
+                self.lookup = key
+            else:
+                self.path.append(key)
+
+        if not self.path:
+            raise FilterError('The expression does not contain a field to filter on.', expression)
+
+        self.operator = LOOKUPS[self.lookup or 'exact']
+        self.is_reference = isinstance(value, F)
+        self.get = self._build_getter()
+        self.predicate = self._build_predicate()
+
+    def __repr__(self):
+        lookup = self.lookup or 'exact'
+        return f'{self.__class__.__name__}({self.field}__{lookup})'
+
+    @property
+    def field(self):
+        """The path to the value e.g. location__country"""
+        return '__'.join(self.path)
+
+    def _build_getter(self):
+        path = self.path
+        if len(path) == 1:
+            key = path[0]
+            if self.lookup is None:
+                def get(record):
+                    value = record[key]
+                    # The user did not query a specific
+                    # key of the subdictionnary
+                    if isinstance(value, dict):
+                        raise SubDictError(key, value)
+                    return value
+                return get
+            return operator.itemgetter(key)
+
+        def get(record):
+            value = record
+            for key in path:
+                if not isinstance(value, dict):
+                    raise errors.KeyExistError(key, list(record.keys()))
+                value = value[key]
+            return value
+        return get
+
+    def _build_predicate(self):
+        get = self.get
+        compare = self.operator
+        value = self.value
+
+        if isinstance(value, F):
+            get_reference = Lookup(value.field, None).get
+            return lambda record: compare(get(record), get_reference(record))
+
+        if self.lookup == 're':
+            value = re.compile(value)
+        elif self.lookup in ('icontains', 'iexact'):
+            value = value.lower()
+        elif self.lookup == 'search':
+            value = parse_search(value)
+        elif self.lookup == 'in' and not isinstance(value, str):
+            try:
+                value = frozenset(value)
+            except TypeError:
+                # Keep the original values
+                # when they cannot be hashed
+                pass
+        return lambda record: compare(get(record), value)
+
+
 class F:
     """The F function resolves expressions for other function 
     classes such as Avg, Sum etc
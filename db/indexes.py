@@ -0,0 +1,793 @@
+"""A module that regroups the secondary indexes that can be created
+on the fields of a database in order to answer queries without
+scanning all the records
+"""
+
+import bisect
+import re
+
+from django_no_sql.db import errors as django_no_sql_errors
+
+
+# Returned when a record does not have
+# a value that can be indexed for the field
+MISSING = object()
+
+TOKEN = re.compile(r'\w+')
+
+
+def get_value(record, path):
+    """Returns the value at the end of the path of keys
+    in the record or MISSING when there is none"""
+    value = record
+    for key in path:
+        if not isinstance(value, dict):
+            return MISSING
+        try:
+            value = value[key]
+        except KeyError:
+            return MISSING
+    return value
+
+
+def tokenize(text):
+    """Returns the lowered words of the text"""
+    return TOKEN.findall(text.lower())
+
+
+def parse_search(query):
+    """
+    Parses the value of a search lookup into groups of terms. The
+    terms of a group must all be present in the text (AND) and at
+    least one of the groups must match (OR)
+
+    Example
+    -------
+
+        parse_search('los angeles OR tucson') -> [{los, angeles}, {tucson}]
+    """
+    groups = []
+    for part in re.split(r'\s+OR\s+', query.strip()):
+        terms = frozenset(tokenize(part))
+        if terms:
+            groups.append(terms)
+    return groups
+
+
+def matches_search(text, groups):
+    """Whether the text matches one of the groups of terms"""
+    if not isinstance(text, str):
+        return False
+    words = set(tokenize(text))
+    return any(terms <= words for terms in groups)
+
+
+class Index:
+    """
+    Base class for the indexes
+
+    Description
+    -----------
+
+        An index maps the values of a field to the ids of the records
+        that hold them. The records themselves are never copied. The
+        index is kept up to date by the record store each time a record
+        is added, replaced or removed.
+
+        Records that do not have the field, or whose value cannot be
+        indexed, are kept apart. They are returned with the records
+        found by the index so that they are compared with the lookups
+        as they would be during a scan.
+
+    Parameters
+    ----------
+
+        field (str): the path to the field e.g. name or location__country
+    """
+    kind = None
+
+    # The lookups of the filter expressions
+    # that the index can answer
+    lookups = []
+
+    # Whether the records returned by the index all
+    # match the lookups. When they do not, the index
+    # only narrows the records to compare
+    exact_matches = True
+
+    def __init__(self, field):
+        self.field = field
+        self.path = field.split('__')
+        # The ids of the records that do not
+        # have a value that can be indexed
+        self.unindexed = set()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}({self.field})>'
+
+    @property
+    def name(self):
+        return f'{self.field}_{self.kind}'
+
+    @property
+    def exact(self):
+        """Whether the records returned by the index all match the
+        lookups, which is not the case once some were not indexed"""
+        return self.exact_matches and not self.unindexed
+
+    def value(self, record):
+        """Returns the value of the field in the
+        record or MISSING when it has none"""
+        return get_value(record, self.path)
+
+    def supports(self, field, lookup):
+        """Whether the index can answer the lookup on the field"""
+        return field == self.field and (lookup or 'exact') in self.lookups
+
+    def build(self, items):
+        """Indexes the (id, record) pairs"""
+        for record_id, record in items:
+            self.add(record_id, record)
+        return self
+
+    def add(self, record_id, record):
+        raise NotImplementedError
+
+    def remove(self, record_id, record):
+        raise NotImplementedError
+
+    def search(self, lookup, value):
+        """Returns the set of the ids of the records that match or
+        None when the index cannot answer the lookup for the value"""
+        raise NotImplementedError
+
+    def search_many(self, lookups):
+        """Returns the ids of the records that match all the
+        (lookup, value) pairs or None when one of them cannot
+        be answered by the index"""
+        record_ids = None
+        for lookup, value in lookups:
+            matches = self.search(lookup, value)
+            if matches is None:
+                return None
+            record_ids = matches if record_ids is None else record_ids & matches
+        return record_ids
+
+    def match(self, lookups):
+        """
+        Returns the compiled lookups of a query that the index can answer
+
+        Parameters
+        ----------
+
+            lookups (list): the compiled lookups of the query
+        """
+        return [lookup for lookup in lookups if self.supports(lookup.field, lookup.lookup)]
+
+    def estimate(self, lookups):
+        """Returns the number of records that the index would return
+        for the lookups or None when it cannot be known cheaply"""
+        return None
+
+    def search_lookups(self, lookups):
+        """Returns the ids of the records that match the compiled
+        lookups returned by match or None"""
+        record_ids = self.search_many([(lookup.lookup or 'exact', lookup.value) for lookup in lookups])
+        if record_ids is None:
+            return None
+        return record_ids | self.unindexed
+
+
+class HashIndex(Index):
+    """
+    An index that maps each value of a field to the ids
+    of the records holding it. It answers exact, eq and in
+    lookups with a single dict access per searched value
+
+    Example
+    -------
+
+        index = HashIndex('location__country')
+        index.build(records.items())
+        index.search('exact', 'USA') -> {1, 2, 3}
+    """
+    kind = 'hash'
+    lookups = ['exact', 'eq', 'in']
+
+    def __init__(self, field):
+        super().__init__(field)
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def value(self, record):
+        value = super().value(record)
+        try:
+            hash(value)
+        except TypeError:
+            return MISSING
+        return value
+
+    def add(self, record_id, record):
+        value = self.value(record)
+        if value is MISSING:
+            self.unindexed.add(record_id)
+            return
+        self._entries.setdefault(value, set()).add(record_id)
+
+    def remove(self, record_id, record):
+        value = self.value(record)
+        if value is MISSING:
+            self.unindexed.discard(record_id)
+            return
+        record_ids = self._entries.get(value)
+        if record_ids is not None:
+            record_ids.discard(record_id)
+            if not record_ids:
+                del self._entries[value]
+
+    def search(self, lookup, value):
+        if lookup == 'in':
+            if isinstance(value, str):
+                return None
+            values = value
+        else:
+            values = [value]
+
+        record_ids = set()
+        try:
+            for value in values:
+                record_ids.update(self._entries.get(value, ()))
+        except TypeError:
+            # Unhashable values can only
+            # be compared with a scan
+            return None
+        return record_ids
+
+    def estimate(self, lookups):
+        estimates = []
+        for lookup in lookups:
+            values = lookup.value if lookup.lookup == 'in' else [lookup.value]
+            if isinstance(values, str):
+                return None
+            try:
+                estimates.append(sum(len(self._entries.get(value, ())) for value in values))
+            except TypeError:
+                return None
+        if not estimates:
+            return None
+        return min(estimates) + len(self.unindexed)
+
+
+class SortedIndex(Index):
+    """
+    An index that keeps the values of a field sorted next to the
+    ids of the records holding them
+
+    Description
+    -----------
+
+        Range lookups are answered with a binary search of their bounds
+        and a single slice of the ids. Several lookups on the same field
+        e.g. age__gte=21 and age__lt=30 are narrowed to the same slice.
+
+        The ids can also be read in the order of the values which
+        allows ordering the records on the field without sorting them.
+
+        The values of a field are expected to be either numbers or strings
+        (e.g. dates in ISO format). Values of the other kind are left out
+        of the index and compared with the lookups instead.
+
+    Example
+    -------
+
+        index = SortedIndex('age')
+        index.build(records.items())
+        index.search_many([('gte', 21), ('lt', 30)]) -> {1, 4}
+    """
+    kind = 'sorted'
+    lookups = ['exact', 'eq', 'gt', 'gte', 'lt', 'lte']
+
+    def __init__(self, field):
+        super().__init__(field)
+        self.family = None
+        self._keys = []
+        self._ids = []
+
+    def __len__(self):
+        return len(self._ids)
+
+    @staticmethod
+    def family_of(value):
+        """Returns the kind of values that can be compared with the value"""
+        if isinstance(value, (int, float)):
+            return 'number'
+        if isinstance(value, str):
+            return 'string'
+        return None
+
+    def value(self, record):
+        value = super().value(record)
+        family = self.family_of(value)
+        if family is None or (self.family is not None and family != self.family):
+            return MISSING
+        return value
+
+    def build(self, items):
+        pairs = []
+        for record_id, record in items:
+            value = self.value(record)
+            if value is MISSING:
+                self.unindexed.add(record_id)
+                continue
+            if self.family is None:
+                self.family = self.family_of(value)
+            pairs.append((value, record_id))
+        # The sort is stable which keeps the
+        # records with the same value in the
+        # order of the store
+        pairs.sort(key=lambda pair: pair[0])
+        self._keys = [pair[0] for pair in pairs]
+        self._ids = [pair[1] for pair in pairs]
+        return self
+
+    def add(self, record_id, record):
+        value = self.value(record)
+        if value is MISSING:
+            self.unindexed.add(record_id)
+            return
+        if self.family is None:
+            self.family = self.family_of(value)
+        position = bisect.bisect_right(self._keys, value)
+        self._keys.insert(position, value)
+        self._ids.insert(position, record_id)
+
+    def remove(self, record_id, record):
+        value = self.value(record)
+        if value is MISSING:
+            self.unindexed.discard(record_id)
+            return
+        start = bisect.bisect_left(self._keys, value)
+        end = bisect.bisect_right(self._keys, value)
+        for position in range(start, end):
+            if self._ids[position] == record_id:
+                del self._keys[position]
+                del self._ids[position]
+                break
+
+    def bounds(self, lookups):
+        """Returns the start and the end of the slice of the
+        ids that match all the (lookup, value) pairs"""
+        start, end = 0, len(self._keys)
+        for lookup, value in lookups:
+            if self.family is not None and self.family_of(value) != self.family:
+                return None
+            if lookup in ('exact', 'eq'):
+                start = max(start, bisect.bisect_left(self._keys, value))
+                end = min(end, bisect.bisect_right(self._keys, value))
+            elif lookup == 'gt':
+                start = max(start, bisect.bisect_right(self._keys, value))
+            elif lookup == 'gte':
+                start = max(start, bisect.bisect_left(self._keys, value))
+            elif lookup == 'lt':
+                end = min(end, bisect.bisect_left(self._keys, value))
+            elif lookup == 'lte':
+                end = min(end, bisect.bisect_right(self._keys, value))
+            else:
+                return None
+        return start, end
+
+    def search(self, lookup, value):
+        return self.search_many([(lookup, value)])
+
+    def estimate(self, lookups):
+        bounds = self.bounds([(lookup.lookup or 'exact', lookup.value) for lookup in lookups])
+        if bounds is None:
+            return None
+        return max(bounds[1] - bounds[0], 0) + len(self.unindexed)
+
+    def search_many(self, lookups):
+        bounds = self.bounds(lookups)
+        if bounds is None:
+            return None
+        start, end = bounds
+        return set(self._ids[start:end]) if start < end else set()
+
+    def ordered_ids(self, reverse=False, position=None):
+        """
+        Returns the ids of the records in the order of their values. As
+        with a stable sort, the records with the same value keep the order
+        of the store, which `position` gives, even in descending order
+        """
+        groups = []
+        start = 0
+        while start < len(self._keys):
+            end = bisect.bisect_right(self._keys, self._keys[start], start)
+            group = self._ids[start:end]
+            if position is not None and len(group) > 1:
+                # An updated record is added at the end
+                # of its group in the index but keeps
+                # its place in the store
+                group.sort(key=position)
+            groups.append(group)
+            start = end
+        if reverse:
+            groups.reverse()
+        return [record_id for group in groups for record_id in group]
+
+
+class CompositeIndex(Index):
+    """
+    An index on the tuple of the values of several fields
+
+    Description
+    -----------
+
+        The index answers the queries whose exact or eq lookups cover
+        a prefix of its fields e.g. an index on (name, surname) answers
+        name=... and name=..., surname=... but not surname=... alone.
+        A hash map is kept for each prefix so that every covered query
+        costs a single dict access. Records that miss one of the
+        fields are left out of the index.
+
+    Parameters
+    ----------
+
+        fields (list): the paths to the fields e.g. [name, location__country]
+
+    Example
+    -------
+
+        index = CompositeIndex(['name', 'surname'])
+        index.build(records.items())
+        index.search_prefix(['Kendall', 'Jenner']) -> {1}
+    """
+    kind = 'composite'
+    lookups = ['exact', 'eq']
+
+    def __init__(self, fields):
+        if len(fields) < 2:
+            raise django_no_sql_errors.DatabaseError('A composite index needs at least two fields')
+        self.fields = list(fields)
+        self.indexes = [HashIndex(field) for field in self.fields]
+        super().__init__(','.join(self.fields))
+        self._entries = [{} for _ in self.fields]
+
+    def __len__(self):
+        return len(self._entries[-1])
+
+    def supports(self, field, lookup):
+        return field in self.fields and (lookup or 'exact') in self.lookups
+
+    def value(self, record):
+        values = []
+        for index in self.indexes:
+            value = index.value(record)
+            if value is MISSING:
+                return MISSING
+            values.append(value)
+        return tuple(values)
+
+    def add(self, record_id, record):
+        values = self.value(record)
+        if values is MISSING:
+            self.unindexed.add(record_id)
+            return
+        for position, entries in enumerate(self._entries):
+            entries.setdefault(values[:position + 1], set()).add(record_id)
+
+    def remove(self, record_id, record):
+        values = self.value(record)
+        if values is MISSING:
+            self.unindexed.discard(record_id)
+            return
+        for position, entries in enumerate(self._entries):
+            key = values[:position + 1]
+            record_ids = entries.get(key)
+            if record_ids is not None:
+                record_ids.discard(record_id)
+                if not record_ids:
+                    del entries[key]
+
+    def search_prefix(self, values):
+        """Returns the ids of the records whose first fields
+        are equal to the values"""
+        values = tuple(values)
+        try:
+            return set(self._entries[len(values) - 1].get(values, ()))
+        except TypeError:
+            return None
+
+    def search(self, lookup, value):
+        # A single value can only be the first field
+        if (lookup or 'exact') not in self.lookups:
+            return None
+        return self.search_prefix([value])
+
+    def match(self, lookups):
+        matched = []
+        for field in self.fields:
+            lookup = next((lookup for lookup in lookups if lookup.field == field \
+                            and (lookup.lookup or 'exact') in self.lookups), None)
+            # Only the lookups on a prefix
+            # of the fields can be used
+            if lookup is None:
+                break
+            matched.append(lookup)
+        return matched
+
+    def estimate(self, lookups):
+        values = tuple(lookup.value for lookup in lookups)
+        try:
+            return len(self._entries[len(values) - 1].get(values, ())) + len(self.unindexed)
+        except TypeError:
+            return None
+
+    def search_lookups(self, lookups):
+        record_ids = self.search_prefix([lookup.value for lookup in lookups])
+        if record_ids is None:
+            return None
+        return record_ids | self.unindexed
+
+
+class TextIndex(Index):
+    """
+    An inverted index that maps each word of the strings of a
+    field to the ids of the records that contain it
+
+    Description
+    -----------
+
+        The search lookup is answered from the words of the index: the
+        terms of a group are intersected and the groups separated by OR
+        are merged e.g. name__search='kendall OR kylie'.
+
+        The contains and icontains lookups are narrowed to the records
+        that have, for each word of the searched value, a word of the
+        index that contains it. Only these records are then compared
+        to the searched value.
+
+        Records whose value is not a string (e.g. a list), or that do not
+        have the field, are always returned so that the comparison
+        decides for them.
+
+    Example
+    -------
+
+        index = TextIndex('location__city')
+        index.build(records.items())
+        index.search('search', 'los angeles') -> {1, 4}
+    """
+    kind = 'text'
+    lookups = ['contains', 'icontains', 'search']
+    exact_matches = False
+
+    def __init__(self, field):
+        super().__init__(field)
+        self._postings = {}
+
+    def __len__(self):
+        return len(self._postings)
+
+    def add(self, record_id, record):
+        value = self.value(record)
+        if value is MISSING or not isinstance(value, str):
+            self.unindexed.add(record_id)
+            return
+        for word in set(tokenize(value)):
+            self._postings.setdefault(word, set()).add(record_id)
+
+    def remove(self, record_id, record):
+        value = self.value(record)
+        if value is MISSING or not isinstance(value, str):
+            self.unindexed.discard(record_id)
+            return
+        for word in set(tokenize(value)):
+            record_ids = self._postings.get(word)
+            if record_ids is not None:
+                record_ids.discard(record_id)
+                if not record_ids:
+                    del self._postings[word]
+
+    def _intersect(self, groups_of_ids):
+        record_ids = None
+        for ids in sorted(groups_of_ids, key=len):
+            record_ids = set(ids) if record_ids is None else record_ids & ids
+            if not record_ids:
+                break
+        return record_ids or set()
+
+    def search(self, lookup, value):
+        if not isinstance(value, str):
+            return None
+
+        if lookup == 'search':
+            record_ids = set()
+            for terms in parse_search(value):
+                record_ids.update(self._intersect([self._postings.get(term, set()) for term in terms]))
+            return record_ids | self.unindexed
+
+        words = tokenize(value)
+        if not words:
+            return None
+        groups_of_ids = []
+        for word in set(words):
+            ids = set()
+            for indexed_word, record_ids in self._postings.items():
+                if word in indexed_word:
+                    ids.update(record_ids)
+            groups_of_ids.append(ids)
+        return self._intersect(groups_of_ids) | self.unindexed
+
+    def estimate(self, lookups):
+        estimates = []
+        for lookup in lookups:
+            if lookup.lookup != 'search' or not isinstance(lookup.value, str):
+                continue
+            groups = parse_search(lookup.value)
+            estimates.append(len(self.unindexed) + sum(min(len(self._postings.get(term, ())) for term in terms) \
+                                for terms in groups))
+        return min(estimates, default=None)
+
+
+def literal_prefix(pattern):
+    """
+    Returns the characters that every string matched by the regular
+    expression starts with or an empty string when they are unknown
+    """
+    if not isinstance(pattern, str) or '|' in pattern:
+        return ''
+    if pattern.startswith('^'):
+        pattern = pattern[1:]
+
+    prefix = []
+    for character in pattern:
+        if character in '.^$*+?{}[]()\\|':
+            # A quantifier applies to the last character
+            # which is then not always present
+            if character in '*?{' and prefix:
+                prefix.pop()
+            break
+        prefix.append(character)
+    return ''.join(prefix)
+
+
+class TrigramIndex(Index):
+    """
+    An index that maps each sequence of three characters of the
+    lowered strings of a field to the ids of the records holding them
+
+    Description
+    -----------
+
+        The strings are framed with a start and an end marker so that
+        startswith, endswith and iexact lookups only keep the records
+        whose first or last characters match. The contains and icontains
+        lookups keep the records that have all the trigrams of the
+        searched value and regular expressions are narrowed with
+        their literal prefix.
+
+        The index only narrows the records: the returned ones are still
+        compared to the searched value. Records without the field or
+        whose value is not a string are always returned.
+
+    Example
+    -------
+
+        index = TrigramIndex('name')
+        index.build(records.items())
+        index.search('endswith', 'all') -> {1}
+    """
+    kind = 'trigram'
+    lookups = ['contains', 'icontains', 'startswith', 'endswith', 'iexact', 're']
+    exact_matches = False
+
+    start = '\x02'
+    end = '\x03'
+
+    def __init__(self, field):
+        super().__init__(field)
+        self._postings = {}
+
+    def __len__(self):
+        return len(self._postings)
+
+    @staticmethod
+    def trigrams(text):
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def _framed(self, value):
+        return self.start + value.lower() + self.end
+
+    def add(self, record_id, record):
+        value = self.value(record)
+        if value is MISSING or not isinstance(value, str):
+            self.unindexed.add(record_id)
+            return
+        for trigram in self.trigrams(self._framed(value)):
+            self._postings.setdefault(trigram, set()).add(record_id)
+
+    def remove(self, record_id, record):
+        value = self.value(record)
+        if value is MISSING or not isinstance(value, str):
+            self.unindexed.discard(record_id)
+            return
+        for trigram in self.trigrams(self._framed(value)):
+            record_ids = self._postings.get(trigram)
+            if record_ids is not None:
+                record_ids.discard(record_id)
+                if not record_ids:
+                    del self._postings[trigram]
+
+    def _candidates(self, text):
+        """Returns the ids of the records that contain the text"""
+        if len(text) < 3:
+            # Too short to have a trigram: keep the
+            # records of the trigrams containing it
+            record_ids = set()
+            for trigram, ids in self._postings.items():
+                if text in trigram:
+                    record_ids.update(ids)
+            return record_ids
+
+        record_ids = None
+        for trigram in sorted(self.trigrams(text), key=lambda trigram: len(self._postings.get(trigram, ()))):
+            ids = self._postings.get(trigram)
+            if not ids:
+                return set()
+            record_ids = set(ids) if record_ids is None else record_ids & ids
+            if not record_ids:
+                break
+        return record_ids
+
+    def search(self, lookup, value):
+        if lookup == 're':
+            value = literal_prefix(value)
+            lookup = 'startswith'
+        if not isinstance(value, str) or not value:
+            return None
+
+        value = value.lower()
+        if lookup == 'startswith':
+            text = self.start + value
+        elif lookup == 'endswith':
+            text = value + self.end
+        elif lookup == 'iexact':
+            text = self.start + value + self.end
+        else:
+            text = value
+        return self._candidates(text) | self.unindexed
+
+    def estimate(self, lookups):
+        estimates = []
+        for lookup in lookups:
+            value = lookup.value
+            if lookup.lookup == 're':
+                value = literal_prefix(getattr(value, 'pattern', value))
+            if not isinstance(value, str) or len(value) < 3:
+                continue
+            trigrams = self.trigrams(value.lower())
+            estimates.append(len(self.unindexed) + min(len(self._postings.get(trigram, ())) for trigram in trigrams))
+        return min(estimates, default=None)
+
+
+INDEX_TYPES = {
+    'hash': HashIndex,
+    'sorted': SortedIndex,
+    'composite': CompositeIndex,
+    'text': TextIndex,
+    'trigram': TrigramIndex
+}
+
+
+def create_index(field, kind='hash'):
+    """Returns a new, empty, index of the given kind. A list
+    of fields creates a composite index"""
+    if isinstance(field, (list, tuple)):
+        return CompositeIndex(field)
+    try:
+        klass = INDEX_TYPES[kind]
+    except KeyError:
+        raise django_no_sql_errors.DatabaseError(f'"{kind}" is not a valid index type. Use one of: {", ".join(INDEX_TYPES)}')
+    return klass(field)
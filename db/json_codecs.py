@@ -0,0 +1,223 @@
+"""A module that regroups the JSON codecs used to read and write
+the databases. The fastest codec that is installed is selected
+when the module is imported and the standard library's json
+module is used as a fallback
+"""
+
+import json
+import math
+import re
+
+# Integers of 19 digits or more can be outside of
+# the 64 bits range that the fast codecs support
+LONG_INTEGER = re.compile(r'\d{19}')
+
+LONG_INTEGER_BYTES = re.compile(rb'\d{19}')
+
+
+class Codec:
+    """
+    Base class for the JSON codecs
+
+    Description
+    -----------
+
+        Codecs write compact JSON by default. Pretty printed JSON
+        can be requested with the pretty parameter of dumps and dump.
+        Decoding errors are raised as ValueError (or a subclass of it)
+        whatever the library that is used.
+
+        The fast codecs fall back on the standard library for what they
+        do not support: NaN, Infinity, numbers that do not fit in a float
+        and integers larger than 64 bits. Reading or writing a database
+        therefore gives the same values whatever the codec.
+    """
+    name = None
+    module_name = None
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.name})'
+
+    @classmethod
+    def is_available(cls):
+        if cls.module_name is None:
+            return True
+        try:
+            __import__(cls.module_name)
+        except ImportError:
+            return False
+        return True
+
+    def loads(self, data):
+        raise NotImplementedError
+
+    def dumps(self, obj, pretty=False):
+        raise NotImplementedError
+
+    def load(self, fp):
+        return self.loads(fp.read())
+
+    def dump(self, obj, fp, pretty=False):
+        fp.write(self.dumps(obj, pretty=pretty))
+
+
+class StandardCodec(Codec):
+    """Codec using the json module of the standard library"""
+    name = 'json'
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def dumps(self, obj, pretty=False):
+        if pretty:
+            return json.dumps(obj, indent=4, ensure_ascii=False)
+        return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+
+class OrjsonCodec(Codec):
+    """Codec using orjson. Pretty printed output
+    is indented with two spaces"""
+    name = 'orjson'
+    module_name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+        self.fallback = StandardCodec()
+
+    def loads(self, data):
+        # orjson reads the integers larger
+        # than 64 bits as floats
+        if has_long_integers(data):
+            return self.fallback.loads(data)
+        try:
+            return self.orjson.loads(data)
+        except self.orjson.JSONDecodeError:
+            # e.g. NaN, Infinity or 1e400 which
+            # the json module accepts
+            return self.fallback.loads(data)
+
+    def dumps(self, obj, pretty=False):
+        option = self.orjson.OPT_INDENT_2 if pretty else 0
+        try:
+            text = self.orjson.dumps(obj, option=option)
+        except TypeError:
+            # orjson is stricter than json e.g. integers
+            # larger than 64 bits or non string keys
+            return self.fallback.dumps(obj, pretty=pretty)
+        # orjson writes NaN and Infinity as null
+        if b'null' in text and has_special_numbers(obj):
+            return self.fallback.dumps(obj, pretty=pretty)
+        return text.decode('utf-8')
+
+
+class UjsonCodec(Codec):
+    """Codec using ujson"""
+    name = 'ujson'
+    module_name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self.ujson = ujson
+        self.fallback = StandardCodec()
+
+    def loads(self, data):
+        if has_long_integers(data):
+            return self.fallback.loads(data)
+        try:
+            return self.ujson.loads(data)
+        except ValueError:
+            return self.fallback.loads(data)
+
+    def dumps(self, obj, pretty=False):
+        try:
+            return self.ujson.dumps(obj, indent=4 if pretty else 0, ensure_ascii=False)
+        except (TypeError, OverflowError, ValueError):
+            return self.fallback.dumps(obj, pretty=pretty)
+
+
+# The codecs ordered from the
+# fastest to the slowest one
+CODECS = [OrjsonCodec, UjsonCodec, StandardCodec]
+
+
+def has_special_numbers(obj):
+    """Whether the object contains floats that are not finite
+    or integers that are larger than 64 bits"""
+    stack = [obj]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, float):
+            if not math.isfinite(value):
+                return True
+        elif isinstance(value, int) and not isinstance(value, bool):
+            if not -2 ** 63 <= value < 2 ** 64:
+                return True
+        elif isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+    return False
+
+
+def has_long_integers(data):
+    """Whether the JSON text might contain
+    integers larger than 64 bits"""
+    pattern = LONG_INTEGER_BYTES if isinstance(data, (bytes, bytearray, memoryview)) else LONG_INTEGER
+    return pattern.search(data) is not None
+
+
+def select_codec(name=None):
+    """
+    Returns an instance of the codec with the given name or of
+    the fastest one that is available
+
+    Parameters
+    ----------
+
+        name (str, optional): one of orjson, ujson or json
+    """
+    for klass in CODECS:
+        if name is not None and klass.name != name:
+            continue
+        if klass.is_available():
+            return klass()
+    if name is not None:
+        raise ValueError(f'The codec "{name}" is not available. Use one of: {", ".join(available_codecs())}')
+    return StandardCodec()
+
+
+def available_codecs():
+    """Returns the names of the codecs that can be used"""
+    return [klass.name for klass in CODECS if klass.is_available()]
+
+
+codec = select_codec()
+
+
+def use_codec(name):
+    """Changes the codec that is used to read and write the databases"""
+    global codec
+    codec = select_codec(name)
+    return codec
+
+
+def active_codec():
+    """Returns the name of the codec that is being used"""
+    return codec.name
+
+
+def loads(data):
+    return codec.loads(data)
+
+
+def dumps(obj, pretty=False):
+    return codec.dumps(obj, pretty=pretty)
+
+
+def load(fp):
+    return codec.load(fp)
+
+
+def dump(obj, fp, pretty=False):
+    return codec.dump(obj, fp, pretty=pretty)
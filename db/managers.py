@@ -1,6 +1,9 @@
 from collections import OrderedDict
 
-from django_no_sql.db.functions import Functions
+from django_no_sql.db import errors, operators
+from django_no_sql.db.cache import ResultCache
+from django_no_sql.db.functions import Functions, Lookup
+from django_no_sql.db.operators import ConditionTree, Operators
 from django_no_sql.db.queryset import QuerySet
 
 
@@ -13,6 +16,10 @@ class Manager(QuerySet):
 
         The Manager returns a copy of a queryset in most situations which
         allows for added querying on the data
+
+        The results of the queries on a database are kept in the cache
+        of the manager until the next write. Its hit ratio is given by
+        manager.cache.stats
     
     Parameters
     ----------
@@ -23,106 +30,202 @@ class Manager(QuerySet):
         query: represents a sub dictionnary of a data that you want to query
         using the manager
     """
+    # Whether the results of the queries on the
+    # database are cached until the next write
+    cache_results = True
+
     def __init__(self, db_instance=None, query=None):
         if db_instance:
             super().__init__(db_instance=db_instance)
+            if self.cache_results:
+                self.cache = ResultCache()
         else:
             super().__init__(query=query)
 
     def __enter__(self):
-        return (
-            self.functions.new_queryset or 
-            self.functions.db_data
-        )
+        return self._fetch_all()
 
     def __exit__(self, exception_type, exception_value, traceback):
         return False
 
-    def __repr__(self):
-        return f'{self.__class__.__name__}({self.functions.new_queryset})'
-
-    def __len__(self):
-        return len(self.functions.new_queryset)
-
     def clear_inner_queryset(self):
         """Clears the inner queryset of the Manager"""
-        if self.functions.has_queryset:
-            self.functions.new_queryset = []
+        self._result_cache = None
+        self.functions.new_queryset = []
         return self
 
     def all(self):
-        copy = self.copy()
-        copy.functions.new_queryset = copy.functions.db_data
-        return copy
+        return self.copy()
+
+    def none(self):
+        """Return an empty queryset which can still be chained"""
+        return self.__class__(query=[])
 
-    def filter(self, **expressions):
+    def filter(self, *conditions, **expressions):
+        """
+        Return a queryset with the records that match all the
+        expressions and Q operators. The records are only filtered
+        once the queryset is used and chained filters run together
+
+        Example
+        -------
+
+            manager.filter(surname='Jenner').filter(age__gt=22)[:10]
+            manager.filter(Q(name='Kendall') | Q(age__lt=23), surname='Jenner')
+        """
+        self._check_not_sliced('filter')
         copy = self.copy()
-        copy.functions.iterator(**expressions)
+        for condition in conditions:
+            if not isinstance(condition, Operators):
+                raise errors.DatabaseError(f'"{condition}" should be an instance of Q')
+            if condition.is_flat:
+                # An AND of simple expressions is
+                # planned like the other filters
+                copy._lookups.extend(Lookup(*expression) for expression in condition.expressions)
+            else:
+                # Compiled once to check the
+                # expressions of the operator
+                condition.compile()
+                copy._conditions.append(condition)
+        # Each expression is compiled once when
+        # the filter is called and only run
+        # when the queryset is evaluated
+        copy._lookups.extend(copy.functions.compile(**expressions))
         return copy
 
-    def get(self, **expressions):
+    def get(self, *conditions, **expressions):
         """Get a specific item"""
+        copy = self.filter(*conditions, **expressions) if conditions or expressions else self.copy()
+        # There is no need to look further
+        # than a second matching record
+        records = copy[:2]._fetch_all()
+        if len(records) > 1:
+            raise Exception(f"Received too many values. You should use filter instead in such as filter({expressions})")
+        return records
+
+    def batch(self, queries):
+        """
+        Run several filters on the records at once and return
+        the records of each one by name. The records are read
+        once for all the filters and a filter that appears
+        in several queries is only compared once per record
+
+        Example
+        -------
+
+            manager.batch({
+                'jenners': {'surname': 'Jenner'},
+                'young_jenners': {'surname': 'Jenner', 'age__lt': 23}
+            })
+            -> {'jenners': [...], 'young_jenners': [...]}
+        """
+        self._check_not_sliced('batch')
+        compiled = {}
+        for name, expressions in queries.items():
+            # The filters of the queryset apply
+            # to each one of the queries
+            compiled[name] = self._lookups + self.functions.compile(**expressions)
+        records = self.functions.db_data
+        if self._conditions:
+            # The records that match the Q operators
+            # are the ones the queries run on
+            condition = ConditionTree(Operators.AND, [condition.compile() for condition in self._conditions])
+            records = operators.execute(records, condition)
+        return self.functions.batch(records, compiled)
+
+    def in_bulk(self, ids=None):
+        """
+        Return a dict mapping each of the given ids to its record.
+        The cost only depends on the number of ids that are requested
+
+        Example
+        -------
+
+            manager.in_bulk(['1', '2']) -> {1: {...}, 2: {...}}
+        """
+        return self.functions.in_bulk(ids)
+
+    def order_by(self, field):
+        """
+        Return the records sorted on the field. Use -field
+        to sort them in descending order
+
+        Example
+        -------
+
+            manager.order_by('-age')
+        """
+        self._check_not_sliced('order_by')
         copy = self.copy()
-        copy.functions.iterator(**expressions)
-        if len(copy.functions.new_queryset) > 1:
-            raise Exception(f"Received too many values. Got {len(copy.functions.new_queryset)}. You should use filter instead in such as filter({expressions})")
-        return copy.functions.new_queryset
+        copy._ordering = field
+        return copy
+
+    def create_index(self, field, kind='hash'):
+        """
+        Creates an index on a field of the records. Nested fields are
+        separated with a double underscore e.g. location__country.
+        The filters on the field then use the index instead of
+        scanning all the records
+
+        The 'hash' kind answers exact, eq and in lookups. The 'sorted'
+        kind answers gt, gte, lt and lte lookups and order_by. The 'text'
+        kind narrows contains and icontains lookups and answers search
+        lookups e.g. name__search='kendall OR kylie'. The 'trigram' kind
+        narrows contains, icontains, startswith, endswith, iexact and
+        re lookups with a literal prefix. A list of fields
+        creates a composite index that answers the exact lookups on a
+        prefix of the fields
+
+        Example
+        -------
+
+            manager.create_index('location__country')
+            manager.get(location__country='USA')
+
+            manager.create_index('age', kind='sorted')
+            manager.filter(age__gte=21, age__lt=30)
+
+            manager.create_index(['name', 'surname'])
+            manager.filter(name='Kendall', surname='Jenner', age__gt=20)
+        """
+        return self.functions.create_index(field, kind=kind)
+
+    def drop_index(self, field, kind='hash'):
+        """Removes the index of the given kind on the field"""
+        return self.functions.drop_index(field, kind=kind)
 
     def count(self):
         """Return the number of items in the queryset"""
-        copy = self.copy()
-        if copy.functions.new_queryset:
-            return len(copy.functions.new_queryset)
-        return len([])
+        return len(self)
 
     def first(self):
-        """Return the first item of the queryset"""
-        copy = self.copy()
-        if copy.functions.has_new_queryset:
-            copy.functions.new_queryset = copy.functions.new_queryset[:1]
-        else:
-            copy.functions.new_queryset = copy.functions.db_data[:1]
-        return copy
+        """Return the first record of the queryset, not a queryset
+        of it. An empty queryset is returned when there is none
+
+        Example
+        -------
+
+            manager.filter(surname='Jenner').first() -> {name: Kendall, ...}
+        """
+        records = list(self[:1])
+        return records[0] if records else self.none()
 
     def last(self):
-        """Return the last item of the queryset"""
-        copy = self.copy()
-        if copy.functions.has_new_queryset:
-            copy.functions.new_queryset = copy.functions.new_queryset[-1]
-        else:
-            copy.functions.new_queryset = copy.functions.db_data[-1]
-        return copy
+        """Return the last record of the queryset, not a queryset
+        of it. An empty queryset is returned when there is none"""
+        records = self._fetch_all()
+        return records[-1] if records else self.none()
 
     def exclude(self, *fields):
-        """Run a query only on a specific set of fields"""
+        """Return the records without the given fields"""
         copy = self.copy()
-        constructed_record = {}
-        new_queryset = []
-        query = copy.functions.new_queryset if copy.functions.new_queryset \
-                            else copy.functions.db_data
-        for record in query:
-            for key, value in record.items():
-                if key not in fields:
-                    constructed_record.update({key: value})
-                    new_queryset.append(constructed_record)
-            constructed_record = {}
-        copy.functions.new_queryset = new_queryset
+        copy._projections.append(('exclude', fields))
         return copy
 
     def include(self, *fields):
-        """Run a query only on a specific set of fields"""
+        """Return the records with only the given fields"""
         copy = self.copy()
-        constructed_record = {}
-        new_queryset = []
-        query = copy.functions.new_queryset if copy.functions.new_queryset \
-                            else copy.functions.db_data
-        for record in query:
-            for key, value in record.items():
-                if key in fields:
-                    constructed_record.update({key: value})
-                    new_queryset.append(constructed_record)
-            constructed_record = {}
-        copy.functions.new_queryset = new_queryset
+        copy._projections.append(('include', fields))
         return copy
 
     def annotate(self, *functions, **aliases):
@@ -130,8 +233,7 @@ class Manager(QuerySet):
         Annotates each record within a queryset with
         a new field with the function that was passed
         """
-        copy = self.copy()
-        query = copy.functions.new_queryset if copy.functions.new_queryset else copy.functions.db_data
+        query = self._fetch_all()
         records = []
         if functions:
             for function in functions:
@@ -144,10 +246,10 @@ class Manager(QuerySet):
         return records
 
     def aggregate(self, *args):
-        copy = self.copy()
+        query = self._fetch_all()
         results = []
         for klass in args:
-            results.append(klass(copy.functions.new_queryset))
+            results.append(klass(query))
         if len(results) == 1:
             return results[0]
         return results
@@ -1,7 +1,8 @@
-import re
+from itertools import islice
 
-from django_no_sql.db.errors import KeyExistError
-from django_no_sql.db.functions import Functions, F
+from django_no_sql.db import errors
+# F is imported from this module by existing code
+from django_no_sql.db.functions import F, Lookup  # noqa: F401
 
 
 class Operators:
@@ -13,127 +14,215 @@ class Operators:
 
         Suppose want to do something like this: get the values
         where a = 1 or a = 2.
-        
+
         We would use an Operator such as OR where
-        .filter(OR(a=1, a=2)) would be resolved into a logical query
+        .filter(Q(a=1) | Q(a=2)) would be resolved into a logical query
         for retrieving the data from the database
 
-        The expressions of the operators are resolved within themselves
-        and their data by the F function.
+        The operators are combined with &, | and ~ into a tree which is
+        compiled once into a single predicate. The predicate stops as
+        soon as the result is known: an AND at the first false
+        condition and an OR at the first true one.
+
+        When the records have indexes, the tree is first resolved on
+        the ids returned by the indexes: an AND intersects them, an OR
+        unites them and a NOT takes the ids that are not part of them.
+        The records are then only compared when an index could not
+        tell exactly which ones match and at most one scan is needed.
+
+    Parameters
+    ----------
+
+        children (Operators): other operators to combine
+        expressions: the filters to apply e.g. name='Kendall' or age__gt=20
+
+    Example
+    -------
+
+        manager.filter(Q(name='Kendall') | Q(name='Kylie'))
+        manager.filter(OR(age__lt=20, age__gt=30), ~Q(location__state='Arizona'))
+    """
+    AND = 'AND'
+    OR = 'OR'
+
+    connector = AND
 
-        These are done by the .resolve() and .evaluate_expressions() definitions.
+    def __init__(self, *children, **expressions):
+        for child in children:
+            if not isinstance(child, Operators):
+                raise errors.DatabaseError(f'"{child}" should be an instance of Q')
+        self.children = list(children) + list(expressions.items())
+        self.negated = False
+
+    def __repr__(self):
+        children = ', '.join(repr(child) for child in self.children)
+        template = '<Q: NOT (%s: %s)>' if self.negated else '<Q: (%s: %s)>'
+        return template % (self.connector, children)
+
+    def _combine(self, other, connector):
+        if not isinstance(other, Operators):
+            raise errors.DatabaseError(f'"{other}" should be an instance of Q')
+        combined = Q()
+        combined.connector = connector
+        combined.children = [self, other]
+        return combined
+
+    def __and__(self, other):
+        return self._combine(other, self.AND)
+
+    def __or__(self, other):
+        return self._combine(other, self.OR)
+
+    def __invert__(self):
+        negated = Q()
+        negated.connector = self.connector
+        negated.children = list(self.children)
+        negated.negated = not self.negated
+        return negated
+
+    @property
+    def is_flat(self):
+        """Whether the operator is an AND of simple
+        expressions which are regular filters"""
+        return self.connector == self.AND and not self.negated and \
+                    all(not isinstance(child, Operators) for child in self.children)
+
+    @property
+    def expressions(self):
+        """The expressions of a flat operator"""
+        return [child for child in self.children if not isinstance(child, Operators)]
+
+    def compile(self):
+        """Compiles the operator and its children
+        into a tree of conditions"""
+        children = []
+        for child in self.children:
+            if isinstance(child, Operators):
+                children.append(child.compile())
+            else:
+                children.append(Condition(Lookup(*child)))
+        if len(children) == 1 and not self.negated:
+            return children[0]
+        return ConditionTree(self.connector, children, negated=self.negated)
+
+
+class Q(Operators):
+    """Combines filters with & (and), | (or) and ~ (not)"""
+
+
+class AND(Q):
+    """All the filters and operators should be true"""
+    connector = Operators.AND
+
+
+class OR(Q):
+    """At least one of the filters and operators should be true"""
+    connector = Operators.OR
+
+
+class NOT(Q):
+    """The filters and operators should not all be true"""
+    def __init__(self, *children, **expressions):
+        super().__init__(*children, **expressions)
+        self.negated = True
+
+
+class Condition:
+    """
+    A single compiled lookup of a tree of conditions
+    """
+    def __init__(self, lookup):
+        self.lookup = lookup
+        self.predicate = lookup.predicate
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.lookup.expression})'
+
+    def search(self, records):
+        """Returns the ids of the records that match the lookup and
+        whether they match exactly or only have to be compared, or
+        None when no index can answer the lookup"""
+        if self.lookup.is_reference:
+            return None
+        candidates = None
+        for index in getattr(records, 'indexes', {}).values():
+            if not index.match([self.lookup]):
+                continue
+            record_ids = index.search_lookups([self.lookup])
+            if record_ids is None:
+                continue
+            if index.exact:
+                return record_ids, True
+            candidates = (record_ids, False)
+        return candidates
+
+
+class ConditionTree:
+    """
+    Conditions joined by AND or OR and which can be negated. The
+    simple conditions are compared before the nested trees
     """
-    # keys_dict = []
-    # values_to_search = []
-    # functions = Functions()
-    # # filter_dict = dict()
-
-    # def __init__(self, *args):
-    #     self.args = args
-    #     self.filter_items = []
-
-    # def resolve(self, data):
-    #     cases = []
-
-    #     operator_type = self.filter_items[-1]
-    #     if not operator_type:
-    #         pass
-        
-    #     self.functions.db_data = data
-    #     print(data)
-
-    #     # for item in data:
-    #     #     for filter_element in self.keys_dict:
-    #     #         pass
-
-    # def decompose(self, *args, operator=None):
-    #     """Decompose each string into a dictionnary or a list
-    #     of lists containing each items separately
-    #     """
-    #     for arg in args:
-    #         parameter, value = arg.split('=')
-    #         self.keys_dict.append(parameter)
-    #         self.values_to_search.append(value)
-    #         # self.filter_dict.update({parameter: value, 'operator': ''})
-    #     return [self.keys_dict, self.values_to_search, operator]
-    #     # return self.filter_dict
-    
-    # def __repr__(self):
-    #     return f'<{self.__class__.__name__}: {self.filter_items}>'
-
-    # def __unicode__(self):
-    #     return self.__str__()
-
-    # def __str__(self):
-    #     return str(self.filter_items)
-
-    functions = Functions()
-
-    expressions = []
-    searched_values = []
-
-    key_expressions = ['gt', 'lt', 'gte', 'lte', 'eq']
-
-    def __init__(self, *expressions):
-        # First, we separate the expressions
-        # from their equal sign e.g. age=14
-        # .. [age] [14]
-        for expression in expressions:
-            decomposed_expressions = self.functions
-
-        # Second, if the decomposed expression
-        # has a __ in it, we also have to decompose
-        # these elements e.g. age__gt
-        # .. [age, gt]
-        decomposed_expressions = [self.functions.simple_decompose(expression) \
-                                    for expression in self.expressions]
-        
-        # Finally, we can start working
-        # the decomposed elements -; we first
-        # create an array of row objects
-        field_objects = []
-        for decomposed_expression in decomposed_expressions:
-            for expression in decomposed_expression:
-                # When the item is a database field,
-                # we an create an F object with it
-                if expression not in self.key_expressions:
-                    f_instance = F(expression)
-                else:
-                    # Otherwise, apply the sign to the
-                    # global variable sign
-                    f_instance.sign = expression
-            # f_instance.resolve(data=[{'age': 16}])
-            field_objects.append(f_instance)
-
-        # Resolve the data for each object
-        for field_object in field_objects:
-            field_object.resolve(data=[{'age': 16}])
-
-        self.field_objects = field_objects
-
-    def decompose(self, expression):
-        """Decomposes an expression based on the equals sign"""
-        if '=' in expression:
-            exp, value = expression.split('=')
-            self.expressions.append(exp)
-            self.searched_values.append(value)
-
-    def evaluate_expressions(self, data=None, operator=None):
-        """A function that evaluates the decomposed expressions
-        in regards to the data that is passed here
-        """
-        pass
+    def __init__(self, connector, children, negated=False):
+        self.connector = connector
+        self.negated = negated
+        self.children = sorted(children, key=lambda child: isinstance(child, ConditionTree))
+        self.predicate = self._build_predicate()
 
     def __repr__(self):
-        return str(self.field_objects)
-
-# class AND(Operators):
-#     def __and__(self, f):
-#         # field = F(f)
-#         # field.resolve(data=None)
-#         decomposed_fields = [decomposed_field for field in self.field_objects]
-#         print(decomposed_fields)
-
-# class OR(Operators):
-#     def __or__(self, f):
-#         pass
+        template = 'NOT (%s: %s)' if self.negated else '(%s: %s)'
+        return template % (self.connector, ', '.join(repr(child) for child in self.children))
+
+    def _build_predicate(self):
+        predicates = [child.predicate for child in self.children]
+        if self.connector == Operators.OR:
+            predicate = lambda record: any(check(record) for check in predicates)
+        else:
+            predicate = lambda record: all(check(record) for check in predicates)
+        if self.negated:
+            return lambda record: not predicate(record)
+        return predicate
+
+    def search(self, records):
+        """Resolves the tree on the ids of the records returned by
+        the indexes. The result is the same as Condition.search"""
+        results = [child.search(records) for child in self.children]
+        if self.connector == Operators.OR:
+            # A single condition that no index can
+            # answer means that all the records
+            # have to be compared
+            if any(result is None for result in results):
+                return None
+            record_ids = set().union(*(ids for ids, _ in results))
+            exact = all(exact for _, exact in results)
+        else:
+            known = sorted((result for result in results if result is not None), key=lambda result: len(result[0]))
+            if not known:
+                return None
+            record_ids = set(known[0][0])
+            for ids, _ in known[1:]:
+                record_ids &= ids
+            exact = len(known) == len(results) and all(exact for _, exact in known)
+
+        if self.negated:
+            if not exact:
+                return None
+            return set(records.ids) - record_ids, True
+        return record_ids, exact
+
+
+def iterate(records, condition):
+    """Yields the records that match the compiled condition"""
+    result = condition.search(records) if getattr(records, 'indexes', None) else None
+    if result is not None:
+        record_ids, exact = result
+        records = records.select(record_ids)
+        if exact:
+            yield from records
+            return
+    yield from filter(condition.predicate, records)
+
+
+def execute(records, condition, limit=None):
+    """Returns the records that match the compiled condition.
+    The scan stops once `limit` records were found"""
+    return list(islice(iterate(records, condition), limit))
@@ -0,0 +1,173 @@
+"""A module that compares the records of large queries with their
+lookups on several processes. The records are split in contiguous
+chunks and each process returns the positions of the records of
+its chunks that match
+"""
+
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# The records of the scans in the processes of
+# the pool. They are set once when the pool
+# forks and shared with the parent
+_records = None
+
+
+def _initialize(records):
+    global _records
+    _records = records
+
+
+def _scan(expressions, start, stop):
+    # The compiled predicates are closures that cannot be
+    # sent to the processes so the lookups are compiled
+    # again from their expressions
+    from django_no_sql.db.functions import Lookup
+    records = _records
+    predicates = [Lookup(expression, value).predicate for expression, value in expressions]
+    return [position for position in range(start, stop) \
+                if all(predicate(records[position]) for predicate in predicates)]
+
+
+def chunk_bounds(total, chunks):
+    """Returns the start and stop of `chunks`
+    contiguous chunks of about the same size"""
+    chunks = max(min(chunks, total), 1)
+    size, remainder = divmod(total, chunks)
+    bounds = []
+    start = 0
+    for chunk in range(chunks):
+        stop = start + size + (1 if chunk < remainder else 0)
+        bounds.append((start, stop))
+        start = stop
+    return bounds
+
+
+def is_available():
+    """Whether the processes can be forked. Forked processes share
+    the records of the parent instead of receiving a copy of them
+    which is the only way the scan is faster than a serial one"""
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+class ScanPool:
+    """
+    A pool of processes that is kept between the queries
+
+    Description
+    -----------
+
+        The processes are forked with the records they compare. The
+        pool is reused by the next scans as long as they run on the same
+        records and the records were not written to since, which the
+        version of a RecordStore tells. Otherwise the pool is replaced.
+
+        Records without a version, such as a plain list, cannot tell
+        whether they changed and always get a new pool.
+
+    Example
+    -------
+
+        scan_pool.filter(records, [('age__gte', 21)], workers=4)
+        scan_pool.close()
+    """
+    def __init__(self):
+        self.workers = None
+        self.created = 0
+        self._executor = None
+        self._records = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}(workers={self.workers}, created={self.created})>'
+
+    def _is_current(self, records, workers):
+        return self._executor is not None and records is self._records and \
+                    self._version is not None and self._version == getattr(records, 'version', None) and \
+                        self.workers == workers
+
+    def _get_executor(self, records, workers):
+        if not self._is_current(records, workers):
+            self._shutdown()
+            self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'),
+                                                 initializer=_initialize, initargs=(records,))
+            # The pool keeps a reference to the records
+            # so that they are not replaced by other
+            # records that would have the same id
+            self._records = records
+            self._version = getattr(records, 'version', None)
+            self.workers = workers
+            self.created = self.created + 1
+        return self._executor
+
+    def filter(self, records, expressions, workers, chunks_per_worker=4):
+        """Returns the positions of the records that match
+        the expressions of the lookups"""
+        bounds = chunk_bounds(len(records), workers * chunks_per_worker)
+        with self._lock:
+            executor = self._get_executor(records, workers)
+            count = len(bounds)
+            results = executor.map(_scan, [expressions] * count, *zip(*bounds))
+            return [position for positions in results for position in positions]
+
+    def _shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+        self._executor = None
+        self._records = None
+        self._version = None
+
+    def close(self):
+        """Stops the processes of the pool"""
+        with self._lock:
+            self._shutdown()
+        return True
+
+
+scan_pool = ScanPool()
+
+atexit.register(scan_pool.close)
+
+
+def parallel_filter(records, lookups, workers=None, chunks_per_worker=4):
+    """
+    Returns the records that match all the lookups by comparing
+    contiguous chunks of the records on a pool of processes
+
+    Description
+    -----------
+
+        Starting the processes has a cost which is only worth paying
+        for large lists of records, which is why the processes of
+        scan_pool are kept for the next scans on the same records.
+        The lookups are compared in the order they are given and each
+        record stops at the first one that is false. The records are
+        returned in their original order.
+
+        When the processes cannot be forked, the records are
+        compared in the current process
+
+    Parameters
+    ----------
+
+        records (list): the records to compare
+        lookups (list): the compiled lookups of the query
+        workers (int, optional): the number of processes. Defaults to the number of cores
+        chunks_per_worker (int, optional): the number of chunks each process receives on average
+
+    Example
+    -------
+
+        parallel_filter(records, [Lookup('age__gte', 21)], workers=4)
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or not is_available():
+        return [record for record in records if all(lookup.predicate(record) for lookup in lookups)]
+
+    expressions = [(lookup.expression, lookup.value) for lookup in lookups]
+    positions = scan_pool.filter(records, expressions, workers, chunks_per_worker=chunks_per_worker)
+    return [records[position] for position in positions]
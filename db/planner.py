@@ -0,0 +1,589 @@
+"""A module that implements the cost based planner which chooses
+how the records that match the filters of a query are found: with
+a scan of all the records, with an index or with the intersection
+of several indexes
+"""
+
+import os
+import random
+import time
+from itertools import islice
+
+from django_no_sql.db.indexes import MISSING, SortedIndex, get_value
+from django_no_sql.db.parallel import is_available, parallel_filter
+
+# The share of the records that a lookup is
+# expected to keep when nothing is known
+# about the values of the field
+DEFAULT_SELECTIVITY = {
+    'exact': 0.05,
+    'eq': 0.05,
+    'iexact': 0.05,
+    'ne': 0.95,
+    'in': 0.1,
+    'gt': 0.33,
+    'gte': 0.33,
+    'lt': 0.33,
+    'lte': 0.33,
+    'contains': 0.1,
+    'icontains': 0.1,
+    'startswith': 0.05,
+    'endswith': 0.05,
+    're': 0.1,
+    'search': 0.05
+}
+
+# The cost of comparing a record with a
+# lookup relative to an exact comparison
+LOOKUP_COSTS = {
+    'iexact': 2,
+    'contains': 1.5,
+    'icontains': 2,
+    'startswith': 1.5,
+    'endswith': 1.5,
+    're': 5,
+    'search': 4
+}
+
+# The cost of using an index relative
+# to comparing a single record
+INDEX_COST = 10
+
+SAMPLE_SIZE = 1000
+
+
+class FieldStatistics:
+    """
+    Statistics about the values of a field computed from
+    a random sample of the records
+
+    Parameters
+    ----------
+
+        field (str): the path to the field e.g. location__country
+        records (list): the records to compute the statistics from
+
+    Example
+    -------
+
+        statistics = FieldStatistics('age', records)
+        statistics.cardinality -> 40
+        statistics.selectivity('gte', 30) -> 0.25
+    """
+    def __init__(self, field, records, sample_size=SAMPLE_SIZE):
+        self.field = field
+        self.total = len(records)
+
+        positions = range(self.total)
+        if self.total > sample_size:
+            # The sample is seeded so that the same
+            # records always give the same plans
+            positions = sorted(random.Random(self.total).sample(positions, sample_size))
+        path = field.split('__')
+        values = []
+        for position in positions:
+            value = get_value(records[position], path)
+            if value is not MISSING:
+                values.append(value)
+        self.sampled = len(positions)
+        self.count = len(values)
+
+        distinct = set()
+        for value in values:
+            try:
+                distinct.add(value)
+            except TypeError:
+                pass
+        # When nearly all the values of the sample are
+        # distinct, the field is considered unique
+        if self.count and len(distinct) >= 0.9 * self.count:
+            self.cardinality = max(round(len(distinct) * self.total / self.sampled), 1)
+        else:
+            self.cardinality = max(len(distinct), 1)
+
+        numbers = [value for value in values if SortedIndex.family_of(value) == 'number']
+        self.minimum = min(numbers, default=None)
+        self.maximum = max(numbers, default=None)
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}({self.field}, cardinality={self.cardinality})>'
+
+    def selectivity(self, lookup, value):
+        """Returns the estimated share of the records
+        that match the lookup"""
+        lookup = lookup or 'exact'
+        default = DEFAULT_SELECTIVITY.get(lookup, 0.5)
+        if not self.count:
+            return default
+
+        if lookup in ('exact', 'eq', 'iexact'):
+            return 1 / self.cardinality
+        if lookup == 'ne':
+            return 1 - 1 / self.cardinality
+        if lookup == 'in':
+            try:
+                return min(len(value) / self.cardinality, 1)
+            except TypeError:
+                return default
+
+        numeric = SortedIndex.family_of(value) == 'number' and self.minimum is not None
+        if lookup in ('gt', 'gte', 'lt', 'lte') and numeric:
+            if self.maximum == self.minimum:
+                return default
+            share = (value - self.minimum) / (self.maximum - self.minimum)
+            if lookup in ('gt', 'gte'):
+                share = 1 - share
+            return min(max(share, 0), 1)
+        return default
+
+
+def statistics_for(records, field):
+    """
+    Returns the statistics of the field. They are cached on the
+    record stores and computed again once the number of records
+    changed by more than a tenth
+    """
+    cache = getattr(records, 'statistics', None)
+    if cache is None:
+        return None
+    statistics = cache.get(field)
+    if statistics is None or abs(statistics.total - len(records)) > statistics.total / 10:
+        statistics = cache[field] = FieldStatistics(field, records)
+    return statistics
+
+
+class PredicateFilter:
+    """
+    Compares records with the lookups of a query, stopping at the
+    first one that is false, and reorders the lookups while the
+    records are scanned
+
+    Description
+    -----------
+
+        The number of records that reach and that fail each lookup are
+        counted. Every `reorder_every` records, the lookups are sorted
+        again on their cost divided by the share of the records they
+        discard so that the ones which are cheap and fail the most
+        records are compared first. The estimates of the planner are
+        used until enough records were compared.
+
+    Parameters
+    ----------
+
+        lookups (list): the compiled lookups in their estimated order
+        selectivities (list, optional): the estimated share of the records each lookup keeps
+
+    Example
+    -------
+
+        matches = PredicateFilter(lookups).filter(records)
+    """
+    reorder_every = 256
+
+    # The number of records the estimate
+    # of the planner is worth
+    prior_weight = 32
+
+    def __init__(self, lookups, selectivities=None, reorder_every=None):
+        if selectivities is None:
+            selectivities = [0.5] * len(lookups)
+        self.lookups = list(lookups)
+        # The compared and passed counts of each lookup
+        # starting from the estimate of the planner
+        self.compared = [self.prior_weight] * len(self.lookups)
+        self.passed = [selectivity * self.prior_weight for selectivity in selectivities]
+        self._estimated = list(self.passed)
+        self.costs = [Planner.lookup_cost(lookup) for lookup in self.lookups]
+        self.order = list(range(len(self.lookups)))
+        if reorder_every is not None:
+            self.reorder_every = reorder_every
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}({self.expressions})>'
+
+    @property
+    def expressions(self):
+        """The expressions in the order they are compared"""
+        return [self.lookups[position].expression for position in self.order]
+
+    @property
+    def stats(self):
+        statistics = {}
+        for position in self.order:
+            compared = self.compared[position] - self.prior_weight
+            passed = self.passed[position] - self._estimated[position]
+            statistics[self.lookups[position].expression] = {
+                'compared': compared,
+                'pass_rate': round(passed / compared, 3) if compared else None
+            }
+        return statistics
+
+    def _reorder(self):
+        def rank(position):
+            discarded = 1 - self.passed[position] / self.compared[position]
+            if discarded <= 0:
+                return float('inf')
+            return self.costs[position] / discarded
+        self.order.sort(key=rank)
+
+    def filter(self, records, limit=None):
+        """Returns the records that match all the lookups. The scan
+        stops once `limit` records were found"""
+        matches = self.matches(records)
+        try:
+            return list(islice(matches, limit))
+        finally:
+            matches.close()
+
+    def matches(self, records):
+        """Yields the records that match all the lookups"""
+        self._reorder()
+        predicates = [self.lookups[position].predicate for position in self.order]
+        # The number of records that failed at each
+        # position since the lookups were last ordered
+        failed = [0] * len(predicates)
+        compared = 0
+
+        try:
+            for record in records:
+                compared += 1
+                for position, predicate in enumerate(predicates):
+                    if not predicate(record):
+                        failed[position] += 1
+                        break
+                else:
+                    yield record
+
+                if compared == self.reorder_every:
+                    self._update(compared, failed)
+                    predicates = [self.lookups[position].predicate for position in self.order]
+                    failed = [0] * len(predicates)
+                    compared = 0
+        finally:
+            # The records compared before the scan
+            # was stopped are counted as well
+            if compared:
+                self._update(compared, failed)
+
+    def _update(self, compared, failed):
+        reached = compared
+        for position, failures in zip(self.order, failed):
+            if not reached:
+                break
+            self.compared[position] += reached
+            self.passed[position] += reached - failures
+            reached = reached - failures
+        self._reorder()
+
+
+class Plan:
+    """
+    The steps chosen by the planner to find the records that match the
+    lookups of a query. Running the plan records the number of rows and
+    the time of each step so that they can be compared to the estimates
+
+    Parameters
+    ----------
+
+        strategy (str): one of scan, index or intersection
+        total (int): the number of records the query runs on
+    """
+    # The number of processes that compare the records
+    # once at least parallel_threshold records remain
+    # after the indexes. None uses all the cores and
+    # 1, the default, compares them in this process
+    workers = 1
+    parallel_threshold = 200000
+
+    def __init__(self, strategy, total):
+        self.strategy = strategy
+        self.total = total
+        self.indexes = []
+        self.predicates = []
+        # The estimated share of the records
+        # that each predicate keeps
+        self.selectivities = []
+        self.estimated_rows = total
+        # The number of records expected
+        # to be returned by the indexes
+        self.candidate_rows = total
+        self.cost = 0
+        self.stages = []
+        self.rows = None
+        self.duration = None
+        self.predicate_filter = None
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}({self.strategy}, estimated_rows={round(self.estimated_rows)})>'
+
+    def __str__(self):
+        return self.explain()
+
+    def _stage(self, name, estimated_rows, rows, started):
+        self.stages.append({
+            'name': name,
+            'estimated_rows': round(estimated_rows),
+            'rows': rows,
+            'duration': time.perf_counter() - started
+        })
+
+    def _candidates(self, records):
+        """Returns the records that the indexes kept and the
+        lookups that still have to be compared to them"""
+        predicates = list(self.predicates)
+        selectivities = list(self.selectivities)
+        self.predicate_filter = None
+
+        record_ids = None
+        for index, lookups, estimate in self.indexes:
+            stage_started = time.perf_counter()
+            ids = index.search_lookups(lookups)
+            if ids is None:
+                # The index could not answer the lookups
+                # for these values after all
+                if index.exact:
+                    predicates.extend(lookups)
+                    selectivities.extend([0.5] * len(lookups))
+                continue
+            record_ids = ids if record_ids is None else record_ids & ids
+            self._stage(f'index {index.name}', estimate, len(ids), stage_started)
+
+        stage_started = time.perf_counter()
+        if record_ids is not None:
+            records = records.select(record_ids)
+            self._stage('fetch', self.candidate_rows, len(records), stage_started)
+        return records, predicates, selectivities
+
+    def use_processes(self, records, predicates, limit=None):
+        """Whether the records are compared on several processes
+        which is only worth it for large scans without limit and
+        when the processes can be forked"""
+        workers = self.workers or os.cpu_count() or 1
+        if workers == 1 or not predicates or limit is not None:
+            return False
+        if not is_available():
+            return False
+        return isinstance(records, list) and len(records) >= self.parallel_threshold
+
+    def execute(self, records, limit=None):
+        """Returns the records that match the lookups. When a limit
+        is given, the scan stops once enough records were found"""
+        self.stages = []
+        started = time.perf_counter()
+        records, predicates, selectivities = self._candidates(records)
+
+        stage_started = time.perf_counter()
+        if self.use_processes(records, predicates, limit):
+            matches = parallel_filter(records, predicates, workers=self.workers)
+            self._stage('parallel filter', self.estimated_rows, len(matches), stage_started)
+            self.rows = len(matches)
+            self.duration = time.perf_counter() - started
+            return matches
+
+        if not predicates:
+            if limit is not None:
+                matches = list(islice(records, limit))
+            else:
+                matches = records if isinstance(records, list) else list(records)
+        elif len(predicates) == 1:
+            predicate = predicates[0].predicate
+            if limit is not None:
+                matches = list(islice(filter(predicate, records), limit))
+            else:
+                matches = [record for record in records if predicate(record)]
+        else:
+            # Each record stops at the first predicate that is
+            # false and the predicates that discard the most
+            # records move to the front during the scan
+            self.predicate_filter = PredicateFilter(predicates, selectivities)
+            matches = self.predicate_filter.filter(records, limit=limit)
+        if predicates:
+            self._stage('filter', self.estimated_rows, len(matches), stage_started)
+
+        self.rows = len(matches)
+        self.duration = time.perf_counter() - started
+        return matches
+
+    def iterate(self, records):
+        """Yields the records that match the lookups as they are
+        found instead of returning the list of all of them"""
+        self.stages = []
+        started = time.perf_counter()
+        records, predicates, selectivities = self._candidates(records)
+
+        stage_started = time.perf_counter()
+        if not predicates:
+            matches = iter(records)
+        elif len(predicates) == 1:
+            matches = filter(predicates[0].predicate, records)
+        else:
+            self.predicate_filter = PredicateFilter(predicates, selectivities)
+            matches = self.predicate_filter.matches(records)
+
+        rows = 0
+        try:
+            for record in matches:
+                rows += 1
+                yield record
+        finally:
+            if self.predicate_filter is not None:
+                matches.close()
+            if predicates:
+                self._stage('filter', self.estimated_rows, rows, stage_started)
+            self.rows = rows
+            self.duration = time.perf_counter() - started
+
+    def explain(self):
+        """Returns a description of the plan and of its last run"""
+        lines = [f'{self.strategy.capitalize()} on {self.total} records (cost {round(self.cost, 1)})']
+        for index, lookups, estimate in self.indexes:
+            expressions = ', '.join(lookup.expression for lookup in lookups)
+            lines.append(f'  index {index.name}: {expressions} (estimated {round(estimate)} rows)')
+        if self.predicates:
+            expressions = ', '.join(lookup.expression for lookup in self.predicates)
+            lines.append(f'  filter: {expressions}')
+        if self.predicate_filter is not None and self.rows is not None:
+            expressions = ', '.join(self.predicate_filter.expressions)
+            lines.append(f'  observed filter order: {expressions}')
+
+        if self.rows is not None:
+            lines.append('Stages:')
+            for stage in self.stages:
+                lines.append(f"  {stage['name']}: estimated {stage['estimated_rows']} rows, actual {stage['rows']} rows, {stage['duration'] * 1000:.3f}ms")
+            lines.append(f'Total: estimated {round(self.estimated_rows)} rows, actual {self.rows} rows, {self.duration * 1000:.3f}ms')
+        return '\n'.join(lines)
+
+
+class Planner:
+    """
+    Chooses the cheapest way to find the records that match the
+    compiled lookups of a query
+
+    Description
+    -----------
+
+        The number of records that each lookup keeps is estimated with
+        the indexes when they can tell it cheaply and otherwise with the
+        statistics of the field (cardinality, minimum and maximum). The
+        cost of a scan, of each index and of the intersection of the
+        indexes that answer different lookups are then compared.
+
+        The lookups that still have to be compared to the records are
+        ordered so that the cheapest and most selective run first.
+
+    Parameters
+    ----------
+
+        records (list): the records the query runs on
+
+    Example
+    -------
+
+        plan = Planner(records).plan(lookups)
+        plan.execute(records) -> [...]
+        print(plan.explain())
+    """
+    def __init__(self, records):
+        self.records = records
+        self.total = len(records)
+        self.indexes = getattr(records, 'indexes', None) or {}
+
+    def selectivity(self, lookup):
+        if lookup.is_reference:
+            return 0.5
+        statistics = statistics_for(self.records, lookup.field)
+        if statistics is None:
+            return DEFAULT_SELECTIVITY.get(lookup.lookup or 'exact', 0.5)
+        return statistics.selectivity(lookup.lookup, lookup.value)
+
+    @staticmethod
+    def lookup_cost(lookup):
+        return LOOKUP_COSTS.get(lookup.lookup or 'exact', 1)
+
+    def order(self, lookups):
+        """Orders the lookups so that the ones that are cheap
+        and that discard the most records run first"""
+        def rank(lookup):
+            selectivity = self.selectivity(lookup)
+            if selectivity >= 1:
+                return float('inf')
+            return self.lookup_cost(lookup) / (1 - selectivity)
+        return sorted(lookups, key=rank)
+
+    def filter_cost(self, lookups, rows):
+        """The cost of comparing the rows with the lookups
+        knowing that a record stops at the first false one"""
+        cost = 0
+        share = 1
+        for lookup in lookups:
+            cost = cost + share * self.lookup_cost(lookup)
+            share = share * self.selectivity(lookup)
+        return rows * cost
+
+    def _options(self, lookups):
+        candidates = [lookup for lookup in lookups if not lookup.is_reference]
+        options = []
+        for index in self.indexes.values():
+            matched = index.match(candidates)
+            if not matched:
+                continue
+            estimate = index.estimate(matched)
+            if estimate is None:
+                estimate = self.total
+                for lookup in matched:
+                    estimate = estimate * self.selectivity(lookup)
+            options.append((index, matched, estimate))
+        return options
+
+    def _build(self, strategy, lookups, options):
+        plan = Plan(strategy, self.total)
+        plan.indexes = options
+
+        answered = []
+        rows = self.total
+        for index, matched, estimate in options:
+            if index.exact:
+                answered.extend(matched)
+            rows = rows * (estimate / self.total if self.total else 0)
+        remaining = self.order([lookup for lookup in lookups if lookup not in answered])
+
+        plan.predicates = remaining
+        plan.selectivities = [self.selectivity(lookup) for lookup in remaining]
+        plan.candidate_rows = rows
+        plan.cost = sum(INDEX_COST + estimate for _, _, estimate in options) + rows + \
+                        self.filter_cost(remaining, rows)
+        plan.estimated_rows = rows
+        for selectivity in plan.selectivities:
+            plan.estimated_rows = plan.estimated_rows * selectivity
+        return plan
+
+    def plan(self, lookups):
+        """Returns the cheapest plan for the lookups"""
+        best = self._build('scan', lookups, [])
+        if not self.indexes:
+            return best
+
+        options = self._options(lookups)
+        for option in options:
+            plan = self._build('index', lookups, [option])
+            if plan.cost < best.cost:
+                best = plan
+
+        # Intersect the exact indexes that answer different
+        # lookups, the most selective first, as long as
+        # each one makes the plan cheaper
+        chosen = []
+        answered = []
+        for option in sorted(options, key=lambda option: option[2]):
+            index, matched, _ = option
+            if not index.exact or any(lookup in answered for lookup in matched):
+                continue
+            if chosen:
+                plan = self._build('intersection', lookups, chosen + [option])
+                if plan.cost >= best.cost:
+                    break
+                best = plan
+            chosen.append(option)
+            answered.extend(matched)
+        return best
@@ -1,3 +1,6 @@
+from itertools import islice
+
+from django_no_sql.db import errors, operators
 from django_no_sql.db.functions import Functions
 
 
@@ -9,38 +12,299 @@ class EmptyQueryset:
 
 
 class QuerySet:
-    """ 
+    """
     A queryset represents of individual data retrieved
     from the database regrouped as a single item
 
+    Description
+    -----------
+
+        A queryset is lazy: filtering, projecting, ordering or slicing
+        it only records the operation on a copy. The records are read
+        once the queryset is iterated, its length is asked or it is
+        converted to a list. All the filters then run together in a
+        single pass over the records which stops as soon as the slice
+        of the queryset is full and the fields are projected on the
+        records that were kept
+
     Parameters
     ----------
 
         db_instance (obj, optionnal): a database instance. Defaults to None.
         query (list, optionnal): a list of values. Defaults to None.
     """
-    functions = Functions()
-
     def __init__(self, db_instance=None, query=None):
+        # Each queryset has its own functions so
+        # that the result of a query does not leak
+        # in the other querysets
+        self.functions = Functions()
         if db_instance:
             self.functions.db_data = db_instance.loaded_json_data
         else:
-            self.functions.new_queryset = query
+            self.functions.db_data = query if query is not None else []
+
+        self._lookups = []
+        # The Q operators that are not
+        # simple filters e.g. OR and NOT
+        self._conditions = []
+        self._projections = []
+        self._ordering = None
+        self._offset = 0
+        self._limit = None
+        self._result_cache = None
+        # The version of the records the result
+        # cache was computed from
+        self._result_version = None
+        # The results of the queries on the database
+        # shared by the manager and its querysets
+        self.cache = None
 
     def __repr__(self):
-        return str(self.functions.db_data)
+        records = list(self[:MAX_VALUES + 1])
+        if len(records) > MAX_VALUES:
+            records[-1] = '...remaining elements truncated...'
+        return f'{self.__class__.__name__}({records})'
 
     def __str__(self):
-        return str(self.functions.new_queryset or self.functions.db_data)
+        return str(self._fetch_all())
 
     def __iter__(self):
-        return iter(self.functions.new_queryset)
+        return iter(self._fetch_all())
+
+    def __len__(self):
+        return len(self._fetch_all())
+
+    def __bool__(self):
+        if self._cached_results() is not None:
+            return bool(self._result_cache)
+        return bool(self[:1]._fetch_all())
+
+    def __getitem__(self, key):
+        cached = self._cached_results()
+        if cached is not None and not isinstance(key, slice):
+            return cached[key]
+
+        if isinstance(key, int):
+            if key < 0:
+                return self._fetch_all()[key]
+            records = self[key:key + 1]._fetch_all()
+            if not records:
+                raise IndexError('QuerySet index out of range')
+            return records[0]
+
+        if not isinstance(key, slice):
+            raise TypeError(f'QuerySet indices must be integers or slices, not {type(key).__name__}')
+
+        start, stop = key.start or 0, key.stop
+        if key.step is not None or start < 0 or (stop is not None and stop < 0):
+            return self._fetch_all()[key]
+
+        # The slice is taken on the records
+        # that the current slice returns
+        current_stop = None if self._limit is None else self._offset + self._limit
+        new_start = self._offset + start
+        new_stop = None if stop is None else self._offset + stop
+        if current_stop is not None:
+            new_stop = current_stop if new_stop is None else min(new_stop, current_stop)
+        if new_stop is not None:
+            new_start = min(new_start, new_stop)
+
+        copy = self.copy()
+        copy._offset = new_start
+        copy._limit = None if new_stop is None else new_stop - new_start
+        if cached is not None:
+            # The slice of an evaluated queryset
+            # does not need to be run again
+            copy._result_cache = cached[key]
+            copy._result_version = self._result_version
+        return copy
+
+    @property
+    def is_sliced(self):
+        return self._offset != 0 or self._limit is not None
+
+    def _check_not_sliced(self, operation):
+        if self.is_sliced:
+            raise errors.DatabaseError(f'Cannot use {operation} once a slice of the queryset was taken')
+
+    def _project(self, record):
+        for kind, fields in self._projections:
+            if kind == 'include':
+                record = {key: value for key, value in record.items() if key in fields}
+            else:
+                record = {key: value for key, value in record.items() if key not in fields}
+        return record
+
+    def _condition(self):
+        """The filters and the Q operators of
+        the queryset as a single condition"""
+        children = [operators.Condition(lookup) for lookup in self._lookups]
+        children.extend(condition.compile() for condition in self._conditions)
+        return operators.ConditionTree(operators.Operators.AND, children)
+
+    def _filter(self, records, limit=None):
+        if self._conditions:
+            return operators.execute(records, self._condition(), limit=limit)
+        if self._lookups:
+            return self.functions.execute(records, self._lookups, limit=limit)
+        return list(islice(records, limit))
+
+    def _execute(self):
+        """Runs all the operations of the queryset
+        in a single pass over the records"""
+        records = self.functions.db_data
+        if not records:
+            return []
+
+        stop = None if self._limit is None else self._offset + self._limit
+        if self._ordering is not None:
+            # The records have to be sorted
+            # before the slice can be taken
+            if self._lookups or self._conditions:
+                records = self._filter(records)
+            records = self.functions.order_by(self._ordering, query=records)[self._offset:stop]
+        else:
+            records = self._filter(records, limit=stop)[self._offset:]
+
+        if self._projections:
+            return [self._project(record) for record in records]
+        return records
+
+    def _cache_key(self):
+        """The operations of the queryset in a form that does not
+        depend on the order or the spelling of the filters"""
+        lookups = []
+        for lookup in self._lookups:
+            name = 'exact' if lookup.lookup in (None, 'eq') else lookup.lookup
+            lookups.append((lookup.field, name, repr(lookup.value)))
+        conditions = tuple(sorted(repr(condition) for condition in self._conditions))
+        projections = tuple((kind, tuple(fields)) for kind, fields in self._projections)
+        return (tuple(sorted(lookups)), conditions, projections, self._ordering, self._offset, self._limit)
+
+    def _cached_results(self):
+        """Returns the records of the last evaluation of the queryset
+        or None when the records were written to since then"""
+        if self._result_cache is not None and \
+                self._result_version != getattr(self.functions.db_data, 'version', None):
+            self._result_cache = None
+        return self._result_cache
+
+    def _fetch_all(self):
+        if self._cached_results() is None:
+            version = getattr(self.functions.db_data, 'version', None)
+            self._result_version = version
+            if self.cache is None or version is None:
+                self._result_cache = self._execute()
+            else:
+                key = self._cache_key()
+                cached = self.cache.get(key, version)
+                if cached is None:
+                    result = self._execute()
+                    # The cache keeps its own immutable copy so that
+                    # changing a result does not change the next ones.
+                    # The projected records are not the ones of the
+                    # database and are copied for the same reason
+                    if self._projections:
+                        cached = tuple(dict(record) for record in result)
+                    else:
+                        cached = tuple(result)
+                    self.cache.set(key, version, cached, projected=bool(self._projections))
+                elif self._projections:
+                    result = [dict(record) for record in cached]
+                else:
+                    result = list(cached)
+                self._result_cache = result
+            self.functions.new_queryset = self._result_cache
+        return self._result_cache
+
+    def iterator(self, chunk_size=2000):
+        """
+        Yields the records of the queryset without keeping them
+        in the queryset. The records are read, filtered and
+        projected `chunk_size` at a time so that large results
+        can be consumed with a constant amount of memory and
+        the first records are available before the scan ends
+
+        Description
+        -----------
+
+            An ordered queryset still has to read all the records
+            that match in order to sort them before the first one
+            can be returned
+
+        Example
+        -------
+
+            for record in manager.filter(location__country='USA').iterator(chunk_size=500):
+                writer.writerow(record)
+        """
+        if chunk_size is None or chunk_size <= 0:
+            raise ValueError('The chunk size should be strictly positive')
+        return self._iterator(chunk_size)
+
+    def _iterator(self, chunk_size):
+        cached = self._cached_results()
+        if cached is not None or self._ordering is not None:
+            yield from (cached if cached is not None else self._execute())
+            return
+
+        records = self.functions.db_data
+        if not records:
+            return
+
+        if self._conditions:
+            source = operators.iterate(records, self._condition())
+        elif self._lookups:
+            source = self.functions.iterate(records, self._lookups)
+        else:
+            source = iter(records)
+        stop = None if self._limit is None else self._offset + self._limit
+        matches = islice(source, self._offset, stop)
+
+        try:
+            while True:
+                chunk = list(islice(matches, chunk_size))
+                if not chunk:
+                    break
+                if self._projections:
+                    chunk = [self._project(record) for record in chunk]
+                yield from chunk
+        finally:
+            # Stops the scan when the records
+            # are not all consumed
+            if self._lookups or self._conditions:
+                source.close()
+
+    def explain(self):
+        """
+        Prints and returns the plan of the query: the indexes that
+        are used, the order in which the lookups are compared and
+        the estimated and actual rows and time of each stage
+
+        Example
+        -------
+
+            queryset = manager.filter(name='Kendall', age__gt=20)
+            queryset.explain()
+        """
+        # The query is run again without the cache
+        # since a cached result does not have a plan
+        queryset = self.copy()
+        queryset.cache = None
+        queryset._fetch_all()
+        plan = queryset.functions.last_plan
+        print(plan.explain() if plan is not None else 'No query was run')
+        return plan
 
     def copy(self):
-        """Creates a fresh QuerySet copy"""
-        # if self.functions.has_new_queryset:
-        #     klass = self.__class__(query=self.functions.new_queryset)
-        # else:
-        #     klass = self.__class__(query=self.functions.db_data)
-        klass = self.__class__(query=self.functions.new_queryset)
+        """Creates a fresh QuerySet copy with the
+        same operations that was not run yet"""
+        klass = self.__class__(query=self.functions.db_data)
+        klass._lookups = list(self._lookups)
+        klass._conditions = list(self._conditions)
+        klass._projections = list(self._projections)
+        klass._ordering = self._ordering
+        klass._offset = self._offset
+        klass._limit = self._limit
+        klass.cache = self.cache
         return klass
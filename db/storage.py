@@ -0,0 +1,440 @@
+"""A module that regroups the containers used to hold the
+records of a database once it has been loaded
+"""
+
+import collections.abc
+import mmap
+import re
+
+from django_no_sql.db import json_codecs
+from django_no_sql.db import errors as django_no_sql_errors
+from django_no_sql.db import indexes as django_no_sql_indexes
+
+WHITESPACE = re.compile(rb'[ \t\n\r]*')
+
+STRING = re.compile(rb'"(?:[^"\\]|\\.)*"', re.DOTALL)
+
+STRUCTURE = re.compile(rb'["{}\[\]]')
+
+SCALAR = re.compile(rb'[^,}\]\s]+')
+
+
+class IndexedRecords:
+    """
+    Mixin for the record stores that keeps the secondary indexes
+    created on the fields of the records up to date
+    """
+    def create_index(self, field, kind='hash'):
+        """
+        Creates an index on the field, or on a nested field such as
+        location__country, and builds it from the current records
+
+        Returns
+        -------
+
+            obj: the index that was created
+        """
+        index = django_no_sql_indexes.create_index(field, kind=kind)
+        if index.name not in self.indexes:
+            self.indexes[index.name] = index.build(self.items())
+        return self.indexes[index.name]
+
+    def drop_index(self, field, kind='hash'):
+        """Removes the index of the given kind on the field"""
+        if isinstance(field, (list, tuple)):
+            field, kind = ','.join(field), 'composite'
+        return self.indexes.pop(f'{field}_{kind}', None) is not None
+
+    def _update_indexes(self, record_id, old_record=None, new_record=None):
+        for index in self.indexes.values():
+            if old_record is not None:
+                index.remove(record_id, old_record)
+            if new_record is not None:
+                index.add(record_id, new_record)
+
+    def select(self, record_ids):
+        """Returns the records stored under the given
+        ids in the order of the store"""
+        positions = sorted(self._positions[record_id] for record_id in record_ids \
+                                if record_id in self._positions)
+        return [self[position] for position in positions]
+
+
+class RecordStore(IndexedRecords, list):
+    """
+    A list of records that remembers the id each record
+    was stored under in the data section of the database
+
+    Description
+    -----------
+
+        The records keep the order of the file so that the store can
+        be used wherever a list of records is expected. A hash map of
+        the ids to the positions of the records makes getting a record
+        by its id cost the same whatever the size of the database.
+
+        Records should be added or removed with put and delete so that
+        the ids and the positions stay in sync with the list.
+
+    Parameters
+    ----------
+
+        records (iterable, optional): the records of the database
+        ids (iterable, optional): the id of each record, in the same order
+
+    Example
+    -------
+
+        records = RecordStore([{name: Kendall}, {name: Hailey}], ['1', '2'])
+        records[0] -> {name: Kendall}
+        records.get('2') -> {name: Hailey}
+        records.in_bulk(['2', '5']) -> {2: {name: Hailey}}
+    """
+    def __init__(self, records=(), ids=()):
+        super().__init__(records)
+        self.ids = [str(record_id) for record_id in ids]
+        if len(self.ids) != len(self):
+            raise django_no_sql_errors.DatabaseError('Each record of the database should have an id')
+        self._positions = {record_id: index for index, record_id in enumerate(self.ids)}
+        self.indexes = {}
+        # The statistics of the fields
+        # used by the query planner
+        self.statistics = {}
+        # Incremented on each write so that
+        # the cached results can be invalidated
+        self.version = 0
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}(records={len(self)})>'
+
+    def position(self, record_id):
+        """Returns the index of the record stored
+        under the given id or None"""
+        return self._positions.get(str(record_id))
+
+    def get(self, record_id, default=None):
+        """Returns the record stored under the given id"""
+        try:
+            return self[self._positions[str(record_id)]]
+        except KeyError:
+            return default
+
+    def in_bulk(self, ids=None):
+        """
+        Returns a dict of the records stored under the given ids
+        in the order in which they were requested. Ids that do not
+        exist are left out. All the records are returned when no
+        ids are given
+        """
+        if ids is None:
+            return dict(zip(self.ids, self))
+        records = {}
+        for record_id in ids:
+            record_id = str(record_id)
+            index = self._positions.get(record_id)
+            if index is not None:
+                records[record_id] = self[index]
+        return records
+
+    def items(self):
+        """Returns the (id, record) pairs of the records as they are now"""
+        return list(zip(self.ids, self))
+
+    def put(self, record_id, record):
+        """Adds a record at the end of the store or replaces
+        the record that is stored under the same id"""
+        record_id = str(record_id)
+        index = self._positions.get(record_id)
+        if index is None:
+            self._positions[record_id] = len(self)
+            self.ids.append(record_id)
+            self.append(record)
+            old_record = None
+        else:
+            old_record = self[index]
+            self[index] = record
+        self.version = self.version + 1
+        if self.indexes:
+            self._update_indexes(record_id, old_record, record)
+        return True
+
+    def delete(self, record_id):
+        """Removes the record stored under the given id"""
+        record_id = str(record_id)
+        try:
+            index = self._positions.pop(record_id)
+        except KeyError:
+            return False
+        self.version = self.version + 1
+        if self.indexes:
+            self._update_indexes(record_id, old_record=self[index])
+        del self.ids[index]
+        del self[index]
+        for position in range(index, len(self.ids)):
+            self._positions[self.ids[position]] = position
+        return True
+
+
+class MappedRecords(IndexedRecords, collections.abc.Sequence):
+    """
+    A read only sequence of records backed by a memory mapped
+    JSON database file
+
+    Description
+    -----------
+
+        The file is scanned once in order to build an index of the
+        byte offsets of each record of the data section. A record is
+        only decoded when it is accessed which means that getting
+        a single record from a very large file costs a single decode.
+
+        The file itself is never written to: records that are inserted
+        or updated after the file was mapped are kept in memory in
+        place of their offsets.
+
+        Since the file is mapped read only, several processes opening
+        the same database share the pages of the operating system's
+        cache instead of each holding their own parsed copy.
+
+    Parameters
+    ----------
+
+        path (str): the path to the JSON file to map
+        key (str, optional): the key of the data section. Defaults to 'data'.
+
+    Example
+    -------
+
+        records = MappedRecords('path/to/database.json')
+        records[0] -> {name: Kendall, ...}
+        records.get('1') -> {name: Kendall, ...}
+    """
+    def __init__(self, path, key=None):
+        self.path = path
+        self.key = key or 'data'
+        self.schema = {}
+
+        self._ids = []
+        self._offsets = []
+        self._positions = {}
+        self.indexes = {}
+        self.statistics = {}
+        self.version = 0
+
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise django_no_sql_errors.SchemaError('The database you are trying to load is empty or does not contain a valid schema')
+        self._build_index()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}(records={len(self)})>'
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._load(offsets) for offsets in self._offsets[index]]
+        return self._load(self._offsets[index])
+
+    def __iter__(self):
+        for offsets in self._offsets:
+            yield self._load(offsets)
+
+    def __contains__(self, record):
+        return any(item == record for item in self)
+
+    @property
+    def ids(self):
+        """The ids of the records in the order of the file. The
+        list is kept up to date when records are inserted or deleted"""
+        return self._ids
+
+    def get(self, record_id, default=None):
+        """Returns the record stored under the given id"""
+        try:
+            index = self._positions[str(record_id)]
+        except KeyError:
+            return default
+        return self._load(self._offsets[index])
+
+    def position(self, record_id):
+        """Returns the index of the record stored
+        under the given id or None"""
+        return self._positions.get(str(record_id))
+
+    def in_bulk(self, ids=None):
+        """Returns a dict of the records stored under the given ids.
+        Only the requested records are decoded"""
+        if ids is None:
+            return dict(self.items())
+        records = {}
+        for record_id in ids:
+            record_id = str(record_id)
+            index = self._positions.get(record_id)
+            if index is not None:
+                records[record_id] = self._load(self._offsets[index])
+        return records
+
+    def items(self):
+        """Returns the (id, record) pairs of the records as they
+        are now. The records are only decoded while iterating"""
+        ids = list(self._ids)
+        offsets = list(self._offsets)
+        return ((record_id, self._load(entry)) for record_id, entry in zip(ids, offsets))
+
+    def put(self, record_id, record):
+        """Adds a record that is not part of the mapped file.
+        An existing record with the same id is replaced"""
+        record_id = str(record_id)
+        if record_id in self._positions:
+            return self.update(record_id, record)
+        self._positions[record_id] = len(self._offsets)
+        self._ids.append(record_id)
+        self._offsets.append(record)
+        self.version = self.version + 1
+        if self.indexes:
+            self._update_indexes(record_id, new_record=record)
+        return True
+
+    def update(self, record_id, record):
+        """Replaces the record stored under the given id"""
+        record_id = str(record_id)
+        try:
+            index = self._positions[record_id]
+        except KeyError:
+            return False
+        if self.indexes:
+            self._update_indexes(record_id, self._load(self._offsets[index]), record)
+        self._offsets[index] = record
+        self.version = self.version + 1
+        return True
+
+    def delete(self, record_id):
+        """Removes the record stored under the given id"""
+        record_id = str(record_id)
+        try:
+            index = self._positions.pop(record_id)
+        except KeyError:
+            return False
+        self.version = self.version + 1
+        if self.indexes:
+            self._update_indexes(record_id, old_record=self._load(self._offsets[index]))
+        del self._ids[index]
+        del self._offsets[index]
+        for position in range(index, len(self._ids)):
+            self._positions[self._ids[position]] = position
+        return True
+
+    def close(self):
+        """Releases the memory map and the underlying file"""
+        self._map.close()
+        self._file.close()
+
+    def _decode(self, start, end):
+        return json_codecs.loads(self._map[start:end])
+
+    def _load(self, offsets):
+        if isinstance(offsets, dict):
+            return offsets
+        return self._decode(*offsets)
+
+    def _error(self):
+        return django_no_sql_errors.DatabaseError('The file you are trying to open could not be read')
+
+    def _skip_whitespace(self, position):
+        return WHITESPACE.match(self._map, position).end()
+
+    def _peek(self, position):
+        position = self._skip_whitespace(position)
+        return self._map[position:position + 1], position
+
+    def _expect(self, position, token):
+        found, position = self._peek(position)
+        if found != token:
+            raise self._error()
+        return position + 1
+
+    def _read_key(self, position):
+        position = self._skip_whitespace(position)
+        match = STRING.match(self._map, position)
+        if match is None:
+            raise self._error()
+        return json_codecs.loads(match.group()), match.end()
+
+    def _skip_value(self, position):
+        """Returns the start and the end offsets of the
+        JSON value that starts at the given position"""
+        token, start = self._peek(position)
+        if token == b'"':
+            match = STRING.match(self._map, start)
+        elif token in (b'{', b'['):
+            depth = 0
+            position = start
+            while True:
+                match = STRUCTURE.search(self._map, position)
+                if match is None:
+                    raise self._error()
+                character = match.group()
+                if character == b'"':
+                    match = STRING.match(self._map, match.start())
+                    if match is None:
+                        raise self._error()
+                elif character in (b'{', b'['):
+                    depth = depth + 1
+                else:
+                    depth = depth - 1
+                    if depth == 0:
+                        return start, match.end()
+                position = match.end()
+        else:
+            match = SCALAR.match(self._map, start)
+        if match is None:
+            raise self._error()
+        return start, match.end()
+
+    def _next_separator(self, position):
+        """Returns whether the object continues after
+        the current member and the new position"""
+        token, position = self._peek(position)
+        if token == b',':
+            return True, position + 1
+        if token == b'}':
+            return False, position + 1
+        raise self._error()
+
+    def _build_index(self):
+        position = self._expect(0, b'{')
+        if self._peek(position)[0] == b'}':
+            raise django_no_sql_errors.SchemaError('The database you are trying to load is empty or does not contain a valid schema')
+
+        has_next = True
+        while has_next:
+            name, position = self._read_key(position)
+            position = self._expect(position, b':')
+            if name == self.key:
+                position = self._index_records(position)
+            else:
+                start, position = self._skip_value(position)
+                self.schema[name] = self._decode(start, position)
+            has_next, position = self._next_separator(position)
+
+    def _index_records(self, position):
+        position = self._expect(position, b'{')
+        token, end = self._peek(position)
+        if token == b'}':
+            return end + 1
+
+        has_next = True
+        while has_next:
+            record_id, position = self._read_key(position)
+            position = self._expect(position, b':')
+            start, position = self._skip_value(position)
+            self._positions[record_id] = len(self._offsets)
+            self._ids.append(record_id)
+            self._offsets.append((start, position))
+            has_next, position = self._next_separator(position)
+        return position
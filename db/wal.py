@@ -0,0 +1,457 @@
+"""A module that implements the append only write ahead log
+used to persist the changes made to a database without having
+to rewrite the whole JSON file on each change
+"""
+
+import collections
+import datetime
+import os
+import threading
+import time
+
+from django_no_sql.db import backends, json_codecs
+from django_no_sql.db import errors as django_no_sql_errors
+
+
+class WriteAheadLog:
+    """
+    An append only log stored next to the JSON database file
+    that records each insert, update, delete or schema change as
+    a single line of JSON
+
+    Description
+    -----------
+
+        Writing an entry costs the size of the entry and not the size
+        of the database. When the database is loaded, the entries are
+        replayed on top of the data of the JSON file. Entries only store
+        final values so replaying an entry twice gives the same result.
+
+        Entries are committed in groups: when other writers are waiting,
+        the first writer waits for the commit window during which they can
+        queue their entries, then writes the whole group with a single write
+        and fsync. A writer that is alone writes its entry right away. Each
+        writer only returns once its own entry is on the disk.
+
+    Parameters
+    ----------
+
+        database_path (str): the path to the JSON database file
+        sync (bool, optional): fsync the log after each write. Defaults to True.
+        commit_window (float, optional): how long in seconds entries are grouped
+
+    Example
+    -------
+
+        log = WriteAheadLog('path/to/database.json')
+        log.append('insert', record_id='5', record={'name': 'Kendall'})
+        list(log.entries()) -> [{op: insert, id: 5, record: {...}}]
+    """
+    suffix = '.wal'
+
+    # The log is renamed with this suffix while
+    # its entries are being folded in a new
+    # snapshot of the database
+    compacting_suffix = '.compacting'
+
+    operations = ['insert', 'update', 'delete', 'schema']
+
+    commit_window = 0.002
+
+    def __init__(self, database_path, sync=True, commit_window=None):
+        self.database_path = str(database_path)
+        self.path = self.database_path + self.suffix
+        self.compacting_path = self.path + self.compacting_suffix
+        self.sync = sync
+        if commit_window is not None:
+            self.commit_window = commit_window
+
+        # The number of groups that were written
+        # and the number of entries they contained
+        self.commits = 0
+        self.committed_entries = 0
+
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        # Only one thread at a time can write
+        # to the file or rotate it
+        self._io_lock = threading.Lock()
+        self._file = None
+
+        self._pending = []
+        self._sequence = 0
+        self._written = 0
+        self._flushing = False
+        # The number of threads waiting
+        # for their entries to be written
+        self._waiters = 0
+        # The tickets of the groups that
+        # could not be written
+        self._failures = []
+
+        # When the first entry that is not yet part of
+        # the snapshot was written, used to trigger
+        # compactions based on the age of the log
+        self._started = time.time() if self.size else None
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}({self.path})>'
+
+    @property
+    def size(self):
+        """The size of the log in bytes"""
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    @property
+    def average_group_size(self):
+        """The average number of entries written per commit"""
+        if not self.commits:
+            return 0
+        return self.committed_entries / self.commits
+
+    def _encode(self, operation, record_id=None, **payload):
+        if operation not in self.operations:
+            raise django_no_sql_errors.DatabaseError(f'"{operation}" is not a valid log operation. Use one of: {", ".join(self.operations)}')
+        entry = {'op': operation}
+        if record_id is not None:
+            entry['id'] = str(record_id)
+        entry.update(payload)
+        return json_codecs.dumps(entry) + '\n'
+
+    def enqueue(self, operation, record_id=None, **payload):
+        """
+        Queues a new entry for the next commit and returns its
+        ticket. The entry is only durable once wait() returns
+
+        Parameters
+        ----------
+
+            operation (str): one of insert, update, delete or schema
+            record_id (str, optional): the id of the record that was changed
+            payload: the values of the entry e.g. record={...} or field=..., value=...
+        """
+        line = self._encode(operation, record_id=record_id, **payload)
+        with self._lock:
+            self._pending.append(line)
+            self._sequence = self._sequence + 1
+            if self._started is None:
+                self._started = time.time()
+            return self._sequence
+
+    def wait(self, ticket):
+        """Blocks until the entry with the given ticket was written.
+        The first waiting thread writes the group for the others"""
+        with self._condition:
+            self._waiters = self._waiters + 1
+            try:
+                while self._written < ticket:
+                    if not self._flushing:
+                        self._flushing = True
+                        # The commit window is only worth
+                        # waiting for when other writers
+                        # can join the group
+                        grouped = self._waiters > 1
+                        break
+                    self._condition.wait()
+                else:
+                    self._raise_failure(ticket)
+                    return True
+            finally:
+                self._waiters = self._waiters - 1
+
+        try:
+            if grouped and self.commit_window and self.sync:
+                time.sleep(self.commit_window)
+            self.flush()
+        finally:
+            with self._condition:
+                self._flushing = False
+                self._condition.notify_all()
+        return True
+
+    def append(self, operation, record_id=None, **payload):
+        """Appends a new entry at the end of the log and
+        waits until it was written"""
+        return self.wait(self.enqueue(operation, record_id=record_id, **payload))
+
+    def _find_failure(self, ticket):
+        for first, last, error in self._failures:
+            if first <= ticket <= last:
+                return error
+        return None
+
+    def _raise_failure(self, ticket):
+        error = self._find_failure(ticket)
+        if error is not None:
+            raise django_no_sql_errors.DatabaseError(f'The entry could not be written to the log: {error}')
+
+    def is_written(self, ticket):
+        """Returns True once the entry with the given ticket was written,
+        False when it could not be written and None while it is queued"""
+        with self._lock:
+            if self._written < ticket:
+                return None
+            return self._find_failure(ticket) is None
+
+    def flush(self):
+        """Writes all the queued entries with a single write"""
+        with self._io_lock:
+            with self._lock:
+                group, self._pending = self._pending, []
+                first, last = self._written + 1, self._sequence
+            if not group:
+                return True
+
+            try:
+                if self._file is None:
+                    self._file = open(self.path, 'a', encoding='utf-8')
+                self._file.write(''.join(group))
+                self._file.flush()
+                if self.sync:
+                    os.fsync(self._file.fileno())
+            except OSError as error:
+                with self._condition:
+                    self._failures.append((first, last, error))
+                    self._written = last
+                    self._condition.notify_all()
+                raise django_no_sql_errors.DatabaseError(f'The entries could not be written to the log: {error}')
+
+            with self._condition:
+                self._written = last
+                self.commits = self.commits + 1
+                self.committed_entries = self.committed_entries + len(group)
+                self._condition.notify_all()
+        return True
+
+    @property
+    def age(self):
+        """The number of seconds since the oldest entry
+        of the log was written"""
+        if self._started is None:
+            return 0
+        return time.time() - self._started
+
+    def entries(self):
+        """
+        Yields the entries of the log in the order they were written
+        including the ones of a compaction that did not complete. A last
+        line that was only partially written (e.g. the process crashed
+        during the write) is ignored
+        """
+        for path in [self.compacting_path, self.path]:
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as log:
+                for line in log:
+                    if not line.endswith('\n'):
+                        break
+                    try:
+                        yield json_codecs.loads(line)
+                    except ValueError:
+                        break
+
+    def rotate(self):
+        """
+        Moves the current entries aside so that new entries are written
+        to a fresh log while a compaction is running. Returns the path
+        of the rotated log
+        """
+        self.flush()
+        with self._io_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if os.path.exists(self.path):
+                if os.path.exists(self.compacting_path):
+                    # A previous compaction did not complete:
+                    # keep its entries and add the new ones
+                    with open(self.compacting_path, 'a', encoding='utf-8') as rotated:
+                        with open(self.path, 'r', encoding='utf-8') as log:
+                            for line in log:
+                                if line.endswith('\n'):
+                                    rotated.write(line)
+                    os.remove(self.path)
+                else:
+                    os.replace(self.path, self.compacting_path)
+            with self._lock:
+                self._started = None if not self._pending else time.time()
+        return self.compacting_path
+
+    def discard_rotated(self):
+        """Removes the rotated log once its entries were
+        written to a new snapshot of the database"""
+        if os.path.exists(self.compacting_path):
+            os.remove(self.compacting_path)
+        return True
+
+    def close(self):
+        """Writes the queued entries and closes the log"""
+        self.flush()
+        with self._io_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def clear(self):
+        """Removes all the entries of the log"""
+        self.close()
+        for path in [self.path, self.compacting_path]:
+            if os.path.exists(path):
+                os.remove(path)
+        self._started = None
+        return True
+
+
+class Compactor:
+    """
+    Folds the entries of the write ahead log of a database into a
+    new snapshot of its JSON file
+
+    Description
+    -----------
+
+        The records and the schema are captured under the write lock of
+        the database which also rotates the log so that new writes go to
+        a fresh one. The snapshot is then written outside of the lock,
+        through a temporary file that atomically replaces the database.
+        Readers never take the lock and are therefore never blocked.
+
+        When started, a background thread runs a compaction each time
+        the log exceeds max_bytes or has entries older than max_age.
+
+    Parameters
+    ----------
+
+        database (obj): the loaded database instance to compact
+        max_bytes (int, optional): the size of the log that triggers a compaction
+        max_age (int, optional): the age in seconds of the log that triggers a compaction
+        interval (int, optional): how often in seconds the thread checks the triggers
+        history (int, optional): the number of compaction timings to keep
+
+    Example
+    -------
+
+        compactor = Compactor(database, max_bytes=1048576)
+        compactor.start()
+        compactor.stats -> {runs: 1, last_duration: 0.012, ...}
+    """
+    max_bytes = 4 * 1024 * 1024
+    max_age = 300
+    interval = 1
+
+    def __init__(self, database, max_bytes=None, max_age=None, interval=None, history=50):
+        self.database = database
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        if max_age is not None:
+            self.max_age = max_age
+        if interval is not None:
+            self.interval = interval
+
+        self.timings = collections.deque(maxlen=history)
+        self.last_error = None
+        self.runs = 0
+
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}(runs={self.runs}, running={self.is_running})>'
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def stats(self):
+        """Returns the timings of the compactions that were run"""
+        durations = [timing['duration'] for timing in self.timings]
+        return {
+            'runs': self.runs,
+            'last_duration': durations[-1] if durations else None,
+            'average_duration': sum(durations) / len(durations) if durations else None,
+            'max_duration': max(durations, default=None),
+            'last_error': self.last_error
+        }
+
+    def should_compact(self):
+        log = self.database.write_log
+        if log is None or not log.size:
+            return False
+        return log.size >= self.max_bytes or log.age >= self.max_age
+
+    def compact(self):
+        """
+        Runs a compaction and returns its timings or
+        None when there was nothing to compact
+        """
+        database = self.database
+        log = database._get_write_log()
+        with self._lock:
+            started_on = str(datetime.datetime.now())
+            started = time.perf_counter()
+            with database._write_lock:
+                if not log.size and not os.path.exists(log.compacting_path):
+                    return None
+                log_size = log.size
+                log.rotate()
+                # The entries of the rotated log that were
+                # not applied yet are part of the snapshot
+                database._apply_written()
+                schema = {key: value for key, value in database.schema.items() \
+                                if key != database.data_key}
+                records = database._capture_records()
+                number_of_records = len(database.record_ids)
+            captured = time.perf_counter()
+
+            schema['version'] = schema['version'] + 1
+            schema['modified_on'] = str(datetime.datetime.now())
+            backends.write_database(database.database_path, schema, records=records,
+                                    key=database.data_key, pretty=database.pretty_print)
+            log.discard_rotated()
+
+            with database._write_lock:
+                database.schema['version'] = schema['version']
+                database.schema['modified_on'] = schema['modified_on']
+
+            finished = time.perf_counter()
+            timing = {
+                'started_on': started_on,
+                'records': number_of_records,
+                'log_bytes': log_size,
+                'capture_duration': captured - started,
+                'write_duration': finished - captured,
+                'duration': finished - started
+            }
+            self.timings.append(timing)
+            self.runs = self.runs + 1
+        return timing
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                if self.should_compact():
+                    self.compact()
+            except Exception as error:
+                self.last_error = str(error)
+
+    def start(self):
+        """Starts compacting the database in a background thread"""
+        if self.is_running:
+            return self
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='django-no-sql-compactor', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Stops the background thread"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        return True
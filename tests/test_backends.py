@@ -1,7 +1,18 @@
-from django_no_sql.db import backends
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
 import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from django_no_sql.db import backends
 from django_no_sql.db.errors import DatabaseError
 
+TEST_DATABASE = os.path.join(os.path.dirname(__file__), 'database.json')
+
 class TestBackends(unittest.TestCase):
     def test_can_read_file(self):
         f = backends.file_reader('C:\\Users\\Pende\\Documents\\myapps\\django_no_sql\\db\\database.json')
@@ -10,7 +21,208 @@ class TestBackends(unittest.TestCase):
     def test_database_exists(self):
         with self.assertRaises(DatabaseError):
             backends.file_reader('C:\\Users\\Pende\\Documents\\myapps\\django_no_sql\\db\\databases.json')
-        
+
+
+class TestStreamReader(unittest.TestCase):
+    def setUp(self):
+        with open(TEST_DATABASE, 'r', encoding='utf-8') as f:
+            self.expected = json.load(f)
+
+    def test_yields_records(self):
+        reader = backends.StreamReader(TEST_DATABASE)
+        records = list(reader)
+        self.assertEqual(len(records), len(self.expected['data']))
+        self.assertEqual(records[0], ('1', self.expected['data']['1']))
+
+    def test_collects_schema(self):
+        # Use a tiny chunk size to make sure that values
+        # split across several reads are parsed correctly
+        reader = backends.StreamReader(TEST_DATABASE, chunk_size=7)
+        list(reader)
+        self.assertNotIn('data', reader.schema)
+        self.assertEqual(reader.schema['title'], self.expected['title'])
+        self.assertEqual(reader.schema['created_on'], self.expected['created_on'])
+        self.assertEqual(reader.schema['properties'], self.expected['properties'])
+
+    def test_numbers_split_across_chunks(self):
+        document = json.dumps({'created_on': 1603123456.789012, 'version': 12345,
+                               'data': {'1': {'height': 1.5e-3}}})
+        # Every chunk size puts the boundary at
+        # another position within the numbers
+        for chunk_size in range(1, 41):
+            with self.subTest(chunk_size=chunk_size):
+                reader = backends.StreamReader(fileobj=io.StringIO(document), chunk_size=chunk_size)
+                self.assertEqual(list(reader), [('1', {'height': 1.5e-3})])
+                self.assertEqual(reader.schema, {'created_on': 1603123456.789012, 'version': 12345})
+
+
+class TestFileCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'database.json')
+        shutil.copy(TEST_DATABASE, self.path)
+        backends.file_cache.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_cached_until_modified(self):
+        hits = backends.file_cache.hits
+        first = backends.file_reader(self.path)
+        second = backends.file_reader(self.path)
+        self.assertEqual(second, first)
+        self.assertEqual(backends.file_cache.hits, hits + 1)
+        # The records are shared with the cache
+        self.assertIs(second['data'], first['data'])
+
+        data = dict(first, title='Models')
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        self.assertEqual(backends.file_reader(self.path)['title'], 'Models')
+
+    def test_invalidated_by_writes(self):
+        first = backends.file_reader(self.path)
+        backends.write_database(self.path, dict(first, title='Models'))
+        self.assertNotIn(self.path, [key for key in backends.file_cache._entries])
+        self.assertEqual(backends.file_reader(self.path)['title'], 'Models')
+
+    def test_schema_is_copied(self):
+        first = backends.file_reader(self.path)
+        first['title'] = 'Models'
+        first['properties']['nickname'] = {}
+        second = backends.file_reader(self.path)
+        self.assertNotEqual(second['title'], 'Models')
+        self.assertNotIn('nickname', second['properties'])
+
+    def test_decoded_size(self):
+        path = os.path.join(self.directory, 'database.json.gz')
+        with open(TEST_DATABASE, 'r', encoding='utf-8') as f:
+            backends.write_database(path, json.load(f))
+        backends.file_reader(path)
+        self.assertGreater(backends.file_cache.current_bytes, os.path.getsize(path))
+
+    def test_byte_budget(self):
+        cache = backends.FileCache(max_bytes=os.path.getsize(self.path))
+        other = os.path.join(self.directory, 'database2.json')
+        shutil.copy(TEST_DATABASE, other)
+
+        cache.set(self.path, {})
+        cache.set(other, {})
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.evictions, 1)
+        self.assertIsNone(cache.get(self.path))
+        self.assertEqual(cache.get(other), {})
+
+
+class TestCompressedDatabases(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        with open(TEST_DATABASE, 'r', encoding='utf-8') as f:
+            self.expected = json.load(f)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_read_and_write(self):
+        for suffix in ['.json.gz', '.json.xz']:
+            with self.subTest(suffix=suffix):
+                path = os.path.join(self.directory, 'database' + suffix)
+                backends.write_database(path, self.expected)
+                self.assertIsNotNone(backends.get_compression(path))
+
+                self.assertEqual(backends.file_reader(path), self.expected)
+                reader = backends.StreamReader(path)
+                self.assertEqual(dict(reader), self.expected['data'])
+
+    def test_cannot_be_memory_mapped(self):
+        path = os.path.join(self.directory, 'database.json.gz')
+        backends.write_database(path, self.expected)
+        with self.assertRaises(DatabaseError):
+            backends.map_reader(path)
+
+    def test_search_for_database(self):
+        path = os.path.join(self.directory, 'database.json.xz')
+        backends.write_database(path, self.expected)
+        self.assertEqual(backends.resolve_path(self.directory, is_dir=True), path)
+
+    @unittest.skipIf(os.name == 'nt', 'The permissions of the files are POSIX ones')
+    def test_new_files_follow_the_umask(self):
+        path = os.path.join(self.directory, 'database.json')
+        umask = os.umask(0o022)
+        try:
+            backends.write_database(path, self.expected)
+        finally:
+            os.umask(umask)
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o644)
+
+
+class DatabaseHandler(BaseHTTPRequestHandler):
+    etag = '"v1"'
+
+    def do_GET(self):
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        with open(TEST_DATABASE, 'rb') as f:
+            body = gzip.compress(f.read())
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', self.etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestRemoteReader(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(('127.0.0.1', 0), DatabaseHandler)
+        cls.url = 'http://127.0.0.1:%s/database.json' % cls.server.server_address[1]
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_conditional_requests(self):
+        with open(TEST_DATABASE, 'r', encoding='utf-8') as f:
+            expected = json.load(f)
+
+        reader = backends.RemoteReader()
+        first = reader.read(self.url)
+        self.assertEqual(first, expected)
+
+        # The second request is answered with a 304
+        # and served from the local cache
+        second = reader.read(self.url)
+        self.assertEqual(second, first)
+        self.assertIs(second['data'], first['data'])
+        self.assertEqual(reader.stats['requests'], 2)
+        self.assertEqual(reader.stats['not_modified'], 1)
+
+    def test_schema_is_copied(self):
+        reader = backends.RemoteReader()
+        for read in [reader.read, reader.read, backends.file_reader]:
+            data = read(self.url)
+            self.assertEqual(data['title'], 'Celebrity')
+            data['title'] = 'Models'
+            data['properties']['nickname'] = {}
+        for read in [reader.read, backends.file_reader]:
+            self.assertEqual(read(self.url)['title'], 'Celebrity')
+            self.assertNotIn('nickname', read(self.url)['properties'])
+
+    def test_file_reader(self):
+        data = backends.file_reader(self.url)
+        self.assertEqual(data['title'], 'Celebrity')
+        self.assertIn('1', data['data'])
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,66 @@
+import unittest
+
+from django_no_sql.db.errors import DatabaseError
+from django_no_sql.db.managers import Manager
+from django_no_sql.db.operators import NOT, OR, Q
+from django_no_sql.db.storage import RecordStore
+
+COUNTRIES = ['USA', 'France', 'Italy']
+
+RECORDS = [{'name': f'name{i}', 'age': i % 50, 'country': COUNTRIES[i % 3]} for i in range(300)]
+
+
+class TestQ(unittest.TestCase):
+    def setUp(self):
+        self.records = RecordStore(RECORDS, [str(i) for i in range(300)])
+        self.manager = Manager(query=self.records)
+
+    def test_predicates(self):
+        queries = [
+            (Q(age=3) | Q(age=4), lambda record: record['age'] in (3, 4)),
+            (Q(age__lt=5) & ~Q(country='USA'), lambda record: record['age'] < 5 and record['country'] != 'USA'),
+            (OR(age=1, country='Italy'), lambda record: record['age'] == 1 or record['country'] == 'Italy'),
+            (NOT(age__gte=2, country='France'), lambda record: not (record['age'] >= 2 and record['country'] == 'France')),
+            (~(Q(age=3) | Q(age=4)) & Q(name__startswith='name1'),
+                lambda record: record['age'] not in (3, 4) and record['name'].startswith('name1'))
+        ]
+        for condition, check in queries:
+            with self.subTest(condition=condition):
+                expected = [record for record in RECORDS if check(record)]
+                self.assertEqual([record for record in RECORDS if condition.compile().predicate(record)], expected)
+                self.assertEqual(list(self.manager.filter(condition)), expected)
+
+    def test_indexes(self):
+        self.records.create_index('age')
+        self.records.create_index('country')
+        condition = ((Q(age=3) | Q(age=4)) & ~Q(country='USA')).compile()
+        record_ids, exact = condition.search(self.records)
+        self.assertTrue(exact)
+        self.assertEqual(self.records.select(record_ids),
+                         [record for record in RECORDS if record['age'] in (3, 4) and record['country'] != 'USA'])
+
+        # The indexes narrow the records that are compared
+        _, exact = (Q(age=3) & Q(name__endswith='3')).compile().search(self.records)
+        self.assertFalse(exact)
+        # An OR without an index on one side needs a scan
+        self.assertIsNone((Q(age=3) | Q(name__endswith='3')).compile().search(self.records))
+
+        queryset = self.manager.filter(Q(age=3) | Q(name__endswith='3'), ~Q(country='USA'))
+        expected = [record for record in RECORDS \
+                        if (record['age'] == 3 or record['name'].endswith('3')) and record['country'] != 'USA']
+        self.assertEqual(list(queryset), expected)
+
+    def test_simple_operators_are_planned(self):
+        queryset = self.manager.filter(Q(age=3, country='USA'), name__startswith='name')
+        self.assertEqual(len(queryset._lookups), 3)
+        self.assertEqual(queryset._conditions, [])
+
+    def test_invalid_condition(self):
+        with self.assertRaises(DatabaseError):
+            self.manager.filter({'age': 3})
+        with self.assertRaises(DatabaseError):
+            Q(age=3) | {'age': 4}
+
+
+if __name__ == "__main__":
+    unittest.main()
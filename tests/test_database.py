@@ -1,4 +1,7 @@
+import json
 import os
+import shutil
+import tempfile
 import unittest
 
 from django_no_sql.db.database import Database
@@ -7,6 +10,8 @@ from django_no_sql.db.managers import Manager
 
 PATH = 'C:\\Users\\Pende\\Documents\\myapps\\django_no_sql\\db\\database.json'
 
+TEST_DATABASE = os.path.join(os.path.dirname(__file__), 'database.json')
+
 class TestInlineCreation(unittest.TestCase):
     def setUp(self):
         self.database = Database(path_or_url=PATH)
@@ -77,5 +82,91 @@ class TestData(unittest.TestCase):
         with self.assertRaises(DatabaseError):
             Database(path_or_url=__file__)
 
+
+class TestStreamMode(unittest.TestCase):
+    def setUp(self):
+        self.database = Database(path_or_url=TEST_DATABASE, mode='stream')
+        self.schema = self.database.load_database()
+
+    def test_schema_has_no_data(self):
+        self.assertNotIn('data', self.schema)
+        self.assertEqual(self.database.model_name, 'Celebrity')
+
+    def test_records_are_loaded(self):
+        self.assertIs(self.database.manager.functions.db_data, self.database.loaded_json_data)
+
+        expected = Database(path_or_url=TEST_DATABASE)
+        expected.load_database()
+        self.assertEqual(self.database.loaded_json_data, expected.loaded_json_data)
+
+    def test_in_bulk(self):
+        records = self.database.manager.in_bulk(['2', '4'])
+        self.assertEqual([record['name'] for record in records.values()], ['Hailey', 'Kylie'])
+        self.assertEqual(self.database.manager.functions.get_by_id('1')['name'], 'Kendall')
+        self.assertEqual(len(self.database.manager.functions.filter_by_ids(['1', '3', '7'])), 2)
+
+    def test_invalid_mode(self):
+        with self.assertRaises(DatabaseError):
+            Database(path_or_url=TEST_DATABASE, mode='unknown')
+
+
+class TestShardedDatabase(unittest.TestCase):
+    def setUp(self):
+        with open(TEST_DATABASE, 'r', encoding='utf-8') as f:
+            database = json.load(f)
+        records = database.pop('data')
+
+        # Split the records of the test
+        # database in two shard files
+        self.directory = tempfile.mkdtemp()
+        for name, ids in [('database_1.json', ['1', '2']), ('database_2.json', ['3', '4'])]:
+            shard = {**database, 'data': {record_id: records[record_id] for record_id in ids}}
+            with open(os.path.join(self.directory, name), 'w', encoding='utf-8') as f:
+                json.dump(shard, f)
+
+        self.database = Database(import_name=os.path.join(self.directory, 'models.py'), shard_key='surname')
+        self.database.load_database()
+
+    def tearDown(self):
+        for shard in self.database.shards:
+            if shard.write_log is not None:
+                shard.write_log.close()
+        shutil.rmtree(self.directory)
+
+    def test_shards_are_loaded(self):
+        self.assertEqual(len(self.database.shards), 2)
+        self.assertEqual(self.database.record_ids, ['1', '2', '3', '4'])
+        self.assertEqual(self.database.model_name, 'Celebrity')
+        self.assertEqual(len(self.database.manager.all()), 4)
+
+    def test_writes_are_routed(self):
+        first = self.database.insert({'name': 'Kris', 'surname': 'Jenner'})
+        second = self.database.insert({'name': 'Kourtney', 'surname': 'Jenner'})
+        self.database.update('3', age=24)
+        self.database.delete('2')
+
+        # The same shard key always lands in the same shard
+        shard = self.database._shard_of[first]
+        self.assertIs(self.database._shard_of[second], shard)
+        self.assertIn(first, shard.record_ids)
+
+        reloaded = Database(import_name=os.path.join(self.directory, 'models.py'))
+        reloaded.load_database()
+        self.assertEqual(sorted(reloaded.record_ids), ['1', '3', '4', '5', '6'])
+        self.assertEqual(reloaded.get_record('3')['age'], 24)
+        for shard in reloaded.shards:
+            shard.write_log.close()
+
+    def test_compaction_per_shard(self):
+        self.database.insert({'name': 'Kris', 'surname': 'Jenner'})
+        timings = self.database.compact()
+        self.assertEqual(len(timings), 2)
+        self.assertEqual(len([timing for timing in timings if timing is not None]), 1)
+
+    def test_mmap_is_not_supported(self):
+        database = Database(import_name=os.path.join(self.directory, 'models.py'), mode='mmap')
+        with self.assertRaises(DatabaseError):
+            database.load_database()
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,4 +1,4 @@
-from django_no_sql.db.functions import Functions
+from django_no_sql.db.functions import F, Functions, Lookup
 import unittest
 from django_no_sql.db import errors
 
@@ -121,5 +121,51 @@ class TestFunctions(unittest.TestCase):
     def test_query_visually(self):
         print(self.functions.iterator(query=MULTIPLE_TEST_DATA, name='Kylie'))
 
+
+class TestLookup(unittest.TestCase):
+    def setUp(self):
+        self.functions = Functions()
+        self.functions.db_data = MULTIPLE_TEST_DATA
+
+    def test_compile(self):
+        lookup = Lookup('location__country__exact', 'USA')
+        self.assertEqual(lookup.path, ['location', 'country'])
+        self.assertEqual(lookup.lookup, 'exact')
+        self.assertTrue(lookup.predicate(MULTIPLE_TEST_DATA[0]))
+
+        lookup = Lookup('name__icontains', 'KEN')
+        self.assertTrue(lookup.predicate(MULTIPLE_TEST_DATA[0]))
+        self.assertFalse(lookup.predicate(MULTIPLE_TEST_DATA[1]))
+
+    def test_multiple_filters(self):
+        result = self.functions.iterator(query=MULTIPLE_TEST_DATA, surname='Jenner', age__lt=22)
+        self.assertEqual(result, [MULTIPLE_TEST_DATA[1]])
+
+    def test_falsy_values(self):
+        result = self.functions.iterator(query=[{'age': 0}, {'age': 1}], age=0)
+        self.assertEqual(result, [{'age': 0}])
+
+    def test_expressions_do_not_accumulate(self):
+        self.functions.iterator(query=MULTIPLE_TEST_DATA, name='Kendall')
+        result = self.functions.iterator(query=MULTIPLE_TEST_DATA, name='Kylie')
+        self.assertEqual(result, [MULTIPLE_TEST_DATA[1]])
+        self.assertEqual(self.functions.keys_dict, ['name'])
+
+    def test_regex(self):
+        result = self.functions.iterator(query=MULTIPLE_TEST_DATA, name__re=r'^Ky')
+        self.assertEqual(result, [MULTIPLE_TEST_DATA[1]])
+
+    def test_f_references_the_record(self):
+        records = [{'height': 178, 'width': 178}, {'height': 170, 'width': 160}]
+        result = self.functions.iterator(query=records, height__gt=F('width'))
+        self.assertEqual(result, [records[1]])
+
+    def test_errors(self):
+        with self.assertRaises(errors.SubDictError):
+            self.functions.iterator(query=MULTIPLE_TEST_DATA, location='USA')
+
+        with self.assertRaises(KeyError):
+            self.functions.iterator(query=MULTIPLE_TEST_DATA, location__address='USA')
+
 if __name__ == "__main__":
     unittest.main()
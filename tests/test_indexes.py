@@ -0,0 +1,302 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from django_no_sql.db.database import Database
+from django_no_sql.db.errors import DatabaseError
+from django_no_sql.db.functions import Functions
+from django_no_sql.db.managers import Manager
+from django_no_sql.db.operators import Q
+from django_no_sql.db.indexes import (CompositeIndex, HashIndex, SortedIndex,
+                                      literal_prefix, parse_search)
+from django_no_sql.db.planner import Planner
+from django_no_sql.db.storage import RecordStore
+
+TEST_DATABASE = os.path.join(os.path.dirname(__file__), 'database.json')
+
+RECORDS = [
+    {'name': 'Kendall', 'location': {'country': 'USA', 'state': 'California'}},
+    {'name': 'Hailey', 'location': {'country': 'USA', 'state': 'Arizona'}},
+    {'name': 'Kylie', 'location': {'country': 'USA', 'state': 'California'}},
+    {'name': 'Gigi', 'tags': ['model']}
+]
+
+
+class TestHashIndex(unittest.TestCase):
+    def setUp(self):
+        self.records = RecordStore(RECORDS, ['1', '2', '3', '4'])
+
+    def test_search(self):
+        index = HashIndex('location__state').build(self.records.items())
+        self.assertEqual(index.search('exact', 'California'), {'1', '3'})
+        self.assertEqual(index.search('in', ['Arizona', 'Texas']), {'2'})
+        self.assertEqual(index.search('exact', 'Texas'), set())
+        # Records without the field are not indexed
+        self.assertEqual(len(index), 2)
+
+    def test_unhashable_values(self):
+        index = HashIndex('tags').build(self.records.items())
+        self.assertEqual(len(index), 0)
+        self.assertIsNone(index.search('exact', ['model']))
+
+    def test_maintained_by_the_store(self):
+        index = self.records.create_index('location__state')
+        self.records.put('5', {'name': 'Bella', 'location': {'state': 'Arizona'}})
+        self.records.put('1', {'name': 'Kendall', 'location': {'state': 'Arizona'}})
+        self.records.delete('2')
+
+        self.assertEqual(index.search('exact', 'Arizona'), {'1', '5'})
+        self.assertEqual(index.search('exact', 'California'), {'3'})
+        self.assertEqual([record['name'] for record in self.records.select({'5', '1'})], ['Kendall', 'Bella'])
+
+    def test_same_behavior_as_a_scan(self):
+        def run(query):
+            try:
+                return [record['name'] for record in query]
+            except Exception as error:
+                return type(error)
+
+        records = [
+            {'name': 'Kendall', 'age': 20, 'location': {'state': 'California'}},
+            {'name': 'Hailey', 'age': 21, 'location': {'state': 'Arizona'}},
+            {'name': 'Kylie', 'age': 22, 'location': {'state': 'California'}},
+            {'name': 'Gigi', 'location': {'state': ['New York']}},
+            {'name': 'Bella', 'age': 'unknown', 'location': {'state': 'Texas'}}
+        ]
+        queries = [{'location__state': 'Arizona'}, {'age__gt': 20}, {'age': 22}]
+        for missing_age in [True, False]:
+            store = RecordStore([dict(record) for record in records], ['1', '2', '3', '4', '5'])
+            if not missing_age:
+                store[3]['age'] = 23
+            manager = Manager(query=store)
+            expected = [(run(manager.filter(**expressions)), run(manager.filter(~Q(**expressions)))) \
+                            for expressions in queries]
+
+            # The records without the field or with a value that
+            # cannot be indexed are still compared with the lookups
+            store.create_index('location__state')
+            store.create_index('age', kind='sorted')
+            self.assertFalse(store.indexes['age_sorted'].exact)
+            for expressions, (result, negated) in zip(queries, expected):
+                with self.subTest(expressions=expressions, missing_age=missing_age):
+                    self.assertEqual(run(manager.filter(**expressions)), result)
+                    self.assertEqual(run(manager.filter(~Q(**expressions))), negated)
+
+    def test_invalid_kind(self):
+        with self.assertRaises(DatabaseError):
+            self.records.create_index('name', kind='unknown')
+
+
+class TestSortedIndex(unittest.TestCase):
+    def setUp(self):
+        ages = [24, 23, 23, 22, 30, 'unknown']
+        self.records = RecordStore([{'age': age} for age in ages], ['1', '2', '3', '4', '5', '6'])
+        self.index = self.records.create_index('age', kind='sorted')
+
+    def test_ranges(self):
+        self.assertEqual(self.index.search_many([('gte', 23), ('lt', 30)]), {'1', '2', '3'})
+        self.assertEqual(self.index.search('gt', 23), {'1', '5'})
+        self.assertEqual(self.index.search('lte', 22), {'4'})
+        self.assertEqual(self.index.search('exact', 23), {'2', '3'})
+        # Values of another kind are not indexed
+        self.assertEqual(len(self.index), 5)
+        self.assertIsNone(self.index.search('gt', 'a'))
+
+    def test_maintained_by_the_store(self):
+        self.records.put('7', {'age': 25})
+        self.records.put('2', {'age': 40})
+        self.records.delete('5')
+        self.assertEqual(self.index.ordered_ids(), ['4', '3', '1', '7', '2'])
+        self.assertEqual(self.index.search('gt', 24), {'7', '2'})
+
+    def test_ties_keep_the_order_of_the_store(self):
+        ids = ['a', 'b', 'c', 'd', 'e']
+        records = RecordStore([{'name': name, 'age': age} for name, age in zip(ids, [23, 24, 23, 24, 23])], ids)
+        functions = Functions()
+        scanned = {field: [record['name'] for record in functions.order_by(field, query=list(records))] \
+                        for field in ['age', '-age']}
+        self.assertEqual(scanned['-age'], ['b', 'd', 'a', 'c', 'e'])
+
+        records.create_index('age', kind='sorted')
+        # An update moves the record to the end
+        # of its group in the index only
+        records.put('a', {'name': 'a', 'age': 23})
+        for field in ['age', '-age']:
+            with self.subTest(field=field):
+                indexed = [record['name'] for record in functions.order_by(field, query=records)]
+                self.assertEqual(indexed, scanned[field])
+
+
+class TestCompositeIndex(unittest.TestCase):
+    def setUp(self):
+        self.records = RecordStore(RECORDS, ['1', '2', '3', '4'])
+        self.index = self.records.create_index(['location__country', 'location__state'])
+
+    def test_prefix(self):
+        self.assertIsInstance(self.index, CompositeIndex)
+        self.assertEqual(self.index.search_prefix(['USA', 'California']), {'1', '3'})
+        self.assertEqual(self.index.search_prefix(['USA']), {'1', '2', '3'})
+        self.assertEqual(len(self.index), 2)
+
+    def test_maintained_by_the_store(self):
+        self.records.put('3', {'location': {'country': 'USA', 'state': 'Texas'}})
+        self.records.delete('1')
+        self.assertEqual(self.index.search_prefix(['USA', 'California']), set())
+        self.assertEqual(self.index.search_prefix(['USA', 'Texas']), {'3'})
+        self.assertTrue(self.records.drop_index(['location__country', 'location__state']))
+
+
+class TestTextIndex(unittest.TestCase):
+    def setUp(self):
+        cities = ['Los Angeles', 'Tucson', 'Los Alamos', 'New York', ['Paris']]
+        self.records = RecordStore([{'city': city} for city in cities], ['1', '2', '3', '4', '5'])
+        self.index = self.records.create_index('city', kind='text')
+
+    def test_parse_search(self):
+        self.assertEqual(parse_search('Los Angeles OR tucson'), [{'los', 'angeles'}, {'tucson'}])
+
+    def test_search(self):
+        # Records that are not strings are always returned
+        self.assertEqual(self.index.search('search', 'los'), {'1', '3', '5'})
+        self.assertEqual(self.index.search('search', 'los angeles OR york'), {'1', '4', '5'})
+
+    def test_contains(self):
+        self.assertEqual(self.index.search('icontains', 'os a'), {'1', '3', '5'})
+        self.assertEqual(self.index.search('contains', 'cso'), {'2', '5'})
+
+    def test_maintained_by_the_store(self):
+        self.records.put('2', {'city': 'Los Gatos'})
+        self.records.delete('1')
+        self.assertEqual(self.index.search('search', 'los'), {'2', '3', '5'})
+        self.assertEqual(self.index.search('search', 'tucson'), {'5'})
+
+
+class TestTrigramIndex(unittest.TestCase):
+    def setUp(self):
+        names = ['Kendall', 'Kylie', 'Hailey', 'Bella', None]
+        self.records = RecordStore([{'name': name} for name in names], ['1', '2', '3', '4', '5'])
+        self.index = self.records.create_index('name', kind='trigram')
+
+    def test_literal_prefix(self):
+        self.assertEqual(literal_prefix('^Kyl'), 'Kyl')
+        self.assertEqual(literal_prefix('Kyl?e'), 'Ky')
+        self.assertEqual(literal_prefix('Ky|Ha'), '')
+
+    def test_search(self):
+        self.assertEqual(self.index.search('contains', 'ell'), {'4', '5'})
+        self.assertEqual(self.index.search('startswith', 'k'), {'1', '2', '5'})
+        self.assertEqual(self.index.search('endswith', 'ley'), {'3', '5'})
+        self.assertEqual(self.index.search('iexact', 'BELLA'), {'4', '5'})
+        self.assertEqual(self.index.search('re', '^Ky.*'), {'2', '5'})
+        self.assertIsNone(self.index.search('re', '.*ie'))
+
+    def test_maintained_by_the_store(self):
+        self.records.put('2', {'name': 'Gigi'})
+        self.records.delete('5')
+        self.assertEqual(self.index.search('startswith', 'k'), {'1'})
+        self.assertEqual(self.index.search('contains', 'gig'), {'2'})
+
+
+class TestIndexedQueries(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'database.json')
+        shutil.copy(TEST_DATABASE, self.path)
+
+        self.database = Database(path_or_url=self.path)
+        self.database.load_database()
+        self.functions = self.database.manager.functions
+
+    def tearDown(self):
+        if self.database.write_log is not None:
+            self.database.write_log.close()
+        shutil.rmtree(self.directory)
+
+    def test_same_results_as_a_scan(self):
+        expected = self.functions.iterator(query=self.database.loaded_json_data, surname='Jenner', age__gt=22)
+        self.database.manager.create_index('surname')
+        result = self.functions.iterator(query=self.database.loaded_json_data, surname='Jenner', age__gt=22)
+        self.assertEqual(result, expected)
+        self.assertEqual([record['name'] for record in result], ['Kendall'])
+
+    def test_writes_update_the_index(self):
+        index = self.database.manager.create_index('location__state')
+        self.database.insert({'name': 'Selena', 'location': {'state': 'Texas'}})
+        self.database.update('2', location={'state': 'Texas'})
+        self.database.delete('1')
+
+        self.assertEqual(index.search('exact', 'Texas'), {'2', '5'})
+        result = self.functions.iterator(query=self.database.loaded_json_data, location__state__in=['Texas', 'California'])
+        self.assertEqual([record['name'] for record in result], ['Hailey', 'Kylie', 'Selena'])
+
+    def test_range_filters(self):
+        expected = self.functions.iterator(query=self.database.loaded_json_data, age__gte=23, age__lt=24)
+        self.database.manager.create_index('age', kind='sorted')
+        result = self.functions.iterator(query=self.database.loaded_json_data, age__gte=23, age__lt=24)
+        self.assertEqual(result, expected)
+        self.assertEqual([record['name'] for record in result], ['Hailey', 'Bella'])
+
+    def test_composite_filters(self):
+        # Enough records for the indexes
+        # to be cheaper than a scan
+        records = self.database.loaded_json_data
+        for i in range(500):
+            records.put(f'filler{i}', {'name': f'name{i}', 'surname': f'surname{i % 50}', 'age': i % 40,
+                                       'location': {'state': 'Arizona' if i % 2 else 'California'}})
+
+        expected = self.functions.iterator(query=records, surname='Jenner',
+                                           location__state='California', age__lt=24)
+        self.database.manager.create_index('surname')
+        index = self.database.manager.create_index(['surname', 'location__state'])
+        lookups = self.functions.compile(surname='Jenner', location__state='California', age__lt=24)
+        # The composite index answers both exact lookups
+        self.assertEqual([lookup.field for lookup in index.match(lookups)], ['surname', 'location__state'])
+        plan = Planner(records).plan(lookups)
+        self.assertEqual(plan.strategy, 'index')
+        self.assertIs(plan.indexes[0][0], index)
+        self.assertEqual([lookup.field for lookup in plan.predicates], ['age'])
+
+        result = self.functions.iterator(query=records, surname='Jenner',
+                                         location__state='California', age__lt=24)
+        self.assertEqual(result, expected)
+        self.assertEqual([record['name'] for record in result], ['Kylie'])
+        self.assertIs(self.functions.last_plan.indexes[0][0], index)
+
+    def test_text_filters(self):
+        data = self.database.loaded_json_data
+        expected_contains = self.functions.iterator(query=data, location__city__contains='Ang')
+        expected_icontains = self.functions.iterator(query=data, location__city__icontains='ucs')
+        expected_search = self.functions.iterator(query=data, location__city__search='los angeles OR tucson')
+
+        self.database.manager.create_index('location__city', kind='text')
+        self.assertEqual(self.functions.iterator(query=data, location__city__contains='Ang'), expected_contains)
+        self.assertEqual(self.functions.iterator(query=data, location__city__contains='ang'), [])
+        self.assertEqual(self.functions.iterator(query=data, location__city__icontains='ucs'), expected_icontains)
+        result = self.functions.iterator(query=data, location__city__search='los angeles OR tucson')
+        self.assertEqual(result, expected_search)
+        self.assertEqual([record['name'] for record in result], ['Kendall', 'Hailey', 'Kylie'])
+
+    def test_trigram_filters(self):
+        data = self.database.loaded_json_data
+        queries = [{'name__endswith': 'lie'}, {'surname__startswith': 'Jen'}, {'name__re': r'^K\w+'},
+                   {'location__state__icontains': 'ORN'}, {'name__iexact': 'bella'}]
+        expected = [self.functions.iterator(query=data, **query) for query in queries]
+        self.database.manager.create_index('name', kind='trigram')
+        self.database.manager.create_index('surname', kind='trigram')
+        self.database.manager.create_index('location__state', kind='trigram')
+        for query, records in zip(queries, expected):
+            with self.subTest(query=query):
+                self.assertEqual(self.functions.iterator(query=data, **query), records)
+                self.assertTrue(records)
+
+    def test_order_by(self):
+        expected = self.functions.order_by('-height', query=self.database.loaded_json_data)
+        self.database.manager.create_index('height', kind='sorted')
+        result = self.functions.order_by('-height', query=self.database.loaded_json_data)
+        self.assertEqual(result, expected)
+        self.assertEqual([record['height'] for record in result], [178, 175, 171, 168])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import json
+import math
+import unittest
+
+from django_no_sql.db import json_codecs
+
+TEST_DATA = {'name': 'Aurélie', 'details': {'age': 24, 'tags': ['a', 'b']}}
+
+
+class TestCodecs(unittest.TestCase):
+    def test_active_codec(self):
+        self.assertIn(json_codecs.active_codec(), json_codecs.available_codecs())
+        # The standard library is always available
+        # as the fallback codec
+        self.assertIn('json', json_codecs.available_codecs())
+
+    def test_round_trip(self):
+        for name in json_codecs.available_codecs():
+            with self.subTest(codec=name):
+                codec = json_codecs.select_codec(name)
+                self.assertEqual(codec.name, name)
+                self.assertEqual(codec.loads(codec.dumps(TEST_DATA)), TEST_DATA)
+                self.assertEqual(codec.loads(codec.dumps(TEST_DATA, pretty=True)), TEST_DATA)
+                self.assertNotIn('\n', codec.dumps(TEST_DATA))
+                self.assertIn('\n', codec.dumps(TEST_DATA, pretty=True))
+
+    def test_special_numbers(self):
+        # Written by the json module of the standard library
+        text = json.dumps({'nan': float('nan'), 'infinity': float('inf'), 'big': 123456789012345678901234567890,
+                           'negative': -9223372036854775809})
+        for name in json_codecs.available_codecs():
+            with self.subTest(codec=name):
+                codec = json_codecs.select_codec(name)
+                data = codec.loads(text)
+                self.assertTrue(math.isnan(data['nan']))
+                self.assertEqual(data['infinity'], float('inf'))
+                self.assertEqual(data['big'], 123456789012345678901234567890)
+                self.assertEqual(data['negative'], -9223372036854775809)
+                self.assertIsInstance(data['big'], int)
+                self.assertEqual(codec.loads(text.encode('utf-8'))['big'], 123456789012345678901234567890)
+                self.assertEqual(codec.loads('{"large": 1e400}')['large'], float('inf'))
+
+                written = codec.loads(codec.dumps(data))
+                self.assertTrue(math.isnan(written['nan']))
+                self.assertEqual(written['infinity'], float('inf'))
+                self.assertEqual(written['big'], 123456789012345678901234567890)
+                self.assertEqual(codec.loads(codec.dumps({'value': None})), {'value': None})
+
+    def test_decode_error(self):
+        with self.assertRaises(ValueError):
+            json_codecs.loads('{"name": ')
+
+    def test_unavailable_codec(self):
+        with self.assertRaises(ValueError):
+            json_codecs.select_codec('unknown')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,12 @@
+import os
+import shutil
+import tempfile
 import unittest
 
 from django_no_sql.db import aggregates
+from django_no_sql.db.cache import ResultCache
 from django_no_sql.db.database import Database
+from django_no_sql.db.errors import DatabaseError
 from django_no_sql.db.managers import Manager
 
 
@@ -110,6 +115,164 @@ class TestManager(unittest.TestCase):
         pass
 
 
+class TestLazyQuerySet(unittest.TestCase):
+    def setUp(self):
+        records = [{'name': f'name{i}', 'age': i % 30, 'height': 160 + i % 20} for i in range(1000)]
+        self.manager = Manager(query=records)
+
+    def test_operations_are_lazy(self):
+        queryset = self.manager.filter(age__gte=20).filter(height__lt=170).include('name')
+        self.assertIsNone(queryset.functions.last_plan)
+
+        records = list(queryset[:5])
+        self.assertEqual(records, [{'name': 'name20'}, {'name': 'name21'}, {'name': 'name22'},
+                                   {'name': 'name23'}, {'name': 'name24'}])
+        # The filters run together in a single
+        # pass which stops once the slice is full
+        plan = queryset[:5].explain()
+        self.assertEqual(plan.strategy, 'scan')
+        self.assertEqual(len(plan.predicates), 2)
+        self.assertEqual(plan.rows, 5)
+
+    def test_querysets_are_independent(self):
+        adults = self.manager.filter(age__gte=18)
+        young = self.manager.filter(age__lt=18)
+        self.assertEqual(len(adults) + len(young), 1000)
+        self.assertEqual(self.manager.count(), 1000)
+
+    def test_slices(self):
+        queryset = self.manager.filter(age=3)
+        self.assertEqual(queryset[1]['name'], 'name33')
+        self.assertEqual([record['name'] for record in queryset[1:10][1:3]], ['name63', 'name93'])
+        self.assertEqual(queryset.order_by('-height')[0]['height'], 173)
+        with self.assertRaises(DatabaseError):
+            queryset[:2].filter(name='name3')
+
+    def test_iterator(self):
+        queryset = self.manager.filter(age__gte=25).exclude('height')
+        iterator = queryset.iterator(chunk_size=10)
+        self.assertEqual(next(iterator), {'name': 'name25', 'age': 25})
+        # The records are not kept by the queryset
+        self.assertIsNone(queryset._result_cache)
+
+        records = [record['name'] for record in queryset[:12].iterator(chunk_size=5)]
+        self.assertEqual(records, [record['name'] for record in queryset[:12]])
+        self.assertEqual(len(list(queryset.iterator(chunk_size=7))), len(queryset))
+        with self.assertRaises(ValueError):
+            queryset.iterator(chunk_size=0)
+
+    def test_batch(self):
+        queries = {
+            'old': {'age__gte': 25},
+            'old_and_tall': {'age__gte': 25, 'height__gte': 175},
+            'name': {'name': 'name3'},
+            'nothing': {'age': 40}
+        }
+        results = self.manager.batch(queries)
+        self.assertEqual(list(results), list(queries))
+        for name, expressions in queries.items():
+            with self.subTest(query=name):
+                self.assertEqual(results[name], list(self.manager.filter(**expressions)))
+
+        # The filters of the queryset apply to each query
+        results = self.manager.filter(height__lt=165).batch({'old': {'age__gte': 25}})
+        self.assertEqual(results['old'], list(self.manager.filter(height__lt=165, age__gte=25)))
+
+    def test_first_and_last(self):
+        self.assertEqual(self.manager.filter(age=29).first()['name'], 'name29')
+        self.assertEqual(self.manager.filter(age=29).last()['name'], 'name989')
+        # An empty queryset is returned instead of None
+        empty = self.manager.filter(age=40).first()
+        self.assertFalse(empty)
+        self.assertEqual(list(empty.filter(age=3)), [])
+        self.assertEqual(list(self.manager.filter(age=40).last()), [])
+
+    def test_first_after_evaluation(self):
+        queryset = self.manager.filter(age__gte=1)
+        expected = list(queryset)
+        self.assertEqual(queryset.first(), expected[0])
+        self.assertEqual(list(queryset[:2]), expected[:2])
+
+        queryset = self.manager.filter(age=29)
+        self.assertEqual(len(queryset), 33)
+        self.assertEqual(queryset.first()['name'], 'name29')
+        self.assertEqual(queryset.last()['name'], 'name989')
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'database.json')
+        shutil.copy(os.path.join(os.path.dirname(__file__), 'database.json'), self.path)
+        self.database = Database(path_or_url=self.path)
+        self.database.load_database()
+        self.manager = self.database.manager
+
+    def tearDown(self):
+        if self.database.write_log is not None:
+            self.database.write_log.close()
+        shutil.rmtree(self.directory)
+
+    def test_repeated_queries(self):
+        first = list(self.manager.filter(surname='Jenner', age__gt=22))
+        # The order and the spelling of the
+        # filters do not change the query
+        second = list(self.manager.filter(age__gt=22).filter(surname__exact='Jenner'))
+        self.assertEqual(first, second)
+        self.assertEqual(self.manager.cache.stats['hits'], 1)
+        self.assertEqual(self.manager.cache.stats['hit_ratio'], 0.5)
+
+    def test_invalidated_on_writes(self):
+        self.assertEqual(len(self.manager.filter(surname='Jenner')), 2)
+        self.database.insert({'name': 'Kris', 'surname': 'Jenner'})
+        self.assertEqual(len(self.manager.filter(surname='Jenner')), 3)
+        self.assertEqual(self.manager.cache.stats['invalidations'], 1)
+        self.assertEqual(self.manager.cache.stats['hits'], 0)
+
+    def test_evaluated_manager_sees_writes(self):
+        count = len(self.manager)
+        first = self.manager.first()
+        self.database.insert({'name': 'Kris', 'surname': 'Jenner'})
+        self.assertEqual(len(self.manager), count + 1)
+        self.assertEqual(self.manager.first(), first)
+        self.assertEqual(self.manager.last()['name'], 'Kris')
+
+    def test_explain_cached_query(self):
+        list(self.manager.filter(surname='Jenner'))
+        queryset = self.manager.filter(surname='Jenner')
+        self.assertEqual(len(queryset), 2)
+        self.assertEqual(self.manager.cache.stats['hits'], 1)
+
+        plan = queryset.explain()
+        self.assertIsNotNone(plan)
+        self.assertEqual(plan.rows, 2)
+
+    def test_results_are_copies(self):
+        records = self.manager.get(name='Kendall')
+        records.append({'name': 'Kendall'})
+        self.assertEqual(len(self.manager.get(name='Kendall')), 1)
+
+        projected = list(self.manager.filter(surname='Jenner').include('name'))
+        projected[0]['name'] = 'Kris'
+        names = [record['name'] for record in self.manager.filter(surname='Jenner').include('name')]
+        self.assertNotIn('Kris', names)
+        self.assertEqual(self.manager.cache.stats['hits'], 2)
+
+    def test_eviction(self):
+        cache = ResultCache(max_entries=2)
+        cache.set('a', 1, [1])
+        cache.set('b', 1, [2])
+        cache.get('a', 1)
+        cache.set('c', 1, [3])
+        self.assertIsNone(cache.get('b', 1))
+        self.assertEqual(cache.get('a', 1), [1])
+        self.assertEqual(cache.stats['evictions'], 1)
+
+        cache = ResultCache(max_bytes=ResultCache.size_of([1]))
+        cache.set('a', 1, [1])
+        cache.set('b', 1, [2])
+        self.assertEqual(len(cache), 1)
+
 
 if __name__ == "__main__":
     suite = unittest.TestSuite()
@@ -0,0 +1,176 @@
+import unittest
+from unittest import mock
+
+from django_no_sql.db.functions import Lookup
+from django_no_sql.db import parallel
+from django_no_sql.db.parallel import chunk_bounds, parallel_filter
+from django_no_sql.db.planner import FieldStatistics, Planner, PredicateFilter
+from django_no_sql.db.storage import RecordStore
+
+COUNTRIES = ['USA', 'France', 'Italy', 'Spain']
+
+
+def make_records(count=2000):
+    records = [{'name': f'name{i}', 'age': i % 50, 'country': COUNTRIES[i % 4],
+                'group': i % 40} for i in range(count)]
+    return RecordStore(records, [str(i) for i in range(count)])
+
+
+def compile_lookups(**expressions):
+    return [Lookup(expression, value) for expression, value in expressions.items()]
+
+
+class TestFieldStatistics(unittest.TestCase):
+    def setUp(self):
+        self.records = make_records()
+
+    def test_cardinality(self):
+        self.assertEqual(FieldStatistics('country', self.records).cardinality, 4)
+        # Nearly unique fields are scaled
+        # to the number of records
+        self.assertEqual(FieldStatistics('name', self.records).cardinality, 2000)
+
+    def test_selectivity(self):
+        statistics = FieldStatistics('age', self.records)
+        self.assertEqual(statistics.selectivity('exact', 10), 1 / 50)
+        self.assertAlmostEqual(statistics.selectivity('gte', 49), 0)
+        self.assertAlmostEqual(statistics.selectivity('lt', 49), 1)
+        self.assertEqual(statistics.selectivity('in', [1, 2]), 2 / 50)
+
+
+class TestPredicateFilter(unittest.TestCase):
+    def setUp(self):
+        self.records = list(make_records())
+
+    def test_reordered_on_observed_selectivity(self):
+        # The regular expression is expected to be selective
+        # but keeps every record which is only known once
+        # the records are compared
+        lookups = compile_lookups(name__re='^name', age__ne=3)
+        predicate_filter = PredicateFilter(lookups, [0.1, 0.95], reorder_every=100)
+        self.assertEqual(predicate_filter.expressions, ['name__re', 'age__ne'])
+
+        matches = predicate_filter.filter(self.records)
+        self.assertEqual(predicate_filter.expressions, ['age__ne', 'name__re'])
+        self.assertEqual(matches, [record for record in self.records if record['age'] != 3])
+        self.assertEqual(predicate_filter.stats['name__re']['pass_rate'], 1)
+
+    def test_stops_at_the_first_false_predicate(self):
+        compared = []
+
+        def compare(value):
+            compared.append(value)
+            return value
+
+        lookups = compile_lookups(age=0, name__startswith='name1')
+        lookups[1].predicate = lambda record: compare(record['name'])
+        matches = PredicateFilter(lookups, [0.02, 0.5]).filter(self.records[:100])
+        self.assertEqual(len(matches), 2)
+        self.assertEqual(len(compared), 2)
+
+
+class TestPlanner(unittest.TestCase):
+    def setUp(self):
+        self.records = make_records()
+
+    def test_scan_without_indexes(self):
+        lookups = compile_lookups(age__gte=10, country='France')
+        plan = Planner(self.records).plan(lookups)
+        self.assertEqual(plan.strategy, 'scan')
+        # The most selective lookup is compared first
+        self.assertEqual([lookup.field for lookup in plan.predicates], ['country', 'age'])
+
+    def test_index(self):
+        self.records.create_index('name')
+        lookups = compile_lookups(name='name10', age__gte=10)
+        plan = Planner(self.records).plan(lookups)
+        self.assertEqual(plan.strategy, 'index')
+        self.assertEqual([lookup.field for lookup in plan.predicates], ['age'])
+        self.assertEqual([record['name'] for record in plan.execute(self.records)], ['name10'])
+
+    def test_intersection(self):
+        self.records.create_index('age')
+        self.records.create_index('group')
+        lookups = compile_lookups(age=10, group=10, country='Italy')
+        plan = Planner(self.records).plan(lookups)
+        self.assertEqual(plan.strategy, 'intersection')
+        self.assertEqual(len(plan.indexes), 2)
+
+        expected = [record for record in self.records
+                        if record['age'] == 10 and record['group'] == 10 and record['country'] == 'Italy']
+        self.assertEqual(plan.execute(self.records), expected)
+
+    def test_unselective_index_is_not_used(self):
+        self.records.create_index('country')
+        plan = Planner(self.records).plan(compile_lookups(country__in=COUNTRIES))
+        self.assertEqual(plan.strategy, 'scan')
+
+    def test_explain(self):
+        self.records.create_index('age', kind='sorted')
+        plan = Planner(self.records).plan(compile_lookups(age__gte=45, country='USA'))
+        self.assertNotIn('Stages', plan.explain())
+
+        plan.execute(self.records)
+        text = plan.explain()
+        self.assertIn('index age_sorted', text)
+        self.assertIn('estimated', text)
+        self.assertIn('actual', text)
+
+
+class TestParallelScan(unittest.TestCase):
+    def setUp(self):
+        self.records = list(make_records())
+
+    def test_chunk_bounds(self):
+        self.assertEqual(chunk_bounds(10, 3), [(0, 4), (4, 7), (7, 10)])
+        self.assertEqual(chunk_bounds(2, 4), [(0, 1), (1, 2)])
+
+    def test_same_results_as_a_scan(self):
+        lookups = compile_lookups(age__gte=40, country='Spain', name__contains='7')
+        expected = [record for record in self.records if all(lookup.predicate(record) for lookup in lookups)]
+        self.assertEqual(parallel_filter(self.records, lookups, workers=2), expected)
+
+    def test_threshold(self):
+        lookups = compile_lookups(age__gte=40, country='Spain')
+        plan = Planner(self.records).plan(lookups)
+        plan.workers = 2
+        plan.parallel_threshold = 1000
+        self.assertTrue(plan.use_processes(self.records, lookups))
+        self.assertEqual(len(plan.execute(self.records)), 100)
+        self.assertEqual(plan.stages[-1]['name'], 'parallel filter')
+        # Smaller scans and scans with a limit stay serial
+        self.assertFalse(plan.use_processes(self.records[:999], lookups))
+        self.assertFalse(plan.use_processes(self.records, lookups, limit=10))
+
+    def test_serial_by_default(self):
+        lookups = compile_lookups(age__gte=40, country='Spain')
+        plan = Planner(self.records).plan(lookups)
+        plan.parallel_threshold = 1000
+        self.assertFalse(plan.use_processes(self.records, lookups))
+
+    def test_without_fork(self):
+        lookups = compile_lookups(age__gte=40, country='Spain')
+        plan = Planner(self.records).plan(lookups)
+        plan.workers = 2
+        plan.parallel_threshold = 1000
+        with mock.patch.object(parallel.multiprocessing, 'get_all_start_methods', return_value=['spawn']):
+            self.assertFalse(plan.use_processes(self.records, lookups))
+            self.assertEqual(len(parallel_filter(self.records, lookups, workers=2)), 100)
+
+    def test_pool_is_reused(self):
+        records = make_records()
+        pool = parallel.ScanPool()
+        self.addCleanup(pool.close)
+        expressions = [('age__gte', 40), ('country', 'Spain')]
+        self.assertEqual(len(pool.filter(records, expressions, 2)), 100)
+        self.assertEqual(len(pool.filter(records, [('age', 3)], 2)), 40)
+        self.assertEqual(pool.created, 1)
+
+        # A write forks new processes with the new records
+        records.put('2000', {'name': 'name2000', 'age': 45, 'country': 'Spain', 'group': 0})
+        self.assertEqual(len(pool.filter(records, expressions, 2)), 101)
+        self.assertEqual(pool.created, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import json
+import os
+import unittest
+
+from django_no_sql.db.database import Database
+from django_no_sql.db.storage import MappedRecords, RecordStore
+
+TEST_DATABASE = os.path.join(os.path.dirname(__file__), 'database.json')
+
+
+class TestRecordStore(unittest.TestCase):
+    def setUp(self):
+        self.records = RecordStore([{'name': 'Kendall'}, {'name': 'Hailey'}, {'name': 'Bella'}], ['1', '2', '3'])
+
+    def test_access(self):
+        self.assertEqual(self.records[0], {'name': 'Kendall'})
+        self.assertEqual(self.records.get('2'), {'name': 'Hailey'})
+        self.assertEqual(self.records.get(3), {'name': 'Bella'})
+        self.assertIsNone(self.records.get('4'))
+
+    def test_in_bulk(self):
+        records = self.records.in_bulk(['3', '10', 1])
+        self.assertEqual(list(records.keys()), ['3', '1'])
+        self.assertEqual(records['1'], {'name': 'Kendall'})
+
+    def test_put_and_delete(self):
+        self.records.put('4', {'name': 'Kylie'})
+        self.records.put('2', {'name': 'Selena'})
+        self.assertTrue(self.records.delete('1'))
+        self.assertFalse(self.records.delete('1'))
+
+        self.assertEqual(self.records.ids, ['2', '3', '4'])
+        self.assertEqual(self.records.position('4'), 2)
+        self.assertEqual(self.records.get('2'), {'name': 'Selena'})
+        self.assertEqual(list(self.records), [{'name': 'Selena'}, {'name': 'Bella'}, {'name': 'Kylie'}])
+
+
+class TestMappedRecords(unittest.TestCase):
+    def setUp(self):
+        with open(TEST_DATABASE, 'r', encoding='utf-8') as f:
+            self.expected = json.load(f)
+        self.records = MappedRecords(TEST_DATABASE)
+
+    def tearDown(self):
+        self.records.close()
+
+    def test_index(self):
+        self.assertEqual(len(self.records), len(self.expected['data']))
+        self.assertEqual(self.records.ids, list(self.expected['data'].keys()))
+
+    def test_access(self):
+        self.assertEqual(self.records[0], self.expected['data']['1'])
+        self.assertEqual(self.records[-1], self.expected['data']['4'])
+        self.assertEqual(self.records.get('2'), self.expected['data']['2'])
+        self.assertIsNone(self.records.get('10'))
+        self.assertEqual(list(self.records), list(self.expected['data'].values()))
+
+    def test_in_bulk(self):
+        records = self.records.in_bulk(['4', '2', '10'])
+        self.assertEqual(list(records.keys()), ['4', '2'])
+        self.assertEqual(records['2'], self.expected['data']['2'])
+
+    def test_schema(self):
+        self.assertNotIn('data', self.records.schema)
+        self.assertEqual(self.records.schema['properties'], self.expected['properties'])
+
+
+class TestMappedDatabase(unittest.TestCase):
+    def setUp(self):
+        self.database = Database(path_or_url=TEST_DATABASE, mode='mmap')
+        self.database.load_database()
+
+    def test_query(self):
+        self.database.manager.functions.reset_new_queryset()
+        records = self.database.manager.functions.iterator(name='Hailey')
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['surname'], 'Baldwin')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from django_no_sql.db import backends
+from django_no_sql.db.database import Database
+from django_no_sql.db.errors import DatabaseError
+from django_no_sql.db.wal import WriteAheadLog
+
+TEST_DATABASE = os.path.join(os.path.dirname(__file__), 'database.json')
+
+
+class TestWriteAheadLog(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'database.json')
+        shutil.copy(TEST_DATABASE, self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_append_and_replay(self):
+        log = WriteAheadLog(self.path)
+        log.append('insert', record_id=5, record={'name': 'Selena'})
+        log.append('delete', record_id=5)
+        log.close()
+
+        entries = list(log.entries())
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(entries[0], {'op': 'insert', 'id': '5', 'record': {'name': 'Selena'}})
+
+    def test_partial_entry_is_ignored(self):
+        log = WriteAheadLog(self.path)
+        log.append('delete', record_id=1)
+        log.close()
+        with open(log.path, 'a', encoding='utf-8') as f:
+            f.write('{"op": "delete", "id"')
+        self.assertEqual(len(list(log.entries())), 1)
+
+    def test_group_commit(self):
+        log = WriteAheadLog(self.path, commit_window=0.05)
+        threads = [
+            threading.Thread(target=log.append, args=['delete'], kwargs={'record_id': i})
+            for i in range(20)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        log.close()
+
+        self.assertEqual(len(list(log.entries())), 20)
+        self.assertEqual(log.committed_entries, 20)
+        # Writers arriving within the commit window
+        # share a single write and fsync
+        self.assertLess(log.commits, 20)
+
+    def test_single_writer_does_not_wait(self):
+        log = WriteAheadLog(self.path, commit_window=0.05)
+        with mock.patch('django_no_sql.db.wal.time.sleep') as sleep:
+            for i in range(5):
+                log.append('delete', record_id=i)
+        log.close()
+        sleep.assert_not_called()
+        self.assertEqual(log.commits, 5)
+
+    def test_failed_write_is_not_applied(self):
+        database = Database(path_or_url=self.path)
+        database.load_database()
+        with mock.patch('django_no_sql.db.wal.os.fsync', side_effect=OSError('disk full')):
+            with self.assertRaises(DatabaseError):
+                database.insert({'name': 'Selena'})
+            with self.assertRaises(DatabaseError):
+                database.update('1', age=25)
+        self.assertIsNone(database.get_record('5'))
+        self.assertNotEqual(database.get_record('1').get('age'), 25)
+        self.assertEqual(list(database.record_ids), ['1', '2', '3', '4'])
+
+        # The id of the failed insert is used again
+        self.assertEqual(database.insert({'name': 'Selena'}), '5')
+        self.assertEqual(database.get_record('5')['name'], 'Selena')
+        database.write_log.close()
+
+    def test_database_writes(self):
+        with open(self.path, 'rb') as f:
+            original = f.read()
+
+        database = Database(path_or_url=self.path)
+        database.load_database()
+        record_id = database.insert({'name': 'Selena', 'surname': 'Gomez'})
+        database.update('1', age=25)
+        database.delete('2')
+        database.write_log.close()
+
+        self.assertEqual(record_id, '5')
+        # The JSON file itself is never rewritten
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), original)
+
+        for mode in ['memory', 'stream', 'mmap']:
+            with self.subTest(mode=mode):
+                reloaded = Database(path_or_url=self.path, mode=mode)
+                reloaded.load_database()
+                self.assertEqual(list(reloaded.record_ids), ['1', '3', '4', '5'])
+                self.assertEqual(reloaded.get_record('1')['age'], 25)
+                self.assertEqual(reloaded.get_record('5')['name'], 'Selena')
+                self.assertIsNone(reloaded.get_record('2'))
+                reloaded.write_log.close()
+
+
+class TestCompaction(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'database.json')
+        shutil.copy(TEST_DATABASE, self.path)
+
+        self.database = Database(path_or_url=self.path)
+        self.database.load_database()
+
+    def tearDown(self):
+        if self.database.compactor is not None:
+            self.database.compactor.stop()
+        self.database.write_log.close()
+        shutil.rmtree(self.directory)
+
+    def test_compact(self):
+        self.database.insert({'name': 'Selena'})
+        self.database.delete('1')
+        timing = self.database.compact()
+
+        self.assertEqual(timing['records'], 4)
+        self.assertEqual(self.database.write_log.size, 0)
+        self.assertFalse(os.path.exists(self.database.write_log.compacting_path))
+
+        with open(self.path, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+        self.assertEqual(list(snapshot['data'].keys()), ['2', '3', '4', '5'])
+        self.assertEqual(snapshot['version'], 2)
+        self.assertEqual(snapshot['title'], 'Celebrity')
+        self.assertEqual(self.database.compactor.stats['runs'], 1)
+
+        # Nothing left to compact
+        self.assertIsNone(self.database.compact())
+
+    def test_timing(self):
+        write_database = backends.write_database
+
+        def slow_write(*args, **kwargs):
+            time.sleep(0.05)
+            return write_database(*args, **kwargs)
+
+        self.database.insert({'name': 'Selena'})
+        before = datetime.datetime.now()
+        with mock.patch('django_no_sql.db.wal.backends.write_database', side_effect=slow_write):
+            timing = self.database.compact()
+        started_on = datetime.datetime.fromisoformat(timing['started_on'])
+        self.assertGreaterEqual(timing['duration'], 0.05)
+        # The start is taken before the work
+        self.assertLess(started_on - before, datetime.timedelta(seconds=0.05))
+
+    @unittest.skipIf(os.name == 'nt', 'The permissions of the files are POSIX ones')
+    def test_permissions_are_kept(self):
+        os.chmod(self.path, 0o640)
+        self.database.insert({'name': 'Selena'})
+        self.database.compact()
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o640)
+
+    def test_background_compaction(self):
+        compactor = self.database.start_compaction(max_bytes=1, interval=0.01)
+        self.database.insert({'name': 'Selena'})
+        for _ in range(200):
+            if compactor.runs:
+                break
+            time.sleep(0.01)
+        self.assertEqual(compactor.runs, 1)
+        self.assertIsNotNone(compactor.stats['last_duration'])
+
+
+if __name__ == "__main__":
+    unittest.main()